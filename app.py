@@ -1,6 +1,9 @@
 import os
+import re
+import secrets
 import tempfile
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 
 from flask import (
     Flask,
@@ -10,22 +13,36 @@ from flask import (
     redirect,
     render_template,
     request,
+    Response,
     send_from_directory,
     url_for,
 )
 from werkzeug.utils import secure_filename
 
 import database
+import database_async
+import dates
+import duplicates
+import metrics
+import money
+import ocr_admission
 import ocr_handler
+import outbox
+import profiling
 import storage_handler
+import vendors
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "change-me")
-app.config["UPLOAD_FOLDER"] = os.path.join(os.path.dirname(__file__), "uploads")
+app.config["UPLOAD_FOLDER"] = os.getenv("UPLOAD_FOLDER", os.path.join(os.path.dirname(__file__), "uploads"))
 app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB max file size
 
 ALLOWED_EXTENSIONS = {"pdf", "jpg", "jpeg", "png", "tiff", "tif"}
 
+# OCR text is parked here between /api/ocr and the upload form post
+OCR_TEXT_DIR = os.getenv("OCR_TEXT_DIR", os.path.join(tempfile.gettempdir(), "invoice-ocr-text"))
+OCR_TEXT_TTL_SECONDS = 24 * 3600
+
 # Create uploads directory with error handling
 try:
     os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -54,18 +71,18 @@ def get_mime_type(filename: str) -> str:
 
 
 # ========== 辅助函数 ==========
-def calculate_payment_status(total_amount: float, paid_amount: float) -> str:
-    """根据 total_amount 和 paid_amount 计算付款状态"""
-    if paid_amount == 0:
+def calculate_payment_status(total_cents: int, paid_cents: int) -> str:
+    """根据 total_cents 和 paid_cents (整数分) 计算付款状态"""
+    if paid_cents == 0:
         return "unpaid"
-    elif paid_amount >= total_amount:
+    elif paid_cents >= total_cents:
         return "paid"
     else:
         return "partial"
 
-def calculate_remaining_amount(total_amount: float, paid_amount: float, credit: float = 0.0) -> float:
-    """计算剩余应付金额 = total_amount - paid_amount - credit"""
-    return max(0.0, total_amount - paid_amount - credit)
+def calculate_remaining_amount(total_cents: int, paid_cents: int, credit_cents: int = 0) -> int:
+    """计算剩余应付金额(分) = total_cents - paid_cents - credit_cents"""
+    return max(0, total_cents - paid_cents - credit_cents)
 
 def get_payment_status_badge(status: str) -> str:
     """返回付款状态的 Bootstrap 徽章 HTML"""
@@ -79,29 +96,40 @@ def get_payment_status_badge(status: str) -> str:
 # 注册为 Jinja2 过滤器
 app.jinja_env.filters['payment_status_badge'] = get_payment_status_badge
 app.jinja_env.filters['calculate_remaining'] = calculate_remaining_amount
+app.jinja_env.filters['cents'] = money.format_cents
 
 
 def format_date_english(date_string):
-    """Format date string to English format (e.g., 'November 5, 2025')."""
-    if not date_string:
-        return ""
-    try:
-        # Try to parse various date formats
-        for fmt in ["%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d"]:
-            try:
-                date_obj = datetime.strptime(date_string, fmt)
-                return date_obj.strftime("%B %d, %Y")
-            except ValueError:
-                continue
-        # If no format matched, return original
-        return date_string
-    except Exception:
-        return date_string
+    """Format date string to English format (e.g., 'November 5, 2025').
+
+    Rows loaded from the database already carry ``<field>_display``; this
+    filter is for ad-hoc values and hits the parse cache for repeats.
+    """
+    return dates.display_date(date_string)
 
 
 # Register custom Jinja2 filter
 app.jinja_env.filters['format_date'] = format_date_english
 
+# Per-route latency for /metrics; registered first so the other hooks are timed too
+app.before_request(metrics.start_request)
+app.after_request(metrics.record_response)
+app.teardown_request(metrics.finish_request)
+metrics.track_lru_cache("parse_date", dates.parse_date)
+# Slow-request logs and sampled stack profiles (PROFILE_* settings; off by default)
+profiling.init_app(app)
+
+# Drain queued side effects (file deletes) in a background thread per worker process
+app.before_request(outbox.ensure_worker)
+
+# fitz, OpenCV and the Supabase/psycopg clients load on first use. With gunicorn
+# --preload (GUNICORN_PRELOAD=true in start.sh) the master can import them once
+# instead, and the forked workers share them copy-on-write.
+if os.getenv("PRELOAD_HEAVY_MODULES", "false").strip().lower() in ("true", "1", "yes"):
+    ocr_handler.preload_modules()
+    storage_handler.preload_modules()
+    database.preload_modules()
+
 
 @app.route('/health')
 def health_check():
@@ -109,16 +137,21 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "service": "invoice-management-system",
-        "backend": database.get_backend()
+        "backend": database.current_backend()
     }), 200
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint; merges the metrics of every worker on this host."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # 付款历史包装函数
 def create_payment_record(data):
     """创建付款历史记录"""
     try:
-        backend = database._get_backend()
-        return backend.create_payment_record(data)
+        return database.create_payment_record(data)
     except Exception as e:
         print(f"Error creating payment record: {e}")
         import traceback
@@ -128,8 +161,7 @@ def create_payment_record(data):
 def get_payment_history(invoice_id):
     """获取付款历史"""
     try:
-        backend = database._get_backend()
-        return backend.get_payment_history(invoice_id)
+        return database.get_payment_history(invoice_id)
     except Exception as e:
         print(f"Error getting payment history: {e}")
     return []
@@ -221,6 +253,8 @@ def test_ocr_endpoint():
 
 @app.route('/')
 def index():
+    q = (request.args.get('q') or '').strip()
+    vendor_id = request.args.get('vendor', type=int)
     company_name = (request.args.get('companyName') or '').strip()
     invoice_number = (request.args.get('invoiceNumber') or '').strip()
     date_from = (request.args.get('startDate') or '').strip()
@@ -252,6 +286,8 @@ def index():
                 invoice_number=invoice_number or None,
                 date_from=date_from or None,
                 date_to=date_to or None,
+                q=q or None,
+                vendor_id=vendor_id,
             )
         except Exception as exc:
             flash(f"Failed to load invoices: {exc}", 'danger')
@@ -261,6 +297,8 @@ def index():
         'index.html',
         invoices=invoices,
         filters={
+            "q": q,
+            "vendor": vendor_id,
             "companyName": company_name,
             "invoiceNumber": invoice_number,
             "startDate": date_from,
@@ -278,7 +316,6 @@ def upload():
         entered_by = request.form.get('enteredBy')
         notes = request.form.get('notes')
         credit_raw = request.form.get('credit', '0.00')
-        credit_raw = request.form.get('credit', '0.00')
         file = request.files.get('invoiceFile')
 
         missing_fields = [
@@ -295,18 +332,28 @@ def upload():
             return redirect(url_for('upload'))
 
         try:
-            total_amount = float(total_amount_raw.replace(',', ''))
-            credit = float(credit_raw.replace(',', '')) if credit_raw else 0.00
-        except (TypeError, ValueError):
+            total_cents = money.to_cents(total_amount_raw)
+            credit_cents = money.to_cents(credit_raw) if credit_raw else 0
+        except ValueError:
             flash("Total Amount and Credit must be numbers (example: 1234.56).", 'danger')
             return redirect(url_for('upload'))
 
+        try:
+            invoice_date = dates.normalize_date(invoice_date)
+        except ValueError:
+            flash("Invoice Date is invalid. Use YYYY-MM-DD.", 'danger')
+            return redirect(url_for('upload'))
+
         stored_filename = None
+        pdf_sha256 = None
         if file and file.filename:
             if not allowed_file(file.filename):
                 flash("Supported file types: PDF, JPEG, PNG, TIFF", 'danger')
                 return redirect(url_for('upload'))
 
+            pdf_sha256 = duplicates.file_sha256(file.read())
+            file.seek(0)
+
             # Check if Supabase Storage is enabled
             if storage_handler.should_use_storage():
                 # Upload to Supabase Storage
@@ -335,25 +382,102 @@ def upload():
             "invoice_date": invoice_date,
             "invoice_number": invoice_number,
             "company_name": company_name,
-            "total_amount": total_amount,
+            "total_cents": total_cents,
             "entered_by": entered_by,
             "notes": notes,
             "pdf_path": stored_filename,
-            "credit": credit,
-            "paid_amount": 0.00,
+            "credit_cents": credit_cents,
+            "paid_cents": 0,
+            "pdf_sha256": pdf_sha256,
         }
+        invoice_record["ocr_text"], ocr_incomplete = _take_ocr_text(request.form.get('ocrToken', ''))
+
+        # Checked before the insert so the new invoice does not match itself
+        matches = _find_duplicates(invoice_record)
 
         try:
-            database.create_invoice(invoice_record)
+            created = database.create_invoice(invoice_record)
         except Exception as exc:
             flash(f"Failed to save invoice: {exc}", 'danger')
             return redirect(url_for('upload'))
 
+        # OCR ran out of time or only read the field regions; read the whole file again in the background
+        if ocr_incomplete and stored_filename:
+            outbox.enqueue_ocr_reprocess(created["id"], stored_filename, app.config["UPLOAD_FOLDER"])
+
         flash("Invoice saved successfully.", 'success')
+        for warning in duplicates.duplicate_warnings(matches):
+            flash(warning, 'warning')
         return redirect(url_for('index'))
 
     return render_template('upload.html')
 
+def _find_duplicates(candidate):
+    """Possible duplicates of ``candidate``; a failed lookup never blocks an upload."""
+    try:
+        return database.find_duplicates(candidate)
+    except Exception as exc:
+        print(f"Duplicate check failed: {exc}")
+        return []
+
+
+def _store_ocr_text(text: str, incomplete: bool = False):
+    """Park OCR text until the upload form is posted; returns the token the form sends back.
+
+    ``incomplete`` marks text from an OCR run that timed out on some pages.
+    """
+    if not text.strip() and not incomplete:
+        return None
+    os.makedirs(OCR_TEXT_DIR, exist_ok=True)
+    cutoff = time.time() - OCR_TEXT_TTL_SECONDS
+    for entry in os.scandir(OCR_TEXT_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+    token = secrets.token_hex(16)
+    with open(os.path.join(OCR_TEXT_DIR, f"{token}.txt"), "w", encoding="utf-8") as handle:
+        handle.write(text)
+    if incomplete:
+        open(os.path.join(OCR_TEXT_DIR, f"{token}.incomplete"), "w").close()
+    return token
+
+
+def _take_ocr_text(token: str):
+    """Return and discard the OCR text parked under ``token`` and whether it is incomplete.
+
+    Unknown or expired tokens give ``(None, False)``.
+    """
+    if not re.fullmatch(r"[0-9a-f]{32}", token or ""):
+        return None, False
+    path = os.path.join(OCR_TEXT_DIR, f"{token}.txt")
+    marker = os.path.join(OCR_TEXT_DIR, f"{token}.incomplete")
+    try:
+        with open(path, encoding="utf-8") as handle:
+            text = handle.read()
+        os.remove(path)
+    except OSError:
+        return None, False
+    incomplete = os.path.exists(marker)
+    if incomplete:
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
+    return text or None, incomplete
+
+
+def _ocr_timeout_warning(timed_out):
+    if not timed_out:
+        return []
+    pages = ", ".join(str(page) for page in timed_out)
+    return [
+        f"OCR ran out of time on page(s) {pages}; the details shown come from the rest of the file. "
+        "The full text will be read again in the background after you save."
+    ]
+
+
 @app.route('/api/ocr', methods=['POST'])
 def api_ocr():
     file = request.files.get('invoiceFile')
@@ -366,14 +490,38 @@ def api_ocr():
     # Get file extension for temp file
     ext = file.filename.rsplit(".", 1)[1].lower() if "." in file.filename else "pdf"
 
+    file_data = file.read()
+    pdf_sha256 = duplicates.file_sha256(file_data)
     with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as temp_file:
         temp_path = temp_file.name
-        file.save(temp_path)
+        temp_file.write(file_data)
 
+    ocr_token = None
+    timed_out = []
     try:
-        data, warnings = ocr_handler.extract_invoice_data(temp_path)
+        # Waits for (or is refused) a share of the host-wide OCR memory budget
+        with ocr_admission.admit(ocr_admission.estimate_memory_mb(temp_path)):
+            # Bounded by OCR_PAGE_TIMEOUT / OCR_DOCUMENT_TIMEOUT so gunicorn never kills the worker
+            text, timed_out, regions_only = ocr_handler.extract_text_within_budget(temp_path)
+        # Keep the text for full-text search even if no fields can be detected; text that is
+        # missing pages or only covers the field regions is completed in the background
+        ocr_token = _store_ocr_text(text, incomplete=bool(timed_out) or regions_only)
+        data, warnings = ocr_handler.parse_invoice_text(text, ocr_handler.extract_layout_fields(temp_path))
     except ValueError as exc:
-        return jsonify(success=False, message=str(exc)), 422
+        # No fields to compare, but an identical file can still be flagged
+        matches = _find_duplicates({"pdf_sha256": pdf_sha256})
+        return jsonify(
+            success=False,
+            message=str(exc),
+            ocr_token=ocr_token,
+            warnings=_ocr_timeout_warning(timed_out) + duplicates.duplicate_warnings(matches),
+            duplicates=matches,
+        ), 422
+    except ocr_admission.Saturated as exc:
+        response = jsonify(success=False, message="OCR is busy right now. Please try again shortly.")
+        response.status_code = 429
+        response.headers['Retry-After'] = str(exc.retry_after)
+        return response
     except Exception as exc:
         return jsonify(success=False, message=f"Failed to read PDF: {exc}"), 500
     finally:
@@ -382,7 +530,28 @@ def api_ocr():
         except OSError:
             pass
 
-    return jsonify(success=True, data=data, warnings=warnings)
+    matches = _find_duplicates(dict(data, pdf_sha256=pdf_sha256))
+    warnings = _ocr_timeout_warning(timed_out) + warnings + duplicates.duplicate_warnings(matches)
+    return jsonify(success=True, data=data, warnings=warnings, ocr_token=ocr_token, duplicates=matches)
+
+@app.route('/api/ocr/stats')
+def api_ocr_stats():
+    """OCR admission queue depth, memory budget usage and wait times."""
+    return jsonify(success=True, stats=ocr_admission.stats())
+
+@app.route('/api/vendors')
+def api_vendors():
+    """Vendor name suggestions for autocomplete, served from the in-memory prefix index."""
+    prefix = (request.args.get('prefix') or '').strip()
+    limit = min(request.args.get('limit', default=vendors.MAX_SUGGESTIONS, type=int), vendors.MAX_SUGGESTIONS)
+    try:
+        matches = vendors.get_index(database.list_vendors).search(prefix, limit)
+    except Exception as exc:
+        return jsonify(success=False, message=f"Failed to load vendors: {exc}"), 500
+
+    response = jsonify(success=True, vendors=matches)
+    response.headers['Cache-Control'] = "private, max-age=60"
+    return response
 
 @app.route('/files/<path:filename>')
 def download_invoice(filename: str):
@@ -402,8 +571,14 @@ def download_invoice(filename: str):
             abort(404)
         return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
 
+def _form_version():
+    """The invoice version a form was rendered with (its hidden ``version`` field), if it sent one."""
+    raw = (request.form.get('version') or '').strip()
+    return int(raw) if raw.isdigit() else None
+
+
 @app.route('/edit/<int:invoice_id>', methods=['GET', 'POST'])
-def edit_invoice(invoice_id: int):
+async def edit_invoice(invoice_id: int):
     if request.method == 'POST':
         invoice_date = request.form.get('invoiceDate')
         invoice_number = request.form.get('invoiceNumber')
@@ -427,108 +602,185 @@ def edit_invoice(invoice_id: int):
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
 
         try:
-            total_amount = float(total_amount_raw.replace(',', ''))
-            credit = float(credit_raw.replace(',', '')) if credit_raw else 0.00
-        except (TypeError, ValueError):
+            total_cents = money.to_cents(total_amount_raw)
+            credit_cents = money.to_cents(credit_raw) if credit_raw else 0
+        except ValueError:
             flash("Total Amount must be a number (example: 1234.56).", 'danger')
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
 
+        try:
+            invoice_date = dates.normalize_date(invoice_date)
+        except ValueError:
+            flash("Invoice Date is invalid. Use YYYY-MM-DD.", 'danger')
+            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+
         invoice_data = {
             "invoice_date": invoice_date,
             "invoice_number": invoice_number,
             "company_name": company_name,
-            "total_amount": total_amount,
+            "total_cents": total_cents,
             "entered_by": entered_by,
             "notes": notes,
-            "credit": credit,
+            "credit_cents": credit_cents,
         }
 
         try:
-            result = database.update_invoice(invoice_id, invoice_data)
+            result = database.update_invoice(invoice_id, invoice_data, expected_version=_form_version())
             if result:
                 flash("Invoice updated successfully.", 'success')
                 return redirect(url_for('index'))
             else:
                 flash("Invoice not found.", 'danger')
                 return redirect(url_for('index'))
+        except database.VersionConflictError:
+            # Someone saved or paid this invoice after the form was loaded: show what is stored now
+            invoice, payment_history = await database_async.get_invoice_with_history(invoice_id)
+            if not invoice:
+                flash("Invoice not found.", 'danger')
+                return redirect(url_for('index'))
+            flash(
+                "This invoice was changed by someone else while you were editing it. "
+                "Your changes were not saved; review the current values and save again.",
+                'warning',
+            )
+            return render_template('edit.html', invoice=invoice, payment_history=payment_history), 409
         except Exception as exc:
             flash(f"Failed to update invoice: {exc}", 'danger')
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
 
-    # GET request - load existing invoice data
-    invoices = database.get_invoices()
-    invoice = next((inv for inv in invoices if inv['id'] == invoice_id), None)
+    # GET request - load existing invoice data and its payment history concurrently
+    invoice, payment_history = await database_async.get_invoice_with_history(invoice_id)
 
     if not invoice:
         flash("Invoice not found.", 'danger')
         return redirect(url_for('index'))
 
-    # 获取付款历史
-    payment_history = get_payment_history(invoice_id)
     return render_template('edit.html', invoice=invoice, payment_history=payment_history)
 
 @app.route('/delete/<int:invoice_id>', methods=['POST'])
 def delete_invoice(invoice_id: int):
     try:
-        # Get invoice to check if it has a PDF file
-        invoices = database.get_invoices()
-        invoice = next((inv for inv in invoices if inv['id'] == invoice_id), None)
-
-        if not invoice:
+        if not database.get_invoice(invoice_id):
             flash("Invoice not found.", 'danger')
             return redirect(url_for('index'))
 
-        # Delete from database
-        success = database.delete_invoice(invoice_id)
+        # Same path as a bulk delete, so the proofs of every recorded payment go too
+        files = database.bulk_delete([invoice_id])
 
-        if success:
-            # Try to delete the PDF file if it exists
-            if invoice.get('pdf_path'):
-                if storage_handler.should_use_storage():
-                    # Delete from Supabase Storage
-                    try:
-                        storage_handler.delete_file(invoice['pdf_path'])
-                    except Exception as exc:
-                        # Log error but don't fail the deletion
-                        print(f"Failed to delete file from storage: {exc}")
-                else:
-                    # Delete from local storage
-                    try:
-                        file_path = os.path.join(app.config["UPLOAD_FOLDER"], invoice['pdf_path'])
-                        if os.path.isfile(file_path):
-                            os.remove(file_path)
-                    except OSError as exc:
-                        # Log error but don't fail the deletion
-                        print(f"Failed to delete local file: {exc}")
-
-            flash("Invoice deleted successfully.", 'success')
-        else:
-            flash("Failed to delete invoice.", 'danger')
+        # Files are removed by the outbox worker so storage latency or
+        # failures never block the request; failed deletes are retried.
+        outbox.enqueue_file_deletes(files, app.config["UPLOAD_FOLDER"])
+        flash("Invoice deleted successfully.", 'success')
     except Exception as exc:
         flash(f"Error deleting invoice: {exc}", 'danger')
 
     return redirect(url_for('index'))
 
+def _bulk_invoice_ids():
+    """Reads invoice ids from a JSON body (``invoice_ids``) or repeated form fields."""
+    if request.is_json:
+        raw_ids = (request.get_json(silent=True) or {}).get('invoice_ids') or []
+    else:
+        raw_ids = request.form.getlist('invoice_ids')
+    try:
+        return [int(value) for value in raw_ids]
+    except (TypeError, ValueError):
+        return None
+
+
+def _bulk_field(name: str) -> str:
+    if request.is_json:
+        return str((request.get_json(silent=True) or {}).get(name) or '').strip()
+    return (request.form.get(name) or '').strip()
+
+
+def _bulk_response(success: bool, message: str, status: int = 200, **extra):
+    """JSON clients get a JSON body; the index page form gets a flash + redirect."""
+    if request.is_json:
+        return jsonify(success=success, message=message, **extra), status
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('index'))
+
+
+@app.route('/bulk/mark_paid', methods=['POST'])
+def bulk_mark_paid():
+    """Mark many invoices as fully paid (one payment record each for the remaining balance)."""
+    invoice_ids = _bulk_invoice_ids()
+    if not invoice_ids:
+        return _bulk_response(False, "Please select at least one invoice.", 400)
+
+    try:
+        payment_date = dates.normalize_date(_bulk_field('paymentDate') or datetime.now().date())
+    except ValueError:
+        return _bulk_response(False, "Payment date is invalid. Use YYYY-MM-DD.", 400)
+
+    try:
+        updated = database.bulk_mark_paid(invoice_ids, payment_date)
+    except Exception as exc:
+        return _bulk_response(False, f"Failed to mark invoices as paid: {exc}", 500)
+    return _bulk_response(True, f"{updated} invoice(s) marked as paid.", updated=updated)
+
+
+@app.route('/bulk/credit', methods=['POST'])
+def bulk_update_credit():
+    """Set the same credit amount on many invoices."""
+    invoice_ids = _bulk_invoice_ids()
+    if not invoice_ids:
+        return _bulk_response(False, "Please select at least one invoice.", 400)
+
+    try:
+        credit_cents = money.to_cents(_bulk_field('credit'))
+    except ValueError:
+        return _bulk_response(False, "Credit must be a valid number.", 400)
+
+    try:
+        updated = database.bulk_update_credit(invoice_ids, credit_cents)
+    except Exception as exc:
+        return _bulk_response(False, f"Failed to update credit: {exc}", 500)
+    return _bulk_response(True, f"Credit updated on {updated} invoice(s).", updated=updated)
+
+
+@app.route('/bulk/delete', methods=['POST'])
+def bulk_delete():
+    """Delete many invoices; their files are removed in batches by the outbox worker."""
+    invoice_ids = _bulk_invoice_ids()
+    if not invoice_ids:
+        return _bulk_response(False, "Please select at least one invoice.", 400)
+
+    try:
+        files = database.bulk_delete(invoice_ids)
+    except Exception as exc:
+        return _bulk_response(False, f"Failed to delete invoices: {exc}", 500)
+
+    outbox.enqueue_file_deletes(files, app.config["UPLOAD_FOLDER"])
+    return _bulk_response(True, f"{len(invoice_ids)} invoice(s) deleted.", deleted=len(invoice_ids))
+
+
 @app.route('/stats')
-def stats():
-    return render_template('stats.html')
+async def stats():
+    """Spending totals, summed as integer cents by the database (the three ranges concurrently)."""
+    today = datetime.now().date()
+    week_start = today - timedelta(days=today.weekday())
+    try:
+        totals = await database_async.get_totals_many({
+            "week": (week_start.isoformat(), today.isoformat()),
+            "month": (today.replace(day=1).isoformat(), today.isoformat()),
+            "all": (None, None),
+        })
+    except Exception as exc:
+        flash(f"Failed to load statistics: {exc}", 'danger')
+        totals = None
+    return render_template('stats.html', totals=totals)
 
 @app.route('/upload_payment/<int:invoice_id>', methods=['POST'])
 def upload_payment_proof(invoice_id: int):
     """上传付款凭证并记录实付金额(支持部分付款)或更新 Credit"""
-    # 1. 获取发票信息
-    invoices = database.get_invoices()
-    invoice = next((inv for inv in invoices if inv['id'] == invoice_id), None)
-    if not invoice:
-        flash("Invoice not found.", 'danger')
-        return redirect(url_for('index'))
-    
-    # 2. 接收表单数据
+    # 1. 接收表单数据
     paid_amount_raw = request.form.get('paidAmount', '').strip()
     payment_date = request.form.get('paymentDate', '').strip()
     credit_raw = request.form.get('credit', '').strip()
     
-    # 3. 判断是更新 Credit 还是记录付款
+    # 2. 判断是更新 Credit 还是记录付款
     has_payment = bool(paid_amount_raw)
     has_credit_update = bool(credit_raw)
     
@@ -536,45 +788,38 @@ def upload_payment_proof(invoice_id: int):
         flash("Please enter either a payment amount or update the credit.", 'warning')
         return redirect(url_for('edit_invoice', invoice_id=invoice_id))
     
-    update_data = {}
-    
-    # 4. 处理 Credit 更新
+    # 3. 处理 Credit 更新
+    credit_cents = None
     if has_credit_update:
         try:
-            credit = float(credit_raw.replace(',', ''))
-            update_data['credit'] = credit
-        except (TypeError, ValueError):
+            credit_cents = money.to_cents(credit_raw)
+        except ValueError:
             flash("Credit must be a valid number.", 'danger')
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
     
-    # 5. 处理付款
+    # 4. 处理付款
+    stored_filename = None
     if has_payment:
         if not payment_date:
             flash("Payment date is required when recording a payment.", 'danger')
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+        try:
+            payment_date = dates.normalize_date(payment_date)
+        except ValueError:
+            flash("Payment date is invalid. Use YYYY-MM-DD.", 'danger')
+            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
         
         try:
-            new_payment = float(paid_amount_raw.replace(',', ''))
-            if new_payment <= 0:
+            payment_cents = money.to_cents(paid_amount_raw)
+            if payment_cents <= 0:
                 flash("Paid amount must be greater than 0.", 'danger')
                 return redirect(url_for('edit_invoice', invoice_id=invoice_id))
-        except (TypeError, ValueError):
+        except ValueError:
             flash("Paid amount must be a valid number.", 'danger')
             return redirect(url_for('edit_invoice', invoice_id=invoice_id))
         
-        # 累加已付金额
-        current_paid = invoice.get('paid_amount', 0.00)
-        total_paid = current_paid + new_payment
-        total_amount = invoice.get('total_amount', 0.00)
-        
-        # 防止超额支付
-        if total_paid > total_amount:
-            flash(f"Total paid amount (${total_paid:.2f}) cannot exceed total amount (${total_amount:.2f}).", 'danger')
-            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
-        
         # 处理付款凭证文件上传(可选)
         payment_file = request.files.get('paymentProof')
-        stored_filename = invoice.get('payment_proof_path')
         
         if payment_file and payment_file.filename:
             if not allowed_file(payment_file.filename):
@@ -602,51 +847,47 @@ def upload_payment_proof(invoice_id: int):
             except Exception as exc:
                 flash(f"Error uploading payment proof: {exc}", 'danger')
                 return redirect(url_for('edit_invoice', invoice_id=invoice_id))
-        
-        # 自动计算付款状态
-        new_status = calculate_payment_status(total_amount, total_paid)
-        
-        # 添加付款相关更新
-        update_data.update({
-            'paid_amount': total_paid,
-            'payment_status': new_status,
-            'payment_date': payment_date,
-        })
-        if stored_filename:
-            update_data['payment_proof_path'] = stored_filename
     
-    # 6. 更新数据库
+    # 5. 更新数据库: 付款在一个事务内完成累加、超额检查、状态计算和历史记录
     try:
-        result = database.update_invoice(invoice_id, update_data)
+        if has_payment:
+            result = database.apply_payment(
+                invoice_id,
+                payment_cents,
+                payment_date,
+                payment_proof_path=stored_filename,
+                credit_cents=credit_cents,
+                notes=f'Payment of ${money.format_cents(payment_cents)}',
+                # A credit rides along with the payment, so it is checked against the form's version too
+                expected_version=_form_version() if has_credit_update else None,
+            )
+        else:
+            result = database.update_invoice(invoice_id, {'credit_cents': credit_cents}, expected_version=_form_version())
+
         if result:
-            # 创建付款历史记录(如果有付款)
-            if has_payment:
-                try:
-                    create_payment_record({
-                        'invoice_id': invoice_id,
-                        'payment_amount': new_payment,
-                        'payment_date': payment_date,
-                        'payment_proof_path': stored_filename,
-                        'notes': f'Payment of ${new_payment:.2f}'
-                    })
-                    print(f"✅ Payment record created: ${new_payment:.2f}")
-                except Exception as e:
-                    print(f"⚠️ Failed to create payment record: {e}")
-            
             messages = []
             if has_credit_update:
-                messages.append(f"Credit updated: ${update_data.get('credit', 0):.2f}")
+                messages.append(f"Credit updated: ${money.format_cents(credit_cents)}")
             if has_payment:
                 status_text = {
                     'unpaid': 'Unpaid',
                     'partial': 'Partial',
                     'paid': 'Paid'
-                }.get(update_data.get('payment_status', ''), '')
-                messages.append(f"Payment recorded: ${update_data['paid_amount']:.2f}, Status: {status_text}")
+                }.get(result.get('payment_status', ''), '')
+                messages.append(f"Payment recorded: ${money.format_cents(result['paid_cents'])}, Status: {status_text}")
             
             flash(" | ".join(messages), 'success')
         else:
+            outbox.enqueue_file_deletes([stored_filename], app.config["UPLOAD_FOLDER"])
             flash("Invoice not found.", 'danger')
+            return redirect(url_for('index'))
+    except database.OverpaymentError as exc:
+        # The proof was uploaded for a payment that was rejected
+        outbox.enqueue_file_deletes([stored_filename], app.config["UPLOAD_FOLDER"])
+        flash(str(exc), 'danger')
+    except database.VersionConflictError:
+        outbox.enqueue_file_deletes([stored_filename], app.config["UPLOAD_FOLDER"])
+        flash("This invoice was changed by someone else; nothing was recorded. Please try again.", 'warning')
     except Exception as exc:
         flash(f"Error updating invoice: {exc}", 'danger')
     
@@ -673,29 +914,13 @@ def download_payment_proof(filename: str):
 def mark_unpaid(invoice_id: int):
     """Mark an invoice as unpaid and remove payment proof."""
     try:
-        # Get invoice to check if it has a payment proof file
-        invoices = database.get_invoices()
-        invoice = next((inv for inv in invoices if inv['id'] == invoice_id), None)
+        # Get invoice to find its payment proof file
+        invoice = database.get_invoice(invoice_id)
 
         if not invoice:
             flash("Invoice not found.", 'danger')
             return redirect(url_for('index'))
 
-        # Delete payment proof file if it exists
-        if invoice.get('payment_proof_path'):
-            if storage_handler.should_use_storage():
-                try:
-                    storage_handler.delete_file(invoice['payment_proof_path'])
-                except Exception as exc:
-                    print(f"Failed to delete payment proof from storage: {exc}")
-            else:
-                try:
-                    file_path = os.path.join(app.config["UPLOAD_FOLDER"], invoice['payment_proof_path'])
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                except OSError as exc:
-                    print(f"Failed to delete local payment proof file: {exc}")
-
         # Update invoice status
         update_data = {
             "payment_status": "unpaid",
@@ -703,22 +928,17 @@ def mark_unpaid(invoice_id: int):
             "payment_date": None,
         }
 
-        result = database.update_invoice(invoice_id, update_data)
+        # Conditional on the version read above, so a proof attached meanwhile is not deleted unseen
+        result = database.update_invoice(invoice_id, update_data, expected_version=invoice.get('version'))
         if result:
-            # 创建付款历史记录(如果有付款)
-            if has_payment:
-                create_payment_record({
-                    'invoice_id': invoice_id,
-                    'payment_amount': new_payment,
-                    'payment_date': payment_date,
-                    'payment_proof_path': stored_filename,
-                    'notes': f'Payment of ${new_payment:.2f}'
-                })
-            
+            # Remove the payment proof file in the background
+            outbox.enqueue_file_deletes([invoice.get('payment_proof_path')], app.config["UPLOAD_FOLDER"])
             flash("Invoice marked as unpaid.", 'success')
         else:
             flash("Failed to update invoice.", 'danger')
 
+    except database.VersionConflictError:
+        flash("This invoice was changed by someone else; it was not marked as unpaid. Please try again.", 'warning')
     except Exception as exc:
         flash(f"Error updating invoice: {exc}", 'danger')
 
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+HTTP load test of the Flask routes on a local gunicorn instance.
+
+    python benchmarks/bench_http.py [--sizes 1000 100000 1000000] [--workers 1 2 4] [--threads 4]
+                                    [--mix default] [--concurrency 8] [--duration 30]
+                                    [--storage local|supabase] [--json result.json]
+
+For every dataset size a SQLite database is seeded with that many invoices
+(spread over VENDOR_COUNT vendors, each with OCR text for the search index) and
+cached under ``--data-dir`` (a million rows take about a minute and 500 MB
+the first time). Each run then works on a fresh copy, so the rows one run
+writes never reach the next. The app runs under gunicorn exactly as in the
+Procfile, with the SQLite backend and either local uploads or, with
+``--storage supabase``, a stand-in for the Supabase Storage API that keeps
+objects in memory (``--stub-latency-ms`` adds a network round trip).
+
+Clients keep one connection each and pick requests from a weighted mix (see
+MIXES) of ``/`` (listing, vendor and date filters), ``/?q=`` (search),
+``/edit/<id>``, ``/files/<path>``, ``/api/ocr`` (a text-layer PDF, so no
+Tesseract is needed), ``/upload`` and ``/upload_payment/<id>``. Redirects are
+not followed. Per route the report gives requests/s, p50/p95/p99 latency,
+errors (5xx or no answer) and 429s. Run it across worker counts to size
+``--workers`` and across sizes to see how listing cost grows with the table.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import corpus  # noqa: E402
+
+VENDOR_COUNT = 2000
+SEED_FILES = 50
+SEED_BATCH = 10000
+
+MIXES = {
+    # A team working through the backlog: mostly reading, some entry
+    "default": {"index": 30, "search": 10, "edit": 25, "files": 15, "api_ocr": 8, "upload": 7, "upload_payment": 5},
+    # Month-end review: listing, searching and opening invoices
+    "browse": {"index": 45, "search": 20, "edit": 25, "files": 10},
+    # Data entry: every upload is preceded by an OCR call
+    "entry": {"index": 15, "edit": 20, "api_ocr": 25, "upload": 25, "upload_payment": 15},
+}
+ROUTE_LABELS = {
+    "index": "/",
+    "search": "/?q=",
+    "edit": "/edit/<id>",
+    "files": "/files/<path>",
+    "api_ocr": "/api/ocr",
+    "upload": "/upload",
+    "upload_payment": "/upload_payment/<id>",
+}
+
+PREFIXES = ["Acme", "Northwind", "Blue Harbor", "Summit", "Greenfield", "Redwood", "Silverline", "Pioneer"]
+INDUSTRIES = ["Supplies", "Logistics", "Packaging", "Office Products", "Technical Services", "Trading"]
+SUFFIXES = ["Inc", "LLC", "Ltd", "Corp", "Co"]
+SEARCH_TERMS = ["bearings", "toner", "freight", "logistics", "packaging", "summit", "pioneer", "lease"]
+
+
+# ---------------------------------------------------------------------------
+# Dataset
+# ---------------------------------------------------------------------------
+
+def vendor_name(number: int) -> str:
+    return (
+        f"{PREFIXES[number % len(PREFIXES)]} {INDUSTRIES[number // len(PREFIXES) % len(INDUSTRIES)]}"
+        f" {number:04d} {SUFFIXES[number % len(SUFFIXES)]}"
+    )
+
+
+def invoice_pdf(number: int) -> bytes:
+    """A one-page text-layer invoice, as uploaded by most users."""
+    rng = random.Random(number)
+    truth = {"invoice_number": f"LT-{number:07d}", "invoice_date": "2025-03-14", "company_name": vendor_name(number % VENDOR_COUNT)}
+    return corpus._layout(rng, truth, 1).tobytes()
+
+
+def seed(path: Path, count: int) -> None:
+    """Creates the schema through the app's own backend, then bulk-inserts ``count`` invoices."""
+    import database
+    import duplicates
+    import vendors
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.SQLiteBackend().engine.dispose()
+
+    rng = random.Random(count)
+    first_day = date(2021, 1, 1).toordinal()
+    with sqlite3.connect(path) as conn:
+        names = [vendor_name(number) for number in range(VENDOR_COUNT)]
+        conn.executemany(
+            "INSERT INTO vendors (id, name, normalized_key) VALUES (?, ?, ?)",
+            [(number + 1, name, vendors.normalize_vendor(name)) for number, name in enumerate(names)],
+        )
+        for start in range(0, count, SEED_BATCH):
+            rows = []
+            for number in range(start + 1, min(count, start + SEED_BATCH) + 1):
+                vendor = rng.randrange(VENDOR_COUNT)
+                day = first_day + rng.randrange(1500)
+                invoice_number = f"INV-{number:07d}"
+                total_cents = rng.randrange(1000, 5_000_000)
+                paid_cents = rng.choice((0, 0, total_cents, total_cents // 2))
+                status = "paid" if paid_cents == total_cents else ("partial" if paid_cents else "unpaid")
+                text = (
+                    f"{names[vendor]} Invoice Number {invoice_number} "
+                    f"{' '.join(rng.sample(corpus.PRODUCTS, 3))} Total {total_cents / 100:.2f}"
+                )
+                rows.append((
+                    date.fromordinal(day).isoformat(), day, invoice_number,
+                    duplicates.normalize_invoice_number(invoice_number), names[vendor], vendor + 1,
+                    total_cents, "loadtest", rng.choice(SEARCH_TERMS) if rng.random() < 0.2 else None,
+                    f"seed_{number % SEED_FILES:03d}.pdf", status, 0, paid_cents, text,
+                ))
+            conn.executemany(
+                """
+                INSERT INTO invoices (
+                    invoice_date, invoice_day, invoice_number, invoice_number_key, company_name, vendor_id,
+                    total_cents, entered_by, notes, pdf_path, payment_status, credit_cents, paid_cents,
+                    payment_count, ocr_text
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+                """,
+                rows,
+            )
+            conn.commit()
+            print(f"  seeded {min(count, start + SEED_BATCH):,}/{count:,}", end="\r", flush=True)
+    print()
+
+
+def seeded_database(data_dir: Path, count: int) -> Path:
+    path = data_dir / f"seed-{count}.db"
+    if not path.exists():
+        print(f"Seeding {count:,} invoices into {path}")
+        partial = path.with_suffix(".partial")
+        partial.unlink(missing_ok=True)
+        seed(partial, count)
+        partial.rename(path)
+    return path
+
+
+def seed_files() -> Dict[str, bytes]:
+    return {f"seed_{number:03d}.pdf": invoice_pdf(number) for number in range(SEED_FILES)}
+
+
+# ---------------------------------------------------------------------------
+# Supabase Storage stand-in
+# ---------------------------------------------------------------------------
+
+class _StorageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self) -> None:
+        body = self._body()
+        key = self.path.split("?")[0].removeprefix("/storage/v1/object/")
+        if key.startswith("list/"):
+            self._reply(200, b"[]")
+            return
+        self.server.objects[key] = body
+        self._reply(200, json.dumps({"Key": key, "Id": str(uuid.uuid4())}).encode())
+
+    do_PUT = do_POST
+
+    def do_GET(self) -> None:
+        key = self.path.split("?")[0].removeprefix("/storage/v1/object/public/")
+        data = self.server.objects.get(key)
+        if data is None:
+            self._reply(404, b'{"statusCode": "404", "error": "not_found", "message": "Object not found"}')
+        else:
+            self._reply(200, data, "application/pdf")
+
+    def do_DELETE(self) -> None:
+        bucket = self.path.split("?")[0].removeprefix("/storage/v1/object/").strip("/")
+        removed = []
+        for name in json.loads(self._body() or b"{}").get("prefixes", []):
+            if self.server.objects.pop(f"{bucket}/{name}", None) is not None:
+                removed.append({"name": name})
+        self._reply(200, json.dumps(removed).encode())
+
+
+class StorageStub(ThreadingHTTPServer):
+    """The parts of the Supabase Storage API storage_handler uses, with objects kept in memory."""
+
+    daemon_threads = True
+
+    def __init__(self, latency_ms: float) -> None:
+        super().__init__(("127.0.0.1", 0), _StorageHandler)
+        self.latency = latency_ms / 1000
+        self.objects: Dict[str, bytes] = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+# ---------------------------------------------------------------------------
+# App server
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(run_dir: Path, port: int, workers: int, threads: int, storage: Optional[StorageStub]) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DATA_BACKEND="sqlite",
+        DATABASE_URL=f"sqlite:///{run_dir / 'invoices.db'}",
+        UPLOAD_FOLDER=str(run_dir / "uploads"),
+        OUTBOX_DATABASE_PATH=str(run_dir / "outbox.db"),
+        OCR_TEXT_DIR=str(run_dir / "ocr-text"),
+        OCR_ADMISSION_DIR=str(run_dir / "admission"),
+        SECRET_KEY="load-test",
+    )
+    env.pop("OCR_SERVICE_SOCKET", None)
+    if storage:
+        env.update(SUPABASE_URL=storage.url, SUPABASE_KEY="load-test-key", USE_SUPABASE_STORAGE="true")
+    else:
+        env.pop("USE_SUPABASE_STORAGE", None)
+
+    log = open(run_dir / "gunicorn.log", "wb")
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "--chdir", str(ROOT),
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--threads", str(threads),
+            "--timeout", "300", "--log-level", "warning", "app:app",
+        ],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                break
+        except OSError:
+            pass
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise SystemExit(f"App did not start; see {run_dir / 'gunicorn.log'}")
+        time.sleep(0.2)
+    return process
+
+
+# ---------------------------------------------------------------------------
+# Load
+# ---------------------------------------------------------------------------
+
+def _multipart(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/pdf\r\n\r\n".encode()
+        )
+        body.write(data + b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+class Workload:
+    """Builds the requests of the mix; one instance is shared by all clients."""
+
+    def __init__(self, size: int, files: Dict[str, bytes]) -> None:
+        self.size = size
+        self.file_names = sorted(files)
+        self.pdf = invoice_pdf(size)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _next_number(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def index(self, rng: random.Random):
+        roll = rng.random()
+        if roll < 0.15:
+            return "GET", f"/?vendor={rng.randint(1, VENDOR_COUNT)}", None, {}
+        if roll < 0.3:
+            start = date(2021, 1, 1).toordinal() + rng.randrange(1400)
+            return "GET", f"/?startDate={date.fromordinal(start)}&endDate={date.fromordinal(start + 30)}", None, {}
+        return "GET", "/", None, {}
+
+    def search(self, rng: random.Random):
+        term = rng.choice(SEARCH_TERMS + [f"INV-{rng.randint(1, self.size):07d}"])
+        return "GET", f"/?q={quote(term)}", None, {}
+
+    def edit(self, rng: random.Random):
+        return "GET", f"/edit/{rng.randint(1, self.size)}", None, {}
+
+    def files(self, rng: random.Random):
+        return "GET", f"/files/{rng.choice(self.file_names)}", None, {}
+
+    def api_ocr(self, rng: random.Random):
+        body, content_type = _multipart({}, {"invoiceFile": ("invoice.pdf", self.pdf)})
+        return "POST", "/api/ocr", body, {"Content-Type": content_type}
+
+    def upload(self, rng: random.Random):
+        number = self._next_number()
+        body, content_type = _multipart(
+            {
+                "invoiceDate": "2025-03-14",
+                "invoiceNumber": f"LT-{number:07d}",
+                "companyName": vendor_name(rng.randrange(VENDOR_COUNT)),
+                "totalAmount": f"{rng.uniform(10, 50000):.2f}",
+                "enteredBy": "loadtest",
+            },
+            {"invoiceFile": (f"invoice-{number}.pdf", self.pdf)},
+        )
+        return "POST", "/upload", body, {"Content-Type": content_type}
+
+    def upload_payment(self, rng: random.Random):
+        body, content_type = _multipart({"paidAmount": "1.00", "paymentDate": "2025-03-20"}, {})
+        return "POST", f"/upload_payment/{rng.randint(1, self.size)}", body, {"Content-Type": content_type}
+
+
+def _client(port: int, workload: Workload, mix: Dict[str, int], stop_at: float, timeout: float,
+            seed_value: int, samples: Dict[str, List[Tuple[float, Optional[int]]]]) -> None:
+    rng = random.Random(seed_value)
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    builders: Dict[str, Callable] = {route: getattr(workload, route) for route in routes}
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    while time.monotonic() < stop_at:
+        route = rng.choices(routes, weights)[0]
+        method, url, body, headers = builders[route](rng)
+        start = time.perf_counter()
+        try:
+            conn.request(method, url, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            status: Optional[int] = response.status
+            if response.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            status = None
+        samples.setdefault(route, []).append((time.perf_counter() - start, status))
+    conn.close()
+
+
+def drive(port: int, workload: Workload, mix: Dict[str, int], concurrency: int, duration: float,
+          timeout: float, seed_value: int) -> Tuple[Dict[str, list], float]:
+    per_client: List[Dict[str, list]] = [{} for _ in range(concurrency)]
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(target=_client, args=(port, workload, mix, stop_at, timeout, seed_value + number, per_client[number]))
+        for number in range(concurrency)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    merged: Dict[str, list] = {}
+    for samples in per_client:
+        for route, values in samples.items():
+            merged.setdefault(route, []).extend(values)
+    return merged, elapsed
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(samples: Dict[str, list], elapsed: float) -> Dict[str, dict]:
+    routes = {}
+    for route in sorted(samples, key=list(ROUTE_LABELS).index):
+        values = samples[route]
+        latencies = sorted(seconds for seconds, _ in values)
+        routes[ROUTE_LABELS[route]] = {
+            "requests": len(values),
+            "requests_per_second": round(len(values) / elapsed, 2),
+            "errors": sum(1 for _, status in values if status is None or status >= 500),
+            "rejected": sum(1 for _, status in values if status == 429),
+            "latency_ms": {
+                "p50": round(statistics.median(latencies) * 1000, 1),
+                "p95": round(_percentile(latencies, 0.95) * 1000, 1),
+                "p99": round(_percentile(latencies, 0.99) * 1000, 1),
+                "mean": round(statistics.mean(latencies) * 1000, 1),
+            },
+        }
+    total = sum(route["requests"] for route in routes.values())
+    routes["all"] = {
+        "requests": total,
+        "requests_per_second": round(total / elapsed, 2),
+        "errors": sum(route["errors"] for route in routes.values()),
+        "rejected": sum(route["rejected"] for route in routes.values()),
+    }
+    return routes
+
+
+def print_run(run: dict) -> None:
+    print(
+        f"\n{run['size']:,} invoices, {run['workers']} worker(s) x {run['threads']} thread(s), "
+        f"{run['concurrency']} clients, mix={run['mix']}, storage={run['storage']}"
+    )
+    print(f"  {'route':<22} {'req':>6} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'5xx':>5} {'429':>5}")
+    for label, route in run["routes"].items():
+        if label == "all":
+            continue
+        latency = route["latency_ms"]
+        print(
+            f"  {label:<22} {route['requests']:>6} {route['requests_per_second']:>8.1f}"
+            f" {latency['p50']:>7.1f}ms {latency['p95']:>7.1f}ms {latency['p99']:>7.1f}ms"
+            f" {route['errors']:>5} {route['rejected']:>5}"
+        )
+    total = run["routes"]["all"]
+    print(f"  {'all':<22} {total['requests']:>6} {total['requests_per_second']:>8.1f}")
+
+
+def run_once(args, seed_path: Path, files: Dict[str, bytes], size: int, workers: int) -> dict:
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as tmp:
+        run_dir = Path(tmp)
+        shutil.copyfile(seed_path, run_dir / "invoices.db")
+        storage = StorageStub(args.stub_latency_ms) if args.storage == "supabase" else None
+        if storage:
+            storage.objects.update({f"invoices/{name}": data for name, data in files.items()})
+        else:
+            (run_dir / "uploads").mkdir()
+            for name, data in files.items():
+                (run_dir / "uploads" / name).write_bytes(data)
+
+        port = _free_port()
+        process = start_app(run_dir, port, workers, args.threads, storage)
+        try:
+            workload = Workload(size, files)
+            # Warm-up: first backend use runs the migrations, worker caches fill
+            drive(port, workload, {"edit": 1}, workers, 1, args.request_timeout, 0)
+            if args.warmup:
+                drive(port, workload, MIXES[args.mix], args.concurrency, args.warmup, args.request_timeout, 1)
+            samples, elapsed = drive(
+                port, workload, MIXES[args.mix], args.concurrency, args.duration, args.request_timeout, 1000,
+            )
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            if storage:
+                storage.shutdown()
+                storage.server_close()
+
+    return {
+        "size": size,
+        "workers": workers,
+        "threads": args.threads,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "storage": args.storage,
+        "duration": round(elapsed, 2),
+        "routes": summarize(samples, elapsed),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000], help="Invoices in the database")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="gunicorn worker counts to try")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker (Procfile: 4)")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each run")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--storage", choices=("local", "supabase"), default="local")
+    parser.add_argument("--stub-latency-ms", type=float, default=0, help="Added latency of the storage stand-in")
+    parser.add_argument("--data-dir", type=Path, default=Path(tempfile.gettempdir()) / "invoice-bench-http",
+                        help="Where seeded databases are cached")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        raise SystemExit("gunicorn is not installed (pip install gunicorn)")
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    files = seed_files()
+    runs = []
+    for size in args.sizes:
+        seed_path = seeded_database(args.data_dir, size)
+        for workers in args.workers:
+            run = run_once(args, seed_path, files, size, workers)
+            print_run(run)
+            runs.append(run)
+
+    if args.json:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "runs": runs,
+        }
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
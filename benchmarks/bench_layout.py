@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Field extraction from text-layer PDFs: whole-text regexes versus the layout index.
+
+    python benchmarks/bench_layout.py [--documents 20] [--pages 1 10 50]
+
+Generates multi-page invoices whose line items include amounts larger than
+the invoice total (the case where "largest amount in the document" picks the
+wrong value), then times ``parse_invoice_text`` on the extracted text alone
+and with ``extract_layout_fields``, and scores both against the ground truth.
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fitz  # noqa: E402
+
+import ocr_handler  # noqa: E402
+
+ITEMS_PER_PAGE = 30
+
+
+def make_document(number: int, pages: int, path: str) -> dict:
+    truth = {
+        "invoice_number": f"INV-{number:05d}",
+        "invoice_date": "2025-03-14",
+        "company_name": "ACME INDUSTRIAL SUPPLIES INC",
+        "total_amount": f"{1000 + number * 7.25:.2f}",
+    }
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=612, height=792)
+        y = 60
+        if page_number == 1:
+            page.insert_text((50, y), truth["company_name"], fontsize=18)
+            page.insert_text((50, y + 20), "1200 Harbor Road, Suite 4", fontsize=9)
+            page.insert_text((360, y + 40), "Invoice Number:", fontsize=10)
+            page.insert_text((460, y + 40), truth["invoice_number"], fontsize=10)
+            page.insert_text((360, y + 55), "Invoice Date:", fontsize=10)
+            page.insert_text((460, y + 55), "March 14, 2025", fontsize=10)
+            page.insert_text((50, y + 80), "Bill To: Northwind Traders", fontsize=10)
+            y += 110
+        for item in range(ITEMS_PER_PAGE if page_number < pages else 10):
+            # Line items on a credit note style invoice can exceed the amount due
+            amount = 250.0 + (item * 389.5) % 9000
+            page.insert_text((50, y), f"Item {page_number}-{item} equipment lease", fontsize=9)
+            page.insert_text((480, y), f"${amount:,.2f}", fontsize=9)
+            y += 18
+        if page_number < pages:
+            page.insert_text((360, 760), "Page total", fontsize=9)
+        else:
+            page.insert_text((360, y + 20), "Subtotal", fontsize=10)
+            page.insert_text((480, y + 20), "$99,999.00", fontsize=10)
+            page.insert_text((360, y + 40), "Less deposit", fontsize=10)
+            page.insert_text((360, y + 60), "Amount Due", fontsize=10)
+            page.insert_text((480, y + 60), f"${float(truth['total_amount']):,.2f}", fontsize=10)
+    doc.save(path)
+    return truth
+
+
+def score(result: dict, truth: dict) -> int:
+    return sum(1 for key, value in truth.items() if (result.get(key) or "").upper() == value.upper())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            regex_times, layout_times, regex_hits, layout_hits = [], [], 0, 0
+            for number in range(args.documents):
+                path = str(Path(tmp) / f"invoice-{pages}-{number}.pdf")
+                truth = make_document(number, pages, path)
+                text = ocr_handler.extract_text(path)
+
+                start = time.perf_counter()
+                regex_result, _ = ocr_handler.parse_invoice_text(text)
+                regex_times.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                layout_result, _ = ocr_handler.parse_invoice_text(text, ocr_handler.extract_layout_fields(path))
+                layout_times.append(time.perf_counter() - start)
+
+                regex_hits += score(regex_result, truth)
+                layout_hits += score(layout_result, truth)
+
+            total = args.documents * 4
+            print(
+                f"{pages:>3} page(s): regex  median={statistics.median(regex_times) * 1000:7.2f} ms"
+                f"  fields={regex_hits}/{total}"
+            )
+            print(
+                f"{'':>11} layout median={statistics.median(layout_times) * 1000:7.2f} ms"
+                f"  fields={layout_hits}/{total}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
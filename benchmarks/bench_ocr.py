@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+OCR throughput, latency, memory and field accuracy on a labeled corpus.
+
+    python benchmarks/bench_ocr.py [--corpus DIR] [--documents 10] [--mode full]
+                                   [--json result.json] [--baseline previous.json]
+
+Runs the ``/api/ocr`` path (``extract_text_within_budget`` followed by
+``parse_invoice_text`` with the layout fields) over the synthetic corpus from
+``corpus.py`` and reports, per kind of document:
+
+- pages/s and p50/p95 latency per page and per document,
+- peak RSS of the worker process and of the ``tesseract`` processes it forked,
+- per-field accuracy against the ground truth.
+
+Each kind runs in a fresh process so its peak RSS is its own. ``--json``
+writes the results; ``--baseline`` prints the change against an earlier JSON.
+Without Tesseract only the text-layer documents are measured.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import corpus  # noqa: E402
+
+FIELDS = ("invoice_number", "invoice_date", "company_name", "total_amount")
+
+
+def _peak_rss_mb() -> Dict[str, Optional[float]]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return {"self": None, "children": None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def _matches(field: str, found: Optional[str], expected: str) -> bool:
+    if not found:
+        return False
+    if field == "total_amount":
+        try:
+            return abs(float(found) - float(expected)) < 0.005
+        except ValueError:
+            return False
+    if field in ("invoice_number", "company_name"):
+        def normalize(value: str) -> str:
+            return re.sub(r"[^0-9A-Z]", "", value.upper())
+        return normalize(found) == normalize(expected)
+    return found == expected
+
+
+def _run_kind(directory: str, entries: List[dict], mode: str) -> dict:
+    """Runs in a fresh worker process; returns raw samples and the peak RSS."""
+    import ocr_handler
+
+    samples = []
+    for entry in entries:
+        path = str(Path(directory) / entry["file"])
+        start = time.perf_counter()
+        text, timed_out, _ = ocr_handler.extract_text_within_budget(path, mode=mode)
+        try:
+            result, _ = ocr_handler.parse_invoice_text(text, ocr_handler.extract_layout_fields(path))
+        except ValueError:
+            result = {}
+        elapsed = time.perf_counter() - start
+        samples.append({
+            "file": entry["file"],
+            "pages": entry["pages"],
+            "seconds": elapsed,
+            "timed_out_pages": timed_out,
+            "fields": {field: _matches(field, result.get(field), entry["truth"][field]) for field in FIELDS},
+        })
+    return {"samples": samples, "peak_rss_mb": _peak_rss_mb()}
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(run: dict) -> dict:
+    samples = run["samples"]
+    pages = sum(sample["pages"] for sample in samples)
+    seconds = sum(sample["seconds"] for sample in samples)
+    per_document = [sample["seconds"] for sample in samples]
+    per_page = [sample["seconds"] / sample["pages"] for sample in samples]
+    accuracy = {
+        field: round(sum(sample["fields"][field] for sample in samples) / len(samples), 4)
+        for field in FIELDS
+    }
+    return {
+        "documents": len(samples),
+        "pages": pages,
+        "seconds": round(seconds, 3),
+        "pages_per_second": round(pages / seconds, 3) if seconds else None,
+        "page_latency_ms": {
+            "p50": round(statistics.median(per_page) * 1000, 1),
+            "p95": round(_percentile(per_page, 0.95) * 1000, 1),
+        },
+        "document_latency_ms": {
+            "p50": round(statistics.median(per_document) * 1000, 1),
+            "p95": round(_percentile(per_document, 0.95) * 1000, 1),
+        },
+        "timed_out_pages": sum(len(sample["timed_out_pages"]) for sample in samples),
+        "peak_rss_mb": run["peak_rss_mb"],
+        "field_accuracy": accuracy,
+        "accuracy": round(statistics.mean(accuracy.values()), 4),
+        "misses": [
+            {"file": sample["file"], "fields": [field for field, hit in sample["fields"].items() if not hit]}
+            for sample in samples
+            if not all(sample["fields"].values())
+        ],
+    }
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    print(f"{'kind':<6} {'docs':>5} {'pages':>6} {'pages/s':>8} {'p50/page':>9} {'p95/page':>9} "
+          f"{'p95/doc':>9} {'rss MB':>7} {'+tess':>6}  " + "  ".join(f"{field.split('_')[-1]:>7}" for field in FIELDS))
+    for kind, summary in results.items():
+        rss = summary["peak_rss_mb"]
+        print(
+            f"{kind:<6} {summary['documents']:>5} {summary['pages']:>6} {summary['pages_per_second'] or 0:>8.2f}"
+            f" {summary['page_latency_ms']['p50']:>7.1f}ms {summary['page_latency_ms']['p95']:>7.1f}ms"
+            f" {summary['document_latency_ms']['p95']:>7.1f}ms {rss['self'] or 0:>7.0f} {rss['children'] or 0:>6.0f}  "
+            + "  ".join(f"{summary['field_accuracy'][field]:>7.0%}" for field in FIELDS)
+        )
+
+
+def print_comparison(results: Dict[str, dict], baseline: Dict[str, dict]) -> None:
+    def change(new, old, lower_is_better=False):
+        if not new or not old:
+            return "    n/a"
+        delta = (new - old) / old
+        better = delta < 0 if lower_is_better else delta > 0
+        return f"{delta:+7.1%}{' ' if abs(delta) < 0.05 else ('+' if better else '-')}"
+
+    print("\nChange against the baseline ('+' better, '-' worse, beyond 5%):")
+    for kind, summary in results.items():
+        old = baseline.get(kind)
+        if not old:
+            print(f"{kind:<6} not in the baseline")
+            continue
+        accuracy = summary["accuracy"] - old["accuracy"]
+        print(
+            f"{kind:<6} pages/s {change(summary['pages_per_second'], old['pages_per_second'])}"
+            f"  p95/page {change(summary['page_latency_ms']['p95'], old['page_latency_ms']['p95'], True)}"
+            f"  rss {change(summary['peak_rss_mb']['self'], old['peak_rss_mb']['self'], True)}"
+            f"  accuracy {accuracy * 100:+.1f} pts"
+        )
+
+
+def _tesseract_version() -> Optional[str]:
+    try:
+        import pytesseract
+
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", type=Path, help="Corpus directory; generated there when it has no manifest")
+    parser.add_argument("--documents", type=int, default=10, help="Documents per kind when generating")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kinds", nargs="+", choices=corpus.KINDS, default=list(corpus.KINDS))
+    parser.add_argument("--mode", choices=("full", "roi"), default="full", help="OCR_MODE to run with")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    tesseract = _tesseract_version()
+    kinds = list(args.kinds)
+    if tesseract is None:
+        kinds = [kind for kind in kinds if kind == "text"]
+        print("Tesseract is not available: only text-layer documents are measured")
+        if not kinds:
+            raise SystemExit("Nothing to benchmark")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.corpus or Path(tmp)
+        if not (directory / "manifest.json").exists():
+            corpus.generate(directory, args.documents, args.seed, args.kinds)
+        entries = corpus.load(directory)
+
+        results = {}
+        for kind in kinds:
+            selected = [entry for entry in entries if entry["kind"] == kind]
+            if not selected:
+                continue
+            # A fresh process per kind keeps the peak RSS figures separate
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                run = executor.submit(_run_kind, str(directory), selected, args.mode).result()
+            results[kind] = summarize(run)
+
+    print_report(results)
+    for kind, summary in results.items():
+        for miss in summary["misses"]:
+            print(f"  {kind}: {miss['file']} missed {', '.join(miss['fields'])}")
+
+    if args.baseline:
+        print_comparison(results, json.loads(args.baseline.read_text())["results"])
+
+    if args.json:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "mode": args.mode,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "tesseract": tesseract,
+            "results": results,
+        }
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
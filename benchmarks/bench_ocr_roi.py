@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Region-of-interest OCR versus full-page OCR: pixels processed and latency.
+
+    python benchmarks/bench_ocr_roi.py [--documents 10] [--pages 1]
+
+Builds scanned-looking (image only) invoices with the usual layout, header
+fields at the top of the first page and totals at the bottom of the last, then
+extracts each one with ``OCR_MODE`` "full" and "roi" and compares the pixels
+sent to Tesseract, the time taken and the fields detected.
+"""
+
+import argparse
+import io
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fitz  # noqa: E402
+
+import ocr_handler  # noqa: E402
+
+HEADER = [
+    "ACME Industrial Supplies Inc.",
+    "1200 Harbor Road, Suite 4",
+    "Invoice Number: INV-{doc:05d}",
+    "Invoice Date: March 14, 2025",
+    "Bill To: Northwind Traders",
+]
+ITEMS = [
+    "Widget assembly kit          4 x 125.00      500.00",
+    "Replacement bearings         12 x 8.50       102.00",
+    "Freight                                       45.00",
+]
+TOTALS = [
+    "Subtotal                                     647.00",
+    "Tax                                           51.76",
+    "Total Amount Due                             698.76",
+]
+
+
+def _page_image(lines_top, lines_middle, lines_bottom):
+    from PIL import Image, ImageDraw, ImageFont
+
+    # Letter size at 150 DPI, embedded as an image so there is no text layer
+    image = Image.new("L", (1275, 1650), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=24)
+    except TypeError:
+        font = ImageFont.load_default()
+    for start, lines in ((100, lines_top), (700, lines_middle), (1350, lines_bottom)):
+        for offset, line in enumerate(lines):
+            draw.text((100, start + offset * 50), line, fill=0, font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def make_document(doc_number: int, pages: int, path: str) -> None:
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        top = [line.format(doc=doc_number) for line in HEADER] if page_number == 1 else []
+        bottom = TOTALS if page_number == pages else []
+        page = doc.new_page(width=612, height=792)
+        page.insert_image(page.rect, stream=_page_image(top, ITEMS, bottom))
+    doc.save(path)
+
+
+class PixelCounter:
+    """Wraps ``ocr_handler._ocr_image`` to count the pixels handed to OCR."""
+
+    def __init__(self) -> None:
+        self.pixels = 0
+        self._original = ocr_handler._ocr_image
+
+    def __enter__(self):
+        from PIL import Image
+
+        def counting(image_data, timeout=None):
+            with Image.open(io.BytesIO(image_data)) as image:
+                self.pixels += image.width * image.height
+            return self._original(image_data, timeout)
+
+        ocr_handler._ocr_image = counting
+        return self
+
+    def __exit__(self, *exc_info):
+        ocr_handler._ocr_image = self._original
+
+
+def run(paths, mode):
+    timings, pixels, fields = [], [], []
+    for path in paths:
+        with PixelCounter() as counter:
+            start = time.perf_counter()
+            text, _, _ = ocr_handler.extract_text_within_budget(path, mode=mode)
+            timings.append(time.perf_counter() - start)
+        pixels.append(counter.pixels)
+        fields.append(4 - len(ocr_handler._missing_fields(text)))
+    return timings, pixels, fields
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+    except Exception as exc:
+        raise SystemExit(f"Tesseract is not available, nothing to benchmark: {exc}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for number in range(args.documents):
+            path = str(Path(tmp) / f"invoice-{number}.pdf")
+            make_document(number, args.pages, path)
+            paths.append(path)
+
+        print(f"{args.documents} image-only invoice(s), {args.pages} page(s) each\n")
+        results = {mode: run(paths, mode) for mode in ("full", "roi")}
+
+    for mode, (timings, pixels, fields) in results.items():
+        print(
+            f"{mode:<5} median={statistics.median(timings) * 1000:8.1f} ms"
+            f"  pixels/doc={statistics.mean(pixels) / 1e6:7.2f} MP"
+            f"  fields found={statistics.mean(fields):.2f}/4"
+        )
+    full_pixels = statistics.mean(results["full"][1])
+    roi_pixels = statistics.mean(results["roi"][1])
+    if roi_pixels:
+        print(f"\nroi processes {full_pixels / roi_pixels:.1f}x fewer pixels")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Per-page OCR latency: cold ``tesseract`` forks versus the warm OCR service.
+
+    python benchmarks/bench_ocr_service.py [--pages 20] [--workers 2]
+
+"cold" is what ``/api/ocr`` does without the service: every page goes through
+``pytesseract``, which forks the ``tesseract`` binary and reloads the language
+model. "warm" sends the same pages to ``ocr_service.py`` workers that loaded
+Tesseract once at start-up, first one page at a time (latency) and then all at
+once (throughput). Both paths run the same preprocessing.
+"""
+
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import ocr_handler  # noqa: E402
+import ocr_service  # noqa: E402
+
+LINES = [
+    "ACME Industrial Supplies Inc.",
+    "1200 Harbor Road, Suite 4",
+    "Invoice Number: INV-{page:05d}",
+    "Invoice Date: March 14, 2025",
+    "Bill To: Northwind Traders",
+    "Widget assembly kit          4 x 125.00      500.00",
+    "Replacement bearings         12 x 8.50       102.00",
+    "Freight                                       45.00",
+    "Subtotal                                     647.00",
+    "Tax                                           51.76",
+    "Total Amount Due                             698.76",
+]
+
+
+def make_page(page: int) -> bytes:
+    """A letter-size, 300 DPI scan-like invoice page as PNG bytes."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    image = Image.new("L", (2550, 3300), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=48)
+    except TypeError:
+        font = ImageFont.load_default()
+    y = 200
+    for line in LINES:
+        draw.text((200, y), line.format(page=page), fill=0, font=font)
+        y += 110
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def summarize(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(
+        f"{label:<22} n={len(samples):<4} median={statistics.median(samples) * 1000:8.1f} ms"
+        f"  p95={p95 * 1000:8.1f} ms  mean={statistics.mean(samples) * 1000:8.1f} ms"
+    )
+
+
+def bench_cold(pages: list) -> list:
+    from PIL import Image
+
+    samples = []
+    for data in pages:
+        start = time.perf_counter()
+        ocr_handler.recognize_image(Image.open(io.BytesIO(data)))
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_warm(pages: list, socket_path: str) -> list:
+    samples = []
+    for data in pages:
+        start = time.perf_counter()
+        ocr_service.recognize(data, socket_path)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def start_service(socket_path: str, workers: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / "ocr_service.py"), "serve", "--socket", socket_path, "--workers", str(workers)],
+        cwd=str(ROOT),
+    )
+    deadline = time.monotonic() + 60
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise SystemExit("OCR service did not start")
+        time.sleep(0.1)
+    return process
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    try:
+        import pytesseract
+
+        pytesseract.get_tesseract_version()
+    except Exception as exc:
+        raise SystemExit(f"Tesseract is not available, nothing to benchmark: {exc}")
+
+    pages = [make_page(page) for page in range(args.pages)]
+    print(f"{args.pages} synthetic pages, {args.workers} service worker(s)\n")
+
+    summarize("cold (fork per page)", bench_cold(pages))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "ocr.sock")
+        service = start_service(socket_path, args.workers)
+        try:
+            ocr_service.recognize(pages[0], socket_path)  # first request after start-up
+            summarize("warm (service)", bench_warm(pages, socket_path))
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(lambda data: ocr_service.recognize(data, socket_path), pages))
+            elapsed = time.perf_counter() - start
+            print(f"{'warm, concurrent':<22} {args.pages / elapsed:.2f} pages/s")
+        finally:
+            service.terminate()
+            service.wait(timeout=30)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
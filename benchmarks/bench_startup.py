@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Cold start cost of a worker: ``import app`` measured with ``python -X importtime``.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 15] [--json result.json]
+
+Each run is a fresh interpreter with an empty SQLite database, the outbox
+worker off and metrics in a temporary directory. Reported per variant:
+
+- ``lazy``: the default; fitz, OpenCV, numpy and the Supabase/psycopg clients
+  are not imported until first use,
+- ``preload``: ``PRELOAD_HEAVY_MODULES=true``, what the gunicorn master pays
+  with ``GUNICORN_PRELOAD=true`` (workers forked from it pay nothing),
+
+with the median ``import app`` time, which heavy modules ended up loaded, the
+time the first OCR request spends loading them (``lazy`` only) and the slowest
+imports by cumulative time.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ("fitz", "cv2", "numpy", "PIL.Image", "pytesseract", "supabase", "psycopg")
+VARIANTS = {"lazy": {}, "preload": {"PRELOAD_HEAVY_MODULES": "true"}}
+
+# Printed by the child after the import: loaded heavy modules and the first-use cost
+_PROBE = """
+import json, sys, time
+import app
+loaded = [name for name in {heavy!r} if name in sys.modules]
+start = time.perf_counter()
+app.ocr_handler.preload_modules()
+print(json.dumps({{"loaded": loaded, "first_use_ms": (time.perf_counter() - start) * 1000}}))
+"""
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def _parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """``{module: (self_us, cumulative_us)}`` for every module imported."""
+    modules = {}
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            modules[match.group(3)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def _run_once(variant_env: Dict[str, str], scratch: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{scratch / 'invoices.db'}",
+        "DATA_BACKEND": "sqlite",
+        "OUTBOX_DATABASE_PATH": str(scratch / "outbox.db"),
+        "OUTBOX_WORKER_ENABLED": "false",
+        "METRICS_DIR": str(scratch / "metrics"),
+        "UPLOAD_FOLDER": str(scratch / "uploads"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    env.pop("PRELOAD_HEAVY_MODULES", None)
+    env.update(variant_env)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(heavy=HEAVY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=False,
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"import app failed:\n{completed.stderr[-2000:]}")
+    modules = _parse_importtime(completed.stderr)
+    probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {
+        "import_ms": modules["app"][1] / 1000,
+        "loaded": probe["loaded"],
+        "first_use_ms": probe["first_use_ms"],
+        "modules": modules,
+    }
+
+
+def run_variant(name: str, runs: int, top: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as scratch:
+            samples.append(_run_once(VARIANTS[name], Path(scratch)))
+    # Slowest imports of the median run; "app" itself is the total
+    median_run = sorted(samples, key=lambda sample: sample["import_ms"])[len(samples) // 2]
+    slowest = sorted(
+        ((module, cumulative) for module, (_, cumulative) in median_run["modules"].items() if module != "app"),
+        key=lambda item: item[1], reverse=True,
+    )[:top]
+    return {
+        "runs": runs,
+        "import_ms": {
+            "median": round(statistics.median(sample["import_ms"] for sample in samples), 1),
+            "min": round(min(sample["import_ms"] for sample in samples), 1),
+        },
+        "heavy_modules_loaded": median_run["loaded"],
+        "first_ocr_load_ms": round(statistics.median(sample["first_use_ms"] for sample in samples), 1),
+        "slowest_imports_ms": {module: round(cumulative / 1000, 1) for module, cumulative in slowest},
+    }
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    for name, result in results.items():
+        print(f"{name}: import app {result['import_ms']['median']:.0f}ms median "
+              f"({result['import_ms']['min']:.0f}ms min, {result['runs']} runs)")
+        print(f"  heavy modules loaded: {', '.join(result['heavy_modules_loaded']) or 'none'}")
+        if name == "lazy":
+            print(f"  loaded by the first OCR request: {result['first_ocr_load_ms']:.0f}ms")
+        print("  slowest imports (cumulative):")
+        for module, milliseconds in result["slowest_imports_ms"].items():
+            print(f"    {milliseconds:>7.1f}ms  {module}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per variant")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    results: Dict[str, dict] = {name: run_variant(name, args.runs, args.top) for name in args.variants}
+    print_report(results)
+
+    if args.json:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
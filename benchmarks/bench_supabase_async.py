@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Sync vs async Supabase client on the pages that make independent calls.
+
+    python benchmarks/bench_supabase_async.py [--latency-ms 40] [--concurrency 1 8]
+                                              [--requests 200] [--pool-size 10] [--json result.json]
+
+A local stand-in for PostgREST answers the queries the pages make (invoice by
+id, payment history by invoice, the ``invoice_totals`` RPC) after
+``--latency-ms``, the round trip to a hosted Supabase project. Per page and
+number of concurrent clients it compares:
+
+- ``sync``: ``SupabaseBackend``, one call after the other, as the views did,
+- ``async``: ``database_async`` (``AsyncSupabaseBackend`` on the shared loop
+  and connection pool), each page run on a loop of its own like a Flask async view,
+
+reporting p50/p95 latency, pages/s and the connections the stand-in accepted.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+INVOICES = 1000
+PAYMENTS_PER_INVOICE = 3
+
+
+class _PostgrestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as PostgREST behind Supabase's gateway
+    disable_nagle_algorithm = True  # headers and body go out separately
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _reply(self, status: int, payload) -> None:
+        time.sleep(self.server.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/rest/v1/invoices":
+            row = self.server.invoices.get(int(params.get("id", "eq.0")[3:]))
+            self._reply(200, [row] if row else [])
+        elif url.path == "/rest/v1/payment_history":
+            self._reply(200, self.server.payments.get(int(params.get("invoice_id", "eq.0")[3:]), []))
+        else:
+            self._reply(404, {"message": f"no stand-in for {url.path}"})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if urlsplit(self.path).path == "/rest/v1/rpc/invoice_totals":
+            self._reply(200, [self.server.totals])
+        else:
+            self._reply(404, {"message": f"no stand-in for {self.path}"})
+
+
+class PostgrestStub(ThreadingHTTPServer):
+    """The PostgREST endpoints behind the edit and stats pages, with canned rows."""
+
+    daemon_threads = True
+
+    def __init__(self, latency_ms: float) -> None:
+        super().__init__(("127.0.0.1", 0), _PostgrestHandler)
+        self.latency = latency_ms / 1000
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.invoices = {
+            invoice_id: {
+                "id": invoice_id,
+                "invoice_date": "2025-03-14",
+                "invoice_day": "2025-03-14",
+                "invoice_number": f"INV-{invoice_id:05d}",
+                "company_name": "ACME INDUSTRIAL SUPPLIES INC",
+                "vendor_id": 1,
+                "total_cents": 125000,
+                "paid_cents": 75000,
+                "credit_cents": 0,
+                "payment_status": "partial",
+                "entered_by": "bench",
+                "notes": None,
+                "pdf_path": f"{invoice_id}.pdf",
+                "payment_proof_path": None,
+            }
+            for invoice_id in range(1, INVOICES + 1)
+        }
+        self.payments = {
+            invoice_id: [
+                {
+                    "id": invoice_id * 10 + number,
+                    "invoice_id": invoice_id,
+                    "amount_cents": 25000,
+                    "payment_date": "2025-04-01",
+                    "payment_proof_path": None,
+                    "notes": "Payment of $250.00",
+                    "created_at": f"2025-04-0{number + 1}T10:00:00",
+                }
+                for number in range(PAYMENTS_PER_INVOICE)
+            ]
+            for invoice_id in self.invoices
+        }
+        self.totals = {"invoice_count": INVOICES, "total_cents": 125000 * INVOICES, "paid_cents": 0, "credit_cents": 0}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def _pages(database, database_async) -> Dict[str, Dict[str, Callable[[int], object]]]:
+    backend = database.SupabaseBackend()
+    ranges = {"week": ("2025-03-10", "2025-03-16"), "month": ("2025-03-01", "2025-03-31"), "all": (None, None)}
+
+    def edit_sync(invoice_id: int):
+        return backend.get_invoice(invoice_id), backend.get_payment_history(invoice_id)
+
+    def stats_sync(invoice_id: int):
+        return {name: backend.get_totals(*bounds) for name, bounds in ranges.items()}
+
+    return {
+        "edit": {
+            "sync": edit_sync,
+            "async": lambda invoice_id: asyncio.run(database_async.get_invoice_with_history(invoice_id)),
+        },
+        "stats": {
+            "sync": stats_sync,
+            "async": lambda invoice_id: asyncio.run(database_async.get_totals_many(ranges)),
+        },
+    }
+
+
+def drive(page: Callable[[int], object], requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def one(number: int) -> None:
+        start = time.perf_counter()
+        page(number % INVOICES + 1)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "pages_per_second": round(requests / seconds, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=40, help="Stand-in round trip per PostgREST call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8], help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Pages per run")
+    parser.add_argument("--pool-size", type=int, default=10, help="SUPABASE_ASYNC_POOL_SIZE")
+    parser.add_argument("--json", type=Path, help="Write the results to this file")
+    args = parser.parse_args()
+
+    stub = PostgrestStub(args.latency_ms)
+    os.environ.update(
+        DATA_BACKEND="supabase",
+        SUPABASE_URL=stub.url,
+        SUPABASE_KEY="bench-key",
+        SUPABASE_ASYNC="true",
+        SUPABASE_ASYNC_POOL_SIZE=str(args.pool_size),
+    )
+    os.environ.pop("SUPABASE_DB_PASSWORD", None)
+    import database
+    import database_async
+
+    pages = _pages(database, database_async)
+    results: Dict[str, dict] = {}
+    print(f"{'page':<6} {'clients':>7} {'client':<6} {'pages/s':>8} {'p50':>8} {'p95':>8} {'conns':>6}")
+    for name, variants in pages.items():
+        for concurrency in args.concurrency:
+            for variant, page in variants.items():
+                page(1)  # connect outside the measurement
+                before = stub.connections
+                result = drive(page, args.requests, concurrency)
+                result["connections"] = stub.connections - before
+                results[f"{name}/{concurrency}/{variant}"] = result
+                print(f"{name:<6} {concurrency:>7} {variant:<6} {result['pages_per_second']:>8.1f} "
+                      f"{result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms {result['connections']:>6}")
+            sync, async_ = results[f"{name}/{concurrency}/sync"], results[f"{name}/{concurrency}/async"]
+            print(f"{'':<6} {'':>7} p50 {sync['p50_ms'] / async_['p50_ms']:.2f}x faster with async")
+    stub.shutdown()
+
+    if args.json:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "latency_ms": args.latency_ms,
+            "pool_size": args.pool_size,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
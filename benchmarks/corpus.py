@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Labeled synthetic invoice corpus for the OCR benchmarks.
+
+    python benchmarks/corpus.py OUT_DIR [--documents 10] [--seed 0] [--kinds text scan tiff]
+
+Every invoice is laid out as a text-layer PDF first (vendor name at the top,
+number and date in the header, line items, totals on the last page) and then,
+depending on the kind, saved as it is or rasterized:
+
+- ``text``: the PDF with its text layer, as exported by accounting software,
+- ``scan``: image-only PDF pages (JPEG, 200 DPI), rotated, blurred and noisy,
+- ``tiff``: a multi-page TIFF at 200 DPI, as produced by office scanners.
+
+``manifest.json`` lists each file with its ground truth (the fields
+``parse_invoice_text`` returns) and the degradations applied. The same seed
+always produces the same pages, so results can be compared between runs.
+"""
+
+import argparse
+import io
+import json
+import random
+import sys
+from pathlib import Path
+from statistics import NormalDist
+from typing import Dict, List
+
+import fitz
+
+KINDS = ("text", "scan", "tiff")
+PAGES = {"text": (1, 3), "scan": (1, 2), "tiff": (2, 4)}
+SCAN_DPI = 200
+ITEMS_PER_PAGE = 22
+
+VENDORS = [
+    "ACME INDUSTRIAL SUPPLIES INC",
+    "NORTHWIND TRADING LLC",
+    "BLUE HARBOR LOGISTICS LTD",
+    "SUMMIT OFFICE PRODUCTS CORP",
+    "GREENFIELD PACKAGING CO",
+    "REDWOOD TECHNICAL SERVICES INC",
+]
+STREETS = ["1200 Harbor Road, Suite 4", "55 Market Street", "8 Industrial Park Drive", "410 Commerce Way"]
+DATE_STYLES = ["%B %d, %Y", "%Y-%m-%d", "%m/%d/%Y", "%d %b %Y"]
+PRODUCTS = ["Widget assembly kit", "Replacement bearings", "Packing tape", "Toner cartridge", "Freight", "Labour"]
+
+
+def _truth(rng: random.Random, number: int) -> Dict[str, str]:
+    from datetime import date
+
+    day = date(2024, 1, 1).toordinal() + rng.randrange(700)
+    return {
+        "invoice_number": f"INV-{rng.randrange(10000, 99999)}-{number:03d}",
+        "invoice_date": date.fromordinal(day).isoformat(),
+        "company_name": rng.choice(VENDORS),
+    }
+
+
+def _layout(rng: random.Random, truth: Dict[str, str], pages: int) -> fitz.Document:
+    """Builds the text-layer invoice and fills in ``truth["total_amount"]``."""
+    from datetime import date
+
+    invoice_date = date.fromisoformat(truth["invoice_date"])
+    items = [
+        (rng.choice(PRODUCTS), rng.randint(1, 12), round(rng.uniform(4, 400), 2))
+        for _ in range(ITEMS_PER_PAGE * (pages - 1) + rng.randint(3, 10))
+    ]
+    subtotal = round(sum(quantity * price for _, quantity, price in items), 2)
+    tax = round(subtotal * 0.08, 2)
+    truth["total_amount"] = f"{subtotal + tax:.2f}"
+
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=612, height=792)
+        y = 60
+        if page_number == 1:
+            page.insert_text((50, y), truth["company_name"], fontsize=18)
+            page.insert_text((50, y + 20), rng.choice(STREETS), fontsize=9)
+            page.insert_text((360, y + 45), "Invoice Number:", fontsize=10)
+            page.insert_text((450, y + 45), truth["invoice_number"], fontsize=10)
+            page.insert_text((360, y + 60), "Invoice Date:", fontsize=10)
+            page.insert_text((450, y + 60), invoice_date.strftime(rng.choice(DATE_STYLES)), fontsize=10)
+            page.insert_text((50, y + 85), "Bill To: Northwind Traders", fontsize=10)
+            y += 120
+        for name, quantity, price in items[(page_number - 1) * ITEMS_PER_PAGE:page_number * ITEMS_PER_PAGE]:
+            page.insert_text((50, y), name, fontsize=10)
+            page.insert_text((300, y), f"{quantity} x {price:,.2f}", fontsize=10)
+            page.insert_text((480, y), f"{quantity * price:,.2f}", fontsize=10)
+            y += 20
+        if page_number == pages:
+            page.insert_text((360, y + 25), "Subtotal", fontsize=10)
+            page.insert_text((480, y + 25), f"{subtotal:,.2f}", fontsize=10)
+            page.insert_text((360, y + 42), "Tax", fontsize=10)
+            page.insert_text((480, y + 42), f"{tax:,.2f}", fontsize=10)
+            page.insert_text((360, y + 62), "Total Amount Due", fontsize=11)
+            page.insert_text((480, y + 62), f"${subtotal + tax:,.2f}", fontsize=11)
+        else:
+            page.insert_text((480, 760), f"Page {page_number} of {pages}", fontsize=8)
+    return doc
+
+
+def _degrade(image, rng: random.Random, strength: float) -> tuple:
+    """Rotate, blur and add sensor noise and speckles, like a cheap flatbed scan."""
+    from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+    angle = round(rng.uniform(-3, 3) * strength, 2)
+    blur = round(rng.uniform(0.3, 1.2) * strength, 2)
+    sigma = round(rng.uniform(8, 24) * strength, 1)
+
+    image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(blur))
+    if sigma:
+        # Gaussian noise from the seeded stream (Image.effect_noise is not seedable)
+        normal = NormalDist(128, sigma)
+        table = [min(255, max(0, round(normal.inv_cdf((value + 0.5) / 256)))) for value in range(256)]
+        noise = Image.frombytes("L", image.size, rng.randbytes(image.width * image.height)).point(table)
+        image = ImageChops.add(image, noise, 1.0, -128)
+    draw = ImageDraw.Draw(image)
+    for _ in range(int(image.width * image.height * 0.0005 * strength)):
+        draw.point((rng.randrange(image.width), rng.randrange(image.height)), fill=rng.choice((0, 255)))
+    return image, {"rotation": angle, "blur": blur, "noise_sigma": sigma}
+
+
+def _rasterize(doc: fitz.Document, rng: random.Random, strength: float) -> tuple:
+    from PIL import Image
+
+    images, degradations = [], []
+    for page in doc:
+        pixmap = page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+        image, applied = _degrade(image, rng, strength)
+        images.append(image)
+        degradations.append(applied)
+    return images, degradations
+
+
+def make_document(kind: str, number: int, rng: random.Random, directory: Path) -> dict:
+    truth = _truth(rng, number)
+    pages = rng.randint(*PAGES[kind])
+    doc = _layout(rng, truth, pages)
+    entry = {"kind": kind, "pages": pages, "truth": truth}
+
+    if kind == "text":
+        path = directory / f"{kind}-{number:03d}.pdf"
+        doc.save(str(path), no_new_id=True)
+    elif kind == "scan":
+        images, entry["degradations"] = _rasterize(doc, rng, 1.0)
+        path = directory / f"{kind}-{number:03d}.pdf"
+        scanned = fitz.open()
+        for image in images:
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=75)
+            page = scanned.new_page(width=image.width * 72 / SCAN_DPI, height=image.height * 72 / SCAN_DPI)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        scanned.save(str(path), no_new_id=True)
+    elif kind == "tiff":
+        images, entry["degradations"] = _rasterize(doc, rng, 0.6)
+        path = directory / f"{kind}-{number:03d}.tif"
+        images[0].save(
+            str(path), save_all=True, append_images=images[1:],
+            dpi=(SCAN_DPI, SCAN_DPI), compression="tiff_deflate",
+        )
+    else:
+        raise ValueError(f"Unknown corpus kind: {kind}")
+
+    entry["file"] = path.name
+    return entry
+
+
+def generate(directory: Path, documents: int, seed: int = 0, kinds=KINDS) -> List[dict]:
+    """Writes ``documents`` invoices of each kind plus ``manifest.json`` to ``directory``."""
+    directory.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for kind in kinds:
+        # One stream per kind, so adding a kind leaves the others unchanged
+        rng = random.Random(f"{seed}-{kind}")
+        entries.extend(make_document(kind, number, rng, directory) for number in range(documents))
+    manifest = {"seed": seed, "documents": documents, "entries": entries}
+    (directory / "manifest.json").write_text(json.dumps(manifest, indent=2))
+    return entries
+
+
+def load(directory: Path) -> List[dict]:
+    return json.loads((directory / "manifest.json").read_text())["entries"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--documents", type=int, default=10, help="Documents per kind")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    args = parser.parse_args()
+
+    entries = generate(args.out_dir, args.documents, args.seed, args.kinds)
+    pages = sum(entry["pages"] for entry in entries)
+    print(f"Wrote {len(entries)} documents ({pages} pages) to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
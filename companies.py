@@ -0,0 +1,33 @@
+"""
+Company-name vocabulary shared by OCR field extraction and the vendor index.
+
+It lives apart from both so the data layer (``vendors``) can use it without
+importing the OCR module and its dependencies.
+"""
+
+# Legal-form words that end a company name ("Acme Inc.", "Globex GmbH")
+COMPANY_SUFFIXES = [
+    "inc",
+    "inc.",
+    "co",
+    "co.",
+    "corp",
+    "corp.",
+    "ltd",
+    "ltd.",
+    "llc",
+    "gmbh",
+    "pte",
+    "pte.",
+    "company",
+    "limited",
+    "corporation",
+    "plc",
+    "sas",
+    "sa",
+    "kg",
+    "ag",
+    "bv",
+    "srl",
+    "oy",
+]
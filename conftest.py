@@ -0,0 +1,32 @@
+"""
+Shared pytest setup for the test modules in this directory.
+
+Loaded before any test module imports ``database``, so the outbox worker
+thread stays off and no test process writes metric snapshots next to a
+running server's.
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault("OUTBOX_WORKER_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+
+def _invoice(number: str, **data):
+    values = {
+        "invoice_date": "2025-03-14",
+        "invoice_number": number,
+        "company_name": "Acme Industrial Supplies Inc",
+        "total_amount": "100.00",
+        "entered_by": "tester",
+    }
+    values.update(data)
+    return values
+
+
+@pytest.fixture
+def make_invoice():
+    """``make_invoice(number, **fields)``: form data for a new invoice, ``fields`` overriding the defaults."""
+    return _invoice
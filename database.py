@@ -1,32 +1,255 @@
+import bisect
+import importlib
 import os
+import re
+import sys
+import threading
+import time
 from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Set, Tuple, runtime_checkable
 
-from sqlalchemy import Column, Float, Integer, String, Text, text, create_engine
-from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String, Text, and_, bindparam, case, delete, func, insert, or_, text, create_engine, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, declarative_base, defer, sessionmaker
 
 import config
+import dates
+import duplicates
+import metrics
+import money
+import profiling
+import vendors
 
 Base = declarative_base()
 
+# Rows asked for per PostgREST request (Supabase's default max-rows). A project
+# may cap responses lower, so a short page does not mean the end: paging stops
+# at the first empty one.
+SUPABASE_PAGE_SIZE = 1000
+
+# Bulk operations touch at most this many ids per statement (keeps SQLite
+# bound-parameter counts and PostgREST URL lengths well inside their limits)
+BULK_CHUNK_SIZE = 500
+
+# Full-text search returns at most this many ranked invoices, chosen from the
+# newest SEARCH_CANDIDATES matches (ranking every hit of a very common word
+# would scan most of the index)
+SEARCH_LIMIT = 200
+SEARCH_CANDIDATES = 5000
+
+# Columns returned by Supabase list queries (leaves out the large ocr_text)
+SUPABASE_LIST_COLUMNS = (
+    "id,invoice_date,invoice_number,company_name,total_cents,entered_by,notes,pdf_path,"
+    "payment_status,payment_proof_path,payment_date,credit_cents,paid_cents,"
+    "payment_count,last_payment_date,vendor_id,version"
+)
+
+# Columns create_invoice / update_invoice / import_invoices may write (payment_count
+# and last_payment_date belong to the payment_history trigger, version to the update trigger)
+_WRITABLE_COLUMNS = (
+    "invoice_date", "invoice_day", "invoice_number", "invoice_number_key", "company_name", "vendor_id",
+    "total_cents", "entered_by", "notes", "pdf_path", "payment_status", "payment_proof_path", "payment_date",
+    "credit_cents", "paid_cents", "ocr_text", "pdf_sha256",
+)
+
+# Columns whose change bumps invoices.version (the values a clerk sees and edits). Trigger-
+# maintained counters and background writes such as ocr_text leave the version alone, so they
+# never turn an open edit form into a conflict.
+_VERSIONED_COLUMNS = (
+    "invoice_date", "invoice_number", "company_name", "total_cents", "entered_by", "notes", "pdf_path",
+    "payment_status", "payment_proof_path", "payment_date", "credit_cents", "paid_cents",
+)
+
+# Extra columns fetched by duplicate probes so the matching reason can be told apart
+SUPABASE_DUPLICATE_COLUMNS = SUPABASE_LIST_COLUMNS + ",invoice_number_key,pdf_sha256,invoice_day"
+
+# Columns pulled into the read mirror: every column the local copy stores, plus the change timestamp
+SUPABASE_MIRROR_COLUMNS = SUPABASE_DUPLICATE_COLUMNS + ",ocr_text,updated_at"
+
+
+
+class OverpaymentError(ValueError):
+    """Raised when a payment would push paid_cents above total_cents."""
+
+    def __init__(self, total_cents: int, paid_cents: int, payment_cents: int) -> None:
+        self.total_cents = total_cents
+        self.paid_cents = paid_cents
+        self.payment_cents = payment_cents
+        self.attempted_cents = paid_cents + payment_cents
+        super().__init__(
+            f"Total paid amount (${money.format_cents(self.attempted_cents)}) "
+            f"cannot exceed total amount (${money.format_cents(total_cents)})."
+        )
+
+
+class VersionConflictError(Exception):
+    """Raised when a conditional update finds the invoice changed since ``expected_version`` was read."""
+
+    def __init__(self, invoice_id: int, expected_version: int, current_version: int) -> None:
+        self.invoice_id = invoice_id
+        self.expected_version = expected_version
+        self.current_version = current_version
+        super().__init__(
+            f"Invoice {invoice_id} was changed by someone else (version {current_version}, expected {expected_version})."
+        )
+
+
+def _chunks(ids: List[int], size: int = BULK_CHUNK_SIZE) -> Iterable[List[int]]:
+    unique_ids = list(dict.fromkeys(ids))
+    for start in range(0, len(unique_ids), size):
+        yield unique_ids[start:start + size]
+
+
+def _fts_query(q: str) -> str:
+    """Turn free text such as ``PO 4471`` into an FTS5 query: every word must match."""
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", q))
+
+
+def _duplicate_keys(candidate: Dict[str, Any], vendor_id: Optional[int]) -> Dict[str, Any]:
+    """The values each duplicate probe looks up (a probe is skipped when any of its keys is empty)."""
+    try:
+        invoice_date = dates.normalize_date(candidate.get("invoice_date")) if candidate.get("invoice_date") else None
+    except ValueError:
+        invoice_date = None
+    total_cents = candidate.get("total_cents")
+    if total_cents is None and candidate.get("total_amount") not in (None, ""):
+        try:
+            total_cents = money.to_cents(candidate["total_amount"])
+        except ValueError:
+            total_cents = None
+    return {
+        "vendor_id": vendor_id,
+        "invoice_number_key": duplicates.normalize_invoice_number(candidate.get("invoice_number")),
+        "pdf_sha256": candidate.get("pdf_sha256"),
+        "total_cents": total_cents,
+        "invoice_date": invoice_date,
+    }
+
+
+def _duplicate_match(row: Dict[str, Any], keys: Dict[str, Any]) -> Dict[str, Any]:
+    """A row found by the OR-ed duplicate probes (Postgres backends), with the ``reasons`` it matched."""
+    reasons = []
+    same_vendor = keys["vendor_id"] and row.get("vendor_id") == keys["vendor_id"]
+    if same_vendor and keys["invoice_number_key"] and row.get("invoice_number_key") == keys["invoice_number_key"]:
+        reasons.append("invoice_number")
+    if keys["pdf_sha256"] and row.get("pdf_sha256") == keys["pdf_sha256"]:
+        reasons.append("file")
+    invoice_day = row.get("invoice_day")
+    if (
+        same_vendor
+        and row.get("total_cents") == keys["total_cents"]
+        and (invoice_day.isoformat() if hasattr(invoice_day, "isoformat") else invoice_day) == keys["invoice_date"]
+    ):
+        reasons.append("fingerprint")
+    for column in ("invoice_number_key", "pdf_sha256", "invoice_day"):
+        row.pop(column, None)
+    return dict(_hydrate(row), reasons=reasons)
+
+
+def _new_invoice_values(data: Dict[str, Any], vendor_id: Optional[int]) -> Dict[str, Any]:
+    """Column values of a new invoice from cents/ISO-normalized ``data`` (invoice_day as an ISO date)."""
+    return {
+        "invoice_date": data.get("invoice_date"),
+        "invoice_day": data.get("invoice_date"),
+        "invoice_number": data.get("invoice_number"),
+        "invoice_number_key": duplicates.normalize_invoice_number(data.get("invoice_number")),
+        "company_name": data.get("company_name"),
+        "vendor_id": vendor_id,
+        "total_cents": data.get("total_cents"),
+        "entered_by": data.get("entered_by"),
+        "notes": data.get("notes"),
+        "pdf_path": data.get("pdf_path"),
+        "payment_status": data.get("payment_status", "unpaid"),
+        "payment_proof_path": data.get("payment_proof_path"),
+        "payment_date": data.get("payment_date"),
+        "credit_cents": data.get("credit_cents", 0),
+        "paid_cents": data.get("paid_cents", 0),
+        "ocr_text": data.get("ocr_text"),
+        "pdf_sha256": data.get("pdf_sha256"),
+    }
+
+
+def _latest_timestamp(stamps: Iterable[Optional[str]], default: Optional[str] = None) -> Optional[str]:
+    """The newest of some ISO timestamps (compared as instants: PostgREST trims trailing zeros)."""
+    return max((stamp for stamp in stamps if stamp), key=datetime.fromisoformat, default=default)
+
+
+def _hydrate(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the derived display values (money amounts, formatted dates) to a loaded row."""
+    return dates.add_display(money.add_amounts(row))
+
+
+def _normalize_date_rows(rows: Iterable[Any]) -> Tuple[List[Dict[str, Any]], int]:
+    """Turn ``(id, date, ...)`` rows into ISO updates for a bulk UPDATE.
+
+    The first date column is required and reported as invalid when it cannot
+    be parsed; any further columns are optional and left unchanged if invalid.
+    Returns ``(updates, invalid_count)``; each update maps ``id`` and ``d0``,
+    ``d1``, ... to the normalized values.
+    """
+    updates: List[Dict[str, Any]] = []
+    invalid = 0
+    for row_id, required, *optional in rows:
+        parsed = dates.parse_date(required)
+        if parsed is None:
+            invalid += 1
+            continue
+        update_row: Dict[str, Any] = {"id": row_id, "d0": parsed.isoformat()}
+        for index, value in enumerate(optional, start=1):
+            other = dates.parse_date(value)
+            update_row[f"d{index}"] = other.isoformat() if other else value
+        updates.append(update_row)
+    return updates, invalid
+
+
+class Vendor(Base):
+    """One row per distinct company; see vendors.normalize_vendor for the key."""
+    __tablename__ = "vendors"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(256), nullable=False)
+    normalized_key = Column(String(256), nullable=False, unique=True)
+
 
 class Invoice(Base):
     __tablename__ = "invoices"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     invoice_date = Column(String(32), nullable=False)
+    # Day ordinal of invoice_date (date.toordinal()); indexed for range filters and ordering
+    invoice_day = Column(Integer, nullable=True, index=True)
     invoice_number = Column(String(128), nullable=False)
+    # invoice_number without case, spaces or punctuation (duplicates.normalize_invoice_number)
+    invoice_number_key = Column(String(128), nullable=True)
     company_name = Column(String(256), nullable=False)
-    total_amount = Column(Float, nullable=False)
+    vendor_id = Column(Integer, ForeignKey("vendors.id"), nullable=True, index=True)
+    # Money is stored as integer cents (see money.py)
+    total_cents = Column(Integer, nullable=False)
     entered_by = Column(String(128), nullable=False)
     notes = Column(Text, nullable=True)
     pdf_path = Column(String(512), nullable=True)
     payment_status = Column(String(32), nullable=False, default="unpaid")
     payment_proof_path = Column(String(512), nullable=True)
     payment_date = Column(String(32), nullable=True)
-    credit = Column(Float, nullable=False, default=0.00)
-    paid_amount = Column(Float, nullable=False, default=0.00)
+    credit_cents = Column(Integer, nullable=False, default=0)
+    paid_cents = Column(Integer, nullable=False, default=0)
+    # Denormalized from payment_history by database triggers so listings need no extra query
+    payment_count = Column(Integer, nullable=False, default=0)
+    last_payment_date = Column(String(32), nullable=True)
+    # Full text extracted by OCR at upload; indexed for search, not returned in listings
+    ocr_text = Column(Text, nullable=True)
+    # SHA-256 of the uploaded file, for exact-duplicate detection
+    pdf_sha256 = Column(String(64), nullable=True, index=True)
+    # Bumped by a trigger when a _VERSIONED_COLUMNS value changes; expected_version=... makes conditional writes
+    version = Column(Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        Index("ix_invoices_vendor_number", "vendor_id", "invoice_number_key"),
+        Index("ix_invoices_fingerprint", "vendor_id", "total_cents", "invoice_day"),
+    )
 
 class PaymentHistory(Base):
     """付款历史记录模型"""
@@ -34,7 +257,7 @@ class PaymentHistory(Base):
     
     id = Column(Integer, primary_key=True)
     invoice_id = Column(Integer, nullable=False)
-    payment_amount = Column(Float, nullable=False)
+    amount_cents = Column(Integer, nullable=False)
     payment_date = Column(String(32), nullable=False)
     payment_proof_path = Column(String(512), nullable=True)
     notes = Column(Text, nullable=True)
@@ -50,15 +273,85 @@ def _determine_backend() -> str:
     return "sqlite"
 
 
+# ---------- Backend Interface ----------
+
+@runtime_checkable
+class Backend(Protocol):
+    """The methods every data backend implements; the module-level functions below dispatch to them.
+
+    Amounts are integer cents (legacy ``*_amount`` keys are accepted on
+    write), dates are ISO strings, and every returned invoice or payment row
+    carries the display values added by ``_hydrate``. test_backends.py checks
+    each backend against this contract.
+    """
+
+    def get_or_create_vendor(self, name: Optional[str]) -> Optional[int]: ...
+
+    def list_vendors(self) -> List[Dict[str, Any]]: ...
+
+    def find_duplicates(self, candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]: ...
+
+    def create_invoice(self, data: Dict[str, Any]) -> Dict[str, Any]: ...
+
+    def import_invoices(self, rows: Iterable[Dict[str, Any]]) -> int: ...
+
+    def get_invoices(
+        self,
+        company_name: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]: ...
+
+    def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]: ...
+
+    def update_invoice(
+        self, invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]: ...
+
+    def delete_invoice(self, invoice_id: int) -> bool: ...
+
+    def apply_payment(
+        self,
+        invoice_id: int,
+        amount_cents: int,
+        payment_date: str,
+        payment_proof_path: Optional[str] = None,
+        credit_cents: Optional[int] = None,
+        notes: Optional[str] = None,
+        expected_version: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]: ...
+
+    def bulk_mark_paid(self, invoice_ids: List[int], payment_date: str) -> int: ...
+
+    def bulk_update_credit(self, invoice_ids: List[int], credit_cents: int) -> int: ...
+
+    def bulk_delete(self, invoice_ids: List[int]) -> List[str]: ...
+
+    def list_file_references(self) -> Set[str]: ...
+
+    def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]: ...
+
+    def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]: ...
+
+    def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]: ...
+
+    def get_payment_history_many(self, invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]: ...
+
+
 # ---------- SQLite Backend ----------
 
 class SQLiteBackend:
-    def __init__(self) -> None:
-        database_url = os.getenv(
+    def __init__(self, database_url: Optional[str] = None) -> None:
+        database_url = database_url or os.getenv(
             "DATABASE_URL",
             f"sqlite:///{Path(__file__).resolve().parent / 'invoices.db'}",
         )
         self.engine = create_engine(database_url, future=True)
+        metrics.instrument_engine(self.engine, "sqlite")
+        profiling.instrument_engine(self.engine)
         self.session_factory = sessionmaker(
             bind=self.engine,
             autoflush=False,
@@ -75,7 +368,7 @@ class SQLiteBackend:
                 CREATE TABLE IF NOT EXISTS payment_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     invoice_id INTEGER NOT NULL,
-                    payment_amount REAL NOT NULL,
+                    amount_cents INTEGER NOT NULL,
                     payment_date TEXT NOT NULL,
                     payment_proof_path TEXT,
                     notes TEXT,
@@ -88,7 +381,66 @@ class SQLiteBackend:
         
         # 自动迁移: 检测并添加缺失字段
         self._auto_migrate_sqlite()
+        self._migrate_money_to_cents()
+        self._migrate_dates()
+        self._ensure_payment_triggers()
+        self._ensure_version_trigger()
+        self.fts_enabled = self._ensure_search_index()
+        self._migrate_vendors()
+        self._migrate_duplicate_keys()
+
+    def _ensure_payment_triggers(self) -> None:
+        """Keep invoices.payment_count / last_payment_date in step with payment_history.
+
+        Triggers run inside the writing transaction, so every payment write
+        (single, bulk or manual SQL) updates the denormalized columns atomically.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_payment_history_invoice_id
+                ON payment_history (invoice_id)
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS trg_payment_history_insert
+                AFTER INSERT ON payment_history
+                BEGIN
+                    UPDATE invoices
+                    SET payment_count = payment_count + 1,
+                        last_payment_date = CASE
+                            WHEN last_payment_date IS NULL OR NEW.payment_date > last_payment_date
+                            THEN NEW.payment_date ELSE last_payment_date
+                        END
+                    WHERE id = NEW.invoice_id;
+                END
+            """))
+            conn.execute(text("""
+                CREATE TRIGGER IF NOT EXISTS trg_payment_history_delete
+                AFTER DELETE ON payment_history
+                BEGIN
+                    UPDATE invoices
+                    SET payment_count = MAX(payment_count - 1, 0),
+                        last_payment_date = (
+                            SELECT MAX(payment_date) FROM payment_history WHERE invoice_id = OLD.invoice_id
+                        )
+                    WHERE id = OLD.invoice_id;
+                END
+            """))
     
+    def _ensure_version_trigger(self) -> None:
+        """Bump invoices.version once per UPDATE that changes one of the ``_VERSIONED_COLUMNS``."""
+        changed = " OR ".join(f"NEW.{column} IS NOT OLD.{column}" for column in _VERSIONED_COLUMNS)
+        with self.engine.begin() as conn:
+            # Recreated on every start so databases carrying an older definition pick up this one
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_invoices_version"))
+            conn.execute(text(f"""
+                CREATE TRIGGER trg_invoices_version
+                AFTER UPDATE OF {", ".join(_VERSIONED_COLUMNS)} ON invoices
+                WHEN NEW.version = OLD.version AND ({changed})
+                BEGIN
+                    UPDATE invoices SET version = OLD.version + 1 WHERE id = NEW.id;
+                END
+            """))
+
     def _auto_migrate_sqlite(self):
         """SQLite 自动迁移:检测并添加缺失字段"""
         try:
@@ -97,11 +449,18 @@ class SQLiteBackend:
                 result = conn.execute(text("PRAGMA table_info(invoices)"))
                 existing_columns = {row[1] for row in result.fetchall()}
                 
-                # 定义期望字段
-                required_fields = {
-                    'credit': 'REAL DEFAULT 0.00 NOT NULL',
-                    'paid_amount': 'REAL DEFAULT 0.00 NOT NULL'
-                }
+                # 定义期望字段 (credit / paid_amount 只存在于旧版浮点表, 随后由 _migrate_money_to_cents 转换)
+                required_fields = {}
+                if 'total_amount' in existing_columns:
+                    required_fields['credit'] = 'REAL DEFAULT 0.00 NOT NULL'
+                    required_fields['paid_amount'] = 'REAL DEFAULT 0.00 NOT NULL'
+                required_fields['payment_count'] = 'INTEGER DEFAULT 0 NOT NULL'
+                required_fields['last_payment_date'] = 'TEXT'
+                required_fields['ocr_text'] = 'TEXT'
+                required_fields['vendor_id'] = 'INTEGER REFERENCES vendors(id)'
+                required_fields['invoice_number_key'] = 'TEXT'
+                required_fields['pdf_sha256'] = 'TEXT'
+                required_fields['version'] = 'INTEGER DEFAULT 1 NOT NULL'
                 
                 # 添加缺失字段
                 for field_name, field_def in required_fields.items():
@@ -125,9 +484,206 @@ class SQLiteBackend:
                             conn.execute(text("UPDATE invoices SET credit = 0.00 WHERE credit IS NULL"))
                             conn.commit()
                             print(f"SQLite Auto-migration: Set credit default value")
+                        elif field_name == 'payment_count':
+                            # 从 payment_history 回填付款次数
+                            conn.execute(text("""
+                                UPDATE invoices
+                                SET payment_count = (
+                                    SELECT COUNT(*) FROM payment_history WHERE invoice_id = invoices.id
+                                )
+                            """))
+                            conn.commit()
+                            print(f"SQLite Auto-migration: Backfilled payment_count")
+                        elif field_name == 'last_payment_date':
+                            # 从 payment_history 回填最近付款日期
+                            conn.execute(text("""
+                                UPDATE invoices
+                                SET last_payment_date = (
+                                    SELECT MAX(payment_date) FROM payment_history WHERE invoice_id = invoices.id
+                                )
+                            """))
+                            conn.commit()
+                            print(f"SQLite Auto-migration: Backfilled last_payment_date")
         except Exception as e:
             print(f"SQLite Auto-migration warning: {e}")
 
+    def _migrate_money_to_cents(self) -> None:
+        """Rebuild legacy REAL money columns as INTEGER cents.
+
+        SQLite cannot change a column's type in place, so both tables are
+        renamed, recreated from the models and copied across in a single
+        transaction. ``ROUND(ROUND(x, 2) * 100)`` snaps float noise such as
+        ``19.989999`` to the intended cent before the cast.
+        """
+        with self.engine.connect() as conn:
+            invoice_columns = {row[1] for row in conn.execute(text("PRAGMA table_info(invoices)"))}
+            history_columns = {row[1] for row in conn.execute(text("PRAGMA table_info(payment_history)"))}
+        if 'total_cents' in invoice_columns and 'amount_cents' in history_columns:
+            return
+
+        print("SQLite Auto-migration: Converting money columns to integer cents")
+        legacy_columns = {"invoices": invoice_columns, "payment_history": history_columns}
+        with self.engine.begin() as conn:
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_payment_history_insert"))
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_payment_history_delete"))
+            for table in legacy_columns:
+                conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_legacy"))
+            Base.metadata.create_all(conn)
+
+            for model in (Invoice, PaymentHistory):
+                table = model.__tablename__
+                targets, sources = [], []
+                for column in model.__table__.columns:
+                    legacy_name = next(
+                        (amount for amount, cents in money.CENTS_FIELDS.items() if cents == column.name),
+                        None,
+                    )
+                    if column.name in legacy_columns[table]:
+                        sources.append(column.name)
+                    elif legacy_name in legacy_columns[table]:
+                        sources.append(f"CAST(ROUND(ROUND(COALESCE({legacy_name}, 0), 2) * 100) AS INTEGER)")
+                    else:
+                        continue
+                    targets.append(column.name)
+                conn.execute(text(
+                    f"INSERT INTO {table} ({', '.join(targets)}) "
+                    f"SELECT {', '.join(sources)} FROM {table}_legacy"
+                ))
+                conn.execute(text(f"DROP TABLE {table}_legacy"))
+
+    def _ensure_search_index(self) -> bool:
+        """Maintain an FTS5 index over invoice number, company, notes and OCR text.
+
+        The index is an external-content table (the text lives only in
+        ``invoices``) kept current by triggers. Returns False when this SQLite
+        build has no FTS5, in which case search falls back to LIKE.
+        """
+        try:
+            with self.engine.begin() as conn:
+                exists = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'invoices_fts'"
+                )).first()
+                conn.execute(text("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts USING fts5(
+                        invoice_number, company_name, notes, ocr_text,
+                        content='invoices', content_rowid='id'
+                    )
+                """))
+                conn.execute(text("""
+                    CREATE TRIGGER IF NOT EXISTS trg_invoices_fts_insert AFTER INSERT ON invoices
+                    BEGIN
+                        INSERT INTO invoices_fts (rowid, invoice_number, company_name, notes, ocr_text)
+                        VALUES (NEW.id, NEW.invoice_number, NEW.company_name, NEW.notes, NEW.ocr_text);
+                    END
+                """))
+                conn.execute(text("""
+                    CREATE TRIGGER IF NOT EXISTS trg_invoices_fts_delete AFTER DELETE ON invoices
+                    BEGIN
+                        INSERT INTO invoices_fts (invoices_fts, rowid, invoice_number, company_name, notes, ocr_text)
+                        VALUES ('delete', OLD.id, OLD.invoice_number, OLD.company_name, OLD.notes, OLD.ocr_text);
+                    END
+                """))
+                conn.execute(text("""
+                    CREATE TRIGGER IF NOT EXISTS trg_invoices_fts_update
+                    AFTER UPDATE OF invoice_number, company_name, notes, ocr_text ON invoices
+                    BEGIN
+                        INSERT INTO invoices_fts (invoices_fts, rowid, invoice_number, company_name, notes, ocr_text)
+                        VALUES ('delete', OLD.id, OLD.invoice_number, OLD.company_name, OLD.notes, OLD.ocr_text);
+                        INSERT INTO invoices_fts (rowid, invoice_number, company_name, notes, ocr_text)
+                        VALUES (NEW.id, NEW.invoice_number, NEW.company_name, NEW.notes, NEW.ocr_text);
+                    END
+                """))
+                if not exists:
+                    print("SQLite Auto-migration: Building full-text index")
+                    conn.execute(text("INSERT INTO invoices_fts (invoices_fts) VALUES ('rebuild')"))
+            return True
+        except OperationalError as e:
+            print(f"SQLite full-text search unavailable, falling back to LIKE: {e}")
+            return False
+
+    def _migrate_vendors(self) -> None:
+        """Link invoices without a vendor_id to their (possibly new) vendor row."""
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_vendor_id ON invoices (vendor_id)"))
+            names = [row[0] for row in conn.execute(text(
+                "SELECT DISTINCT company_name FROM invoices WHERE vendor_id IS NULL AND company_name IS NOT NULL"
+            ))]
+        updates = []
+        for name in names:
+            vendor_id = self.get_or_create_vendor(name)
+            if vendor_id is not None:
+                updates.append({"vendor_id": vendor_id, "company_name": name})
+        if updates:
+            with self.engine.begin() as conn:
+                conn.execute(text(
+                    "UPDATE invoices SET vendor_id = :vendor_id WHERE company_name = :company_name AND vendor_id IS NULL"
+                ), updates)
+            print(f"SQLite Auto-migration: Linked {len(updates)} company name(s) to vendors")
+
+    def _migrate_duplicate_keys(self) -> None:
+        """Backfill invoice_number_key and create the duplicate-probe indexes."""
+        with self.engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, invoice_number FROM invoices WHERE invoice_number_key IS NULL"
+            )).fetchall()
+            if rows:
+                conn.execute(
+                    text("UPDATE invoices SET invoice_number_key = :key WHERE id = :id"),
+                    [{"id": row[0], "key": duplicates.normalize_invoice_number(row[1])} for row in rows],
+                )
+                print(f"SQLite Auto-migration: Backfilled invoice_number_key for {len(rows)} invoice(s)")
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_invoices_vendor_number ON invoices (vendor_id, invoice_number_key)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_invoices_fingerprint ON invoices (vendor_id, total_cents, invoice_day)"
+            ))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_pdf_sha256 ON invoices (pdf_sha256)"))
+
+    def _migrate_dates(self) -> None:
+        """Normalize stored dates to ISO and backfill the indexed invoice_day column.
+
+        Only rows without an invoice_day are scanned, so after the first run
+        this costs one indexed lookup (plus any rows whose date is unparseable).
+        """
+        with self.engine.begin() as conn:
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(invoices)"))}
+            if 'invoice_day' not in columns:
+                print("SQLite Auto-migration: Adding column 'invoice_day'")
+                conn.execute(text("ALTER TABLE invoices ADD COLUMN invoice_day INTEGER"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_invoices_invoice_day ON invoices (invoice_day)"))
+
+            rows = conn.execute(text(
+                "SELECT id, invoice_date, payment_date FROM invoices WHERE invoice_day IS NULL"
+            )).fetchall()
+            updates, invalid = _normalize_date_rows(rows)
+            for update_row in updates:
+                update_row["day"] = dates.to_ordinal(update_row["d0"])
+            if updates:
+                conn.execute(text("""
+                    UPDATE invoices SET invoice_date = :d0, invoice_day = :day, payment_date = :d1
+                    WHERE id = :id
+                """), updates)
+                print(f"SQLite Auto-migration: Normalized {len(updates)} invoice date(s)")
+            if invalid:
+                print(f"SQLite Auto-migration warning: {invalid} invoice(s) have an unrecognised invoice_date")
+
+            history = conn.execute(text(f"""
+                SELECT id, payment_date FROM payment_history
+                WHERE payment_date NOT GLOB '{dates.ISO_GLOB}'
+            """)).fetchall()
+            history_updates, _ = _normalize_date_rows(history)
+            if history_updates:
+                conn.execute(text("UPDATE payment_history SET payment_date = :d0 WHERE id = :id"), history_updates)
+                conn.execute(text("""
+                    UPDATE invoices
+                    SET last_payment_date = (
+                        SELECT MAX(payment_date) FROM payment_history WHERE invoice_id = invoices.id
+                    )
+                    WHERE payment_count > 0
+                """))
+                print(f"SQLite Auto-migration: Normalized {len(history_updates)} payment date(s)")
+
     @contextmanager
     def session(self) -> Iterable[Session]:
         session: Session = self.session_factory()
@@ -140,18 +696,93 @@ class SQLiteBackend:
         finally:
             session.close()
 
+    def get_or_create_vendor(self, name: Optional[str]) -> Optional[int]:
+        """Return the id of the vendor ``name`` normalizes to, creating it on first use."""
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        with self.engine.begin() as conn:
+            inserted = conn.execute(text(
+                "INSERT OR IGNORE INTO vendors (name, normalized_key) VALUES (:name, :key)"
+            ), {"name": name.strip(), "key": key}).rowcount
+            vendor_id = conn.execute(text("SELECT id FROM vendors WHERE normalized_key = :key"), {"key": key}).scalar()
+        if inserted:
+            vendors.invalidate_index()
+        return vendor_id
+
+    def list_vendors(self) -> List[Dict[str, Any]]:
+        """All vendors with their invoice counts (feeds the autocomplete index)."""
+        with self.engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT v.id, v.name, v.normalized_key, COUNT(i.id)
+                FROM vendors v LEFT JOIN invoices i ON i.vendor_id = v.id
+                GROUP BY v.id
+            """))
+            return [
+                {"id": row[0], "name": row[1], "normalized_key": row[2], "invoice_count": row[3]}
+                for row in result
+            ]
+
+    def _find_vendor_id(self, name: Optional[str]) -> Optional[int]:
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT id FROM vendors WHERE normalized_key = :key"), {"key": key}).scalar()
+
+    def find_duplicates(self, candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Existing invoices that look like ``candidate``, each with the ``reasons`` it matched.
+
+        Every probe is an equality lookup on one of the duplicate indexes, so
+        the cost stays at a few B-tree descents regardless of table size.
+        """
+        keys = _duplicate_keys(candidate, self._find_vendor_id(candidate.get("company_name")))
+        probes = []
+        if keys["vendor_id"] and keys["invoice_number_key"]:
+            probes.append(("invoice_number", and_(
+                Invoice.vendor_id == keys["vendor_id"],
+                Invoice.invoice_number_key == keys["invoice_number_key"],
+            )))
+        if keys["pdf_sha256"]:
+            probes.append(("file", Invoice.pdf_sha256 == keys["pdf_sha256"]))
+        if keys["vendor_id"] and keys["total_cents"] is not None and keys["invoice_date"]:
+            probes.append(("fingerprint", and_(
+                Invoice.vendor_id == keys["vendor_id"],
+                Invoice.total_cents == keys["total_cents"],
+                Invoice.invoice_day == dates.to_ordinal(keys["invoice_date"]),
+            )))
+
+        matches: Dict[int, Dict[str, Any]] = {}
+        with self.session() as session:
+            for reason, condition in probes:
+                query = session.query(Invoice).options(defer(Invoice.ocr_text)).filter(condition)
+                if exclude_id is not None:
+                    query = query.filter(Invoice.id != exclude_id)
+                for invoice in query.order_by(Invoice.id.desc()).limit(duplicates.MAX_MATCHES):
+                    match = matches.setdefault(invoice.id, dict(self._to_dict(invoice), reasons=[]))
+                    match["reasons"].append(reason)
+        return list(matches.values())[:duplicates.MAX_MATCHES]
+
     def create_invoice(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = dates.date_fields(money.cents_fields(data))
         invoice = Invoice(
             invoice_date=data.get("invoice_date"),
+            invoice_day=dates.to_ordinal(data.get("invoice_date")),
             invoice_number=data.get("invoice_number"),
             company_name=data.get("company_name"),
-            total_amount=data.get("total_amount"),
+            vendor_id=self.get_or_create_vendor(data.get("company_name")),
+            total_cents=data.get("total_cents"),
             entered_by=data.get("entered_by"),
             notes=data.get("notes"),
             pdf_path=data.get("pdf_path"),
             payment_status=data.get("payment_status", "unpaid"),
             payment_proof_path=data.get("payment_proof_path"),
             payment_date=data.get("payment_date"),
+            credit_cents=data.get("credit_cents", 0),
+            paid_cents=data.get("paid_cents", 0),
+            ocr_text=data.get("ocr_text"),
+            invoice_number_key=duplicates.normalize_invoice_number(data.get("invoice_number")),
+            pdf_sha256=data.get("pdf_sha256"),
         )
         with self.session() as session:
             session.add(invoice)
@@ -159,78 +790,319 @@ class SQLiteBackend:
             session.refresh(invoice)
             return self._to_dict(invoice)
 
+    def import_invoices(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Insert many invoices in one transaction (one executemany); vendors are resolved once per name."""
+        prepared = [dates.date_fields(money.cents_fields(data)) for data in rows]
+        vendor_ids = {
+            name: self.get_or_create_vendor(name)
+            for name in {data.get("company_name") for data in prepared}
+        }
+        values = []
+        for data in prepared:
+            row = _new_invoice_values(data, vendor_ids[data.get("company_name")])
+            row["invoice_day"] = dates.to_ordinal(row["invoice_day"])
+            values.append(row)
+        if values:
+            with self.session() as session:
+                session.execute(insert(Invoice), values)
+        return len(values)
+
     def get_invoices(
         self,
         company_name: Optional[str] = None,
         invoice_number: Optional[str] = None,
         date_from: Optional[str] = None,
         date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
+        """List invoices, newest first; with ``q``, the best full-text matches first."""
         with self.session() as session:
-            query = session.query(Invoice)
+            query = session.query(Invoice).options(defer(Invoice.ocr_text))
+            if vendor_id:
+                query = query.filter(Invoice.vendor_id == vendor_id)
             if company_name:
                 query = query.filter(Invoice.company_name.ilike(f"%{company_name}%"))
             if invoice_number:
                 query = query.filter(Invoice.invoice_number.ilike(f"%{invoice_number}%"))
             if date_from:
-                query = query.filter(Invoice.invoice_date >= date_from)
+                query = query.filter(Invoice.invoice_day >= dates.to_ordinal(dates.normalize_date(date_from)))
             if date_to:
-                query = query.filter(Invoice.invoice_date <= date_to)
+                query = query.filter(Invoice.invoice_day <= dates.to_ordinal(dates.normalize_date(date_to)))
 
-            invoices = query.order_by(Invoice.invoice_date.desc(), Invoice.id.desc()).all()
+            if q and self.fts_enabled:
+                match = _fts_query(q)
+                if not match:
+                    return []
+                # bm25 weights: invoice_number, company_name, notes, ocr_text (lower rank = better).
+                # FTS5 walks the index in rowid order, so the inner LIMIT stops early.
+                ranked = text("""
+                    SELECT rowid AS id, bm25(invoices_fts, 10.0, 5.0, 2.0, 1.0) AS rank
+                    FROM invoices_fts WHERE invoices_fts MATCH :match
+                    ORDER BY rowid DESC LIMIT :candidates
+                """).bindparams(match=match, candidates=SEARCH_CANDIDATES).columns(
+                    id=Integer, rank=Float
+                ).subquery("ranked")
+                query = query.join(ranked, ranked.c.id == Invoice.id).order_by(ranked.c.rank, Invoice.id.desc())
+                invoices = query.limit(SEARCH_LIMIT).all()
+            elif q:
+                pattern = f"%{q}%"
+                query = query.filter(
+                    Invoice.invoice_number.ilike(pattern)
+                    | Invoice.company_name.ilike(pattern)
+                    | Invoice.notes.ilike(pattern)
+                    | Invoice.ocr_text.ilike(pattern)
+                )
+                invoices = query.order_by(Invoice.invoice_day.desc(), Invoice.id.desc()).limit(SEARCH_LIMIT).all()
+            else:
+                invoices = query.order_by(Invoice.invoice_day.desc(), Invoice.id.desc()).all()
             return [self._to_dict(invoice) for invoice in invoices]
 
-    def update_invoice(self, invoice_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
         with self.session() as session:
             invoice: Optional[Invoice] = session.get(Invoice, invoice_id)
-            if not invoice:
-                return None
-            for key, value in data.items():
-                if hasattr(invoice, key):
-                    setattr(invoice, key, value)
-            session.add(invoice)
-            session.flush()
-            session.refresh(invoice)
-            return self._to_dict(invoice)
+            return self._to_dict(invoice) if invoice else None
+
+    def update_invoice(
+        self, invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Update the writable columns in ``data``; with ``expected_version``, only if the invoice is still at it.
+
+        Raises:
+            VersionConflictError: If the invoice has moved past ``expected_version``.
+        """
+        data = dates.date_fields(money.cents_fields(data))
+        if data.get("invoice_date"):
+            data["invoice_day"] = dates.to_ordinal(data["invoice_date"])
+        if data.get("company_name"):
+            data["vendor_id"] = self.get_or_create_vendor(data["company_name"])
+        if "invoice_number" in data:
+            data["invoice_number_key"] = duplicates.normalize_invoice_number(data["invoice_number"])
+        values = {key: value for key, value in data.items() if key in _WRITABLE_COLUMNS}
+        if not values:
+            return self.get_invoice(invoice_id)
+
+        statement = update(Invoice).where(Invoice.id == invoice_id)
+        if expected_version is not None:
+            statement = statement.where(Invoice.version == expected_version)
+        with self.session() as session:
+            result = session.execute(statement.values(**values).execution_options(synchronize_session=False))
+            invoice: Optional[Invoice] = session.get(Invoice, invoice_id)
+            if result.rowcount == 0 and invoice is not None:
+                raise VersionConflictError(invoice_id, expected_version, invoice.version)
+            return self._to_dict(invoice) if invoice else None
 
     def delete_invoice(self, invoice_id: int) -> bool:
         with self.session() as session:
             invoice: Optional[Invoice] = session.get(Invoice, invoice_id)
             if not invoice:
                 return False
+            # SQLite does not enforce ON DELETE CASCADE unless foreign keys are switched on
+            session.query(PaymentHistory).filter(PaymentHistory.invoice_id == invoice_id).delete(
+                synchronize_session=False
+            )
             session.delete(invoice)
             return True
 
+    def apply_payment(
+        self,
+        invoice_id: int,
+        amount_cents: int,
+        payment_date: str,
+        payment_proof_path: Optional[str] = None,
+        credit_cents: Optional[int] = None,
+        notes: Optional[str] = None,
+        expected_version: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Record a payment atomically and return the updated invoice.
+
+        The overpayment check happens inside a conditional UPDATE, so concurrent
+        payments cannot race past it; the history row is written in the same
+        transaction. Returns None when the invoice does not exist.
+        """
+        from datetime import datetime
+        payment_date = dates.normalize_date(payment_date)
+        new_paid = Invoice.paid_cents + amount_cents
+        values: Dict[str, Any] = {
+            "paid_cents": new_paid,
+            "payment_status": case(
+                (new_paid >= Invoice.total_cents, "paid"),
+                (new_paid > 0, "partial"),
+                else_="unpaid",
+            ),
+            "payment_date": payment_date,
+        }
+        if payment_proof_path:
+            values["payment_proof_path"] = payment_proof_path
+        if credit_cents is not None:
+            values["credit_cents"] = credit_cents
+
+        statement = update(Invoice).where(Invoice.id == invoice_id, new_paid <= Invoice.total_cents)
+        if expected_version is not None:
+            statement = statement.where(Invoice.version == expected_version)
+        with self.session() as session:
+            result = session.execute(statement.values(**values).execution_options(synchronize_session=False))
+            if result.rowcount == 0:
+                invoice: Optional[Invoice] = session.get(Invoice, invoice_id)
+                if not invoice:
+                    return None
+                if expected_version is not None and invoice.version != expected_version:
+                    raise VersionConflictError(invoice_id, expected_version, invoice.version)
+                raise OverpaymentError(invoice.total_cents, invoice.paid_cents, amount_cents)
+
+            session.add(PaymentHistory(
+                invoice_id=invoice_id,
+                amount_cents=amount_cents,
+                payment_date=payment_date,
+                payment_proof_path=payment_proof_path,
+                notes=notes if notes is not None else f"Payment of ${money.format_cents(amount_cents)}",
+                created_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            ))
+            session.flush()
+            invoice = session.get(Invoice, invoice_id)
+            return self._to_dict(invoice)
+
+    def bulk_mark_paid(self, invoice_ids: List[int], payment_date: str) -> int:
+        """Pay off the remaining balance of many invoices in one transaction.
+
+        Each chunk costs one multi-row payment_history INSERT ... SELECT and one
+        UPDATE ... WHERE id IN (...). Returns the number of invoices updated.
+        """
+        from datetime import datetime
+        payment_date = dates.normalize_date(payment_date)
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        insert_history = text("""
+            INSERT INTO payment_history
+            (invoice_id, amount_cents, payment_date, payment_proof_path, notes, created_at)
+            SELECT id, total_cents - paid_cents, :payment_date, NULL,
+                   printf('Bulk payment of $%d.%02d', (total_cents - paid_cents) / 100, (total_cents - paid_cents) % 100),
+                   :created_at
+            FROM invoices
+            WHERE id IN :ids AND paid_cents < total_cents
+        """).bindparams(bindparam("ids", expanding=True))
+        mark_paid = text("""
+            UPDATE invoices
+            SET paid_cents = total_cents, payment_status = 'paid', payment_date = :payment_date
+            WHERE id IN :ids AND paid_cents < total_cents
+        """).bindparams(bindparam("ids", expanding=True))
+
+        updated = 0
+        with self.engine.begin() as conn:
+            for chunk in _chunks(invoice_ids):
+                params = {"ids": chunk, "payment_date": payment_date, "created_at": created_at}
+                conn.execute(insert_history, params)
+                updated += conn.execute(mark_paid, params).rowcount
+        return updated
+
+    def bulk_update_credit(self, invoice_ids: List[int], credit_cents: int) -> int:
+        """Set the same credit on many invoices. Returns the number of invoices updated."""
+        statement = text(
+            "UPDATE invoices SET credit_cents = :credit_cents WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        updated = 0
+        with self.engine.begin() as conn:
+            for chunk in _chunks(invoice_ids):
+                updated += conn.execute(statement, {"ids": chunk, "credit_cents": credit_cents}).rowcount
+        return updated
+
+    def bulk_delete(self, invoice_ids: List[int]) -> List[str]:
+        """Delete many invoices and their payment history in one transaction.
+
+        Returns the stored file paths the deleted invoices and their payment
+        records referenced, for the caller to queue for deletion. Nothing
+        checks other rows: each upload is stored under its own name, so no
+        other invoice refers to these files.
+        """
+        select_files = text("""
+            SELECT pdf_path FROM invoices WHERE id IN :ids AND pdf_path IS NOT NULL
+            UNION
+            SELECT payment_proof_path FROM invoices WHERE id IN :ids AND payment_proof_path IS NOT NULL
+            UNION
+            SELECT payment_proof_path FROM payment_history WHERE invoice_id IN :ids AND payment_proof_path IS NOT NULL
+        """).bindparams(bindparam("ids", expanding=True))
+        delete_history = text(
+            "DELETE FROM payment_history WHERE invoice_id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+        delete_invoices = text(
+            "DELETE FROM invoices WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+
+        files: List[str] = []
+        with self.engine.begin() as conn:
+            for chunk in _chunks(invoice_ids):
+                files.extend(row[0] for row in conn.execute(select_files, {"ids": chunk}))
+                conn.execute(delete_history, {"ids": chunk})
+                conn.execute(delete_invoices, {"ids": chunk})
+        return files
+
+    def list_file_references(self) -> Set[str]:
+        """Return every storage path still referenced by an invoice or payment record."""
+        with self.engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT pdf_path FROM invoices WHERE pdf_path IS NOT NULL
+                UNION
+                SELECT payment_proof_path FROM invoices WHERE payment_proof_path IS NOT NULL
+                UNION
+                SELECT payment_proof_path FROM payment_history WHERE payment_proof_path IS NOT NULL
+            """))
+            return {row[0] for row in result.fetchall()}
+
+    def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Exact money totals over invoices dated within [date_from, date_to], summed in SQL."""
+        with self.session() as session:
+            query = session.query(
+                func.count(Invoice.id),
+                func.coalesce(func.sum(Invoice.total_cents), 0),
+                func.coalesce(func.sum(Invoice.paid_cents), 0),
+                func.coalesce(func.sum(Invoice.credit_cents), 0),
+            )
+            if date_from:
+                query = query.filter(Invoice.invoice_day >= dates.to_ordinal(dates.normalize_date(date_from)))
+            if date_to:
+                query = query.filter(Invoice.invoice_day <= dates.to_ordinal(dates.normalize_date(date_to)))
+            count, total_cents, paid_cents, credit_cents = query.one()
+        return money.add_amounts({
+            "invoice_count": count,
+            "total_cents": total_cents,
+            "paid_cents": paid_cents,
+            "credit_cents": credit_cents,
+        })
+
     @staticmethod
     def _to_dict(invoice: Invoice) -> Dict[str, Any]:
-        return {
+        return _hydrate({
             "id": invoice.id,
             "invoice_date": invoice.invoice_date,
             "invoice_number": invoice.invoice_number,
             "company_name": invoice.company_name,
-            "total_amount": invoice.total_amount,
+            "vendor_id": invoice.vendor_id,
+            "total_cents": invoice.total_cents,
             "entered_by": invoice.entered_by,
             "notes": invoice.notes,
             "pdf_path": invoice.pdf_path,
             "payment_status": invoice.payment_status,
             "payment_proof_path": invoice.payment_proof_path,
             "payment_date": invoice.payment_date,
-            "credit": invoice.credit,
-            "paid_amount": invoice.paid_amount,
-        }
+            "credit_cents": invoice.credit_cents,
+            "paid_cents": invoice.paid_cents,
+            "payment_count": invoice.payment_count,
+            "last_payment_date": invoice.last_payment_date,
+            "version": invoice.version,
+        })
 
 
     def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
         """创建付款历史记录"""
         from datetime import datetime
+        data = dates.date_fields(money.cents_fields(data))
         with self.engine.connect() as conn:
             result = conn.execute(text("""
                 INSERT INTO payment_history 
-                (invoice_id, payment_amount, payment_date, payment_proof_path, notes, created_at)
-                VALUES (:invoice_id, :payment_amount, :payment_date, :payment_proof_path, :notes, :created_at)
+                (invoice_id, amount_cents, payment_date, payment_proof_path, notes, created_at)
+                VALUES (:invoice_id, :amount_cents, :payment_date, :payment_proof_path, :notes, :created_at)
             """), {
                 'invoice_id': data['invoice_id'],
-                'payment_amount': data['payment_amount'],
+                'amount_cents': data['amount_cents'],
                 'payment_date': data['payment_date'],
                 'payment_proof_path': data.get('payment_proof_path'),
                 'notes': data.get('notes', ''),
@@ -243,72 +1115,346 @@ class SQLiteBackend:
         """获取发票的付款历史记录"""
         with self.engine.connect() as conn:
             result = conn.execute(text("""
-                SELECT id, invoice_id, payment_amount, payment_date, 
+                SELECT id, invoice_id, amount_cents, payment_date, 
                        payment_proof_path, notes, created_at
                 FROM payment_history
                 WHERE invoice_id = :invoice_id
-                ORDER BY created_at DESC
+                ORDER BY created_at DESC, id DESC
             """), {'invoice_id': invoice_id})
             
             records = []
             for row in result.fetchall():
-                records.append({
+                records.append(_hydrate({
                     'id': row[0],
                     'invoice_id': row[1],
-                    'payment_amount': row[2],
+                    'amount_cents': row[2],
                     'payment_date': row[3],
                     'payment_proof_path': row[4],
                     'notes': row[5],
                     'created_at': row[6]
-                })
+                }))
             return records
 
+    def get_payment_history_many(self, invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """获取多张发票的付款历史记录 (one IN query per chunk, grouped by invoice)"""
+        statement = text("""
+            SELECT id, invoice_id, amount_cents, payment_date,
+                   payment_proof_path, notes, created_at
+            FROM payment_history
+            WHERE invoice_id IN :ids
+            ORDER BY invoice_id, created_at DESC, id DESC
+        """).bindparams(bindparam("ids", expanding=True))
+
+        grouped: Dict[int, List[Dict[str, Any]]] = {invoice_id: [] for invoice_id in invoice_ids}
+        with self.engine.connect() as conn:
+            for chunk in _chunks(invoice_ids):
+                for row in conn.execute(statement, {"ids": chunk}):
+                    grouped[row[1]].append(_hydrate({
+                        'id': row[0],
+                        'invoice_id': row[1],
+                        'amount_cents': row[2],
+                        'payment_date': row[3],
+                        'payment_proof_path': row[4],
+                        'notes': row[5],
+                        'created_at': row[6]
+                    }))
+        return grouped
+
 
 # ---------- Supabase Backend ----------
 
+# Schema shared by the Supabase backend (created through its direct database
+# connection) and the Postgres backend: tables, indexes and the SQL functions
+# both call (search_invoices, apply_payment, bulk_mark_paid, invoice_totals)
+_POSTGRES_TABLES_DDL = """
+create table if not exists public.vendors (
+    id bigint generated by default as identity primary key,
+    name text not null,
+    normalized_key text not null unique,
+    created_at timestamp with time zone default now()
+);
+
+create table if not exists public.invoices (
+    id bigint generated by default as identity primary key,
+    invoice_date text not null,
+    invoice_day date,
+    ocr_text text,
+    invoice_number text not null,
+    company_name text not null,
+    vendor_id bigint references public.vendors(id),
+    invoice_number_key text,
+    pdf_sha256 text,
+    total_cents bigint not null,
+    entered_by text not null,
+    notes text,
+    pdf_path text,
+    payment_status text default 'unpaid' not null,
+    payment_proof_path text,
+    payment_date text,
+    credit_cents bigint default 0 not null,
+    paid_cents bigint default 0 not null,
+    payment_count integer default 0 not null,
+    last_payment_date text,
+    inserted_at timestamp with time zone default now(),
+    updated_at timestamp with time zone default now() not null,
+    version integer default 1 not null
+);
+"""
+
+_POSTGRES_PAYMENT_HISTORY_DDL = """
+create table if not exists public.payment_history (
+    id bigint generated by default as identity primary key,
+    invoice_id bigint not null references public.invoices(id) on delete cascade,
+    amount_cents bigint not null,
+    payment_date text not null,
+    payment_proof_path text,
+    notes text,
+    created_at timestamp with time zone default now()
+);
+create index if not exists idx_payment_history_invoice_id on public.payment_history (invoice_id);
+"""
+
+_POSTGRES_FUNCTIONS_DDL = """
+create index if not exists idx_invoices_invoice_day on public.invoices (invoice_day desc, id desc);
+create index if not exists idx_invoices_vendor_id on public.invoices (vendor_id);
+create index if not exists idx_invoices_vendor_number on public.invoices (vendor_id, invoice_number_key);
+create index if not exists idx_invoices_fingerprint on public.invoices (vendor_id, total_cents, invoice_day);
+create index if not exists idx_invoices_pdf_sha256 on public.invoices (pdf_sha256);
+
+-- Full-text index; search_invoices() must use the identical expression to hit it
+create index if not exists idx_invoices_search on public.invoices using gin (
+    to_tsvector('simple',
+        coalesce(invoice_number, '') || ' ' || coalesce(company_name, '') || ' ' ||
+        coalesce(notes, '') || ' ' || coalesce(ocr_text, ''))
+);
+
+create or replace function public.search_invoices(
+    p_query text,
+    p_limit integer default 200,
+    p_candidates integer default 5000
+)
+returns setof public.invoices
+language sql
+stable
+as $$
+    with query as (
+        select websearch_to_tsquery('simple', p_query) as tsq
+    ),
+    candidates as (
+        select i.id,
+               to_tsvector('simple',
+                   coalesce(i.invoice_number, '') || ' ' || coalesce(i.company_name, '') || ' ' ||
+                   coalesce(i.notes, '') || ' ' || coalesce(i.ocr_text, '')) as document
+        from public.invoices i, query
+        where to_tsvector('simple',
+                  coalesce(i.invoice_number, '') || ' ' || coalesce(i.company_name, '') || ' ' ||
+                  coalesce(i.notes, '') || ' ' || coalesce(i.ocr_text, '')) @@ query.tsq
+        order by i.id desc
+        limit p_candidates
+    )
+    select i.*
+    from candidates c
+    join public.invoices i on i.id = c.id
+    cross join query
+    order by ts_rank_cd(c.document, query.tsq) desc, c.id desc
+    limit p_limit;
+$$;
+
+create or replace function public.sync_invoice_payment_stats()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'INSERT' then
+        update public.invoices
+        set payment_count = payment_count + 1,
+            last_payment_date = greatest(last_payment_date, new.payment_date)
+        where id = new.invoice_id;
+        return new;
+    end if;
+
+    update public.invoices
+    set payment_count = greatest(payment_count - 1, 0),
+        last_payment_date = (
+            select max(payment_date) from public.payment_history where invoice_id = old.invoice_id
+        )
+    where id = old.invoice_id;
+    return old;
+end;
+$$;
+
+drop trigger if exists trg_payment_history_stats on public.payment_history;
+create trigger trg_payment_history_stats
+after insert or delete on public.payment_history
+for each row execute function public.sync_invoice_payment_stats();
+
+-- Change tracking: every write moves updated_at (read mirror pulls), a change to a column in
+-- _VERSIONED_COLUMNS bumps version (conditional updates), every delete leaves a tombstone
+create index if not exists idx_invoices_updated_at on public.invoices (updated_at);
+
+create table if not exists public.invoice_deletions (
+    id bigint generated by default as identity primary key,
+    invoice_id bigint not null,
+    deleted_at timestamp with time zone default now() not null
+);
+create index if not exists idx_invoice_deletions_deleted_at on public.invoice_deletions (deleted_at);
+
+create or replace function public.touch_invoice_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+drop trigger if exists trg_invoices_updated_at on public.invoices;
+create trigger trg_invoices_updated_at
+before update on public.invoices
+for each row execute function public.touch_invoice_updated_at();
+
+create or replace function public.bump_invoice_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.version = old.version + 1;
+    return new;
+end;
+$$;
+
+drop trigger if exists trg_invoices_version on public.invoices;
+create trigger trg_invoices_version
+before update of
+    invoice_date, invoice_number, company_name, total_cents, entered_by, notes, pdf_path,
+    payment_status, payment_proof_path, payment_date, credit_cents, paid_cents
+on public.invoices
+for each row
+when (new.version = old.version and (
+    old.invoice_date, old.invoice_number, old.company_name, old.total_cents, old.entered_by, old.notes, old.pdf_path,
+    old.payment_status, old.payment_proof_path, old.payment_date, old.credit_cents, old.paid_cents
+) is distinct from (
+    new.invoice_date, new.invoice_number, new.company_name, new.total_cents, new.entered_by, new.notes, new.pdf_path,
+    new.payment_status, new.payment_proof_path, new.payment_date, new.credit_cents, new.paid_cents
+))
+execute function public.bump_invoice_version();
+
+create or replace function public.record_invoice_deletion()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into public.invoice_deletions (invoice_id) values (old.id);
+    return old;
+end;
+$$;
+
+drop trigger if exists trg_invoices_deletion on public.invoices;
+create trigger trg_invoices_deletion
+after delete on public.invoices
+for each row execute function public.record_invoice_deletion();
+
+drop function if exists public.apply_payment(bigint, numeric, text, text, numeric, text);
+drop function if exists public.apply_payment(bigint, bigint, text, text, bigint, text);
+create or replace function public.apply_payment(
+    p_invoice_id bigint,
+    p_amount_cents bigint,
+    p_payment_date text,
+    p_proof_path text default null,
+    p_credit_cents bigint default null,
+    p_notes text default null,
+    p_expected_version integer default null
+)
+returns setof public.invoices
+language plpgsql
+as $$
+declare
+    result public.invoices;
+begin
+    update public.invoices
+    set paid_cents = paid_cents + p_amount_cents,
+        payment_status = case
+            when paid_cents + p_amount_cents >= total_cents then 'paid'
+            when paid_cents + p_amount_cents > 0 then 'partial'
+            else 'unpaid'
+        end,
+        payment_date = p_payment_date,
+        payment_proof_path = coalesce(p_proof_path, payment_proof_path),
+        credit_cents = coalesce(p_credit_cents, credit_cents)
+    where id = p_invoice_id
+      and paid_cents + p_amount_cents <= total_cents
+      and (p_expected_version is null or version = p_expected_version);
+
+    if not found then
+        if exists (
+            select 1 from public.invoices
+            where id = p_invoice_id and p_expected_version is not null and version <> p_expected_version
+        ) then
+            raise exception 'version conflict';
+        end if;
+        if exists (select 1 from public.invoices where id = p_invoice_id) then
+            raise exception 'overpayment';
+        end if;
+        return;
+    end if;
+
+    insert into public.payment_history (invoice_id, amount_cents, payment_date, payment_proof_path, notes)
+    values (p_invoice_id, p_amount_cents, p_payment_date, p_proof_path, p_notes);
+
+    -- Read back after sync_invoice_payment_stats has updated payment_count / last_payment_date
+    select * into result from public.invoices where id = p_invoice_id;
+    return next result;
+end;
+$$;
+
+create or replace function public.bulk_mark_paid(p_ids bigint[], p_payment_date text)
+returns integer
+language plpgsql
+as $$
+declare
+    updated integer;
+begin
+    -- Lock the unpaid rows before reading their balance (in id order, so overlapping calls never
+    -- deadlock); a row paid meanwhile is rechecked after the wait and drops out. History rows come
+    -- from the rows actually updated, so a concurrent call or apply_payment cannot double them up.
+    with due as (
+        select id, total_cents - paid_cents as amount
+        from public.invoices
+        where id = any(p_ids) and paid_cents < total_cents
+        order by id
+        for update
+    ), paid as (
+        update public.invoices i
+        set paid_cents = i.total_cents, payment_status = 'paid', payment_date = p_payment_date
+        from due
+        where i.id = due.id
+        returning i.id, due.amount
+    )
+    insert into public.payment_history (invoice_id, amount_cents, payment_date, notes)
+    select id, amount, p_payment_date, 'Bulk payment of $' || to_char(amount / 100.0, 'FM999999999990.00')
+    from paid;
+    get diagnostics updated = row_count;
+    return updated;
+end;
+$$;
+
+drop function if exists public.invoice_totals(text, text);
+create or replace function public.invoice_totals(p_date_from date default null, p_date_to date default null)
+returns table (invoice_count bigint, total_cents bigint, paid_cents bigint, credit_cents bigint)
+language sql
+stable
+as $$
+    select count(*),
+           coalesce(sum(i.total_cents), 0)::bigint,
+           coalesce(sum(i.paid_cents), 0)::bigint,
+           coalesce(sum(i.credit_cents), 0)::bigint
+    from public.invoices i
+    where (p_date_from is null or i.invoice_day >= p_date_from)
+      and (p_date_to is null or i.invoice_day <= p_date_to);
+$$;
+"""
 
-    def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
-        """创建付款历史记录"""
-        from datetime import datetime
-        with self.engine.connect() as conn:
-            result = conn.execute(text("""
-                INSERT INTO payment_history 
-                (invoice_id, payment_amount, payment_date, payment_proof_path, notes, created_at)
-                VALUES (:invoice_id, :payment_amount, :payment_date, :payment_proof_path, :notes, :created_at)
-            """), {
-                'invoice_id': data['invoice_id'],
-                'payment_amount': data['payment_amount'],
-                'payment_date': data['payment_date'],
-                'payment_proof_path': data.get('payment_proof_path'),
-                'notes': data.get('notes', ''),
-                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
-            conn.commit()
-            return result.lastrowid
-    
-    def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]:
-        """获取发票的付款历史记录"""
-        with self.engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT id, invoice_id, payment_amount, payment_date, 
-                       payment_proof_path, notes, created_at
-                FROM payment_history
-                WHERE invoice_id = :invoice_id
-                ORDER BY created_at DESC
-            """), {'invoice_id': invoice_id})
-            
-            records = []
-            for row in result.fetchall():
-                records.append({
-                    'id': row[0],
-                    'invoice_id': row[1],
-                    'payment_amount': row[2],
-                    'payment_date': row[3],
-                    'payment_proof_path': row[4],
-                    'notes': row[5],
-                    'created_at': row[6]
-                })
-            return records
 
 class SupabaseBackend:
     def __init__(self) -> None:
@@ -325,10 +1471,26 @@ class SupabaseBackend:
         self._ensure_table_exists()
 
     def create_invoice(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = dates.date_fields(money.cents_fields(data))
+        data["invoice_day"] = data.get("invoice_date")
+        data["vendor_id"] = self.get_or_create_vendor(data.get("company_name"))
+        data["invoice_number_key"] = duplicates.normalize_invoice_number(data.get("invoice_number"))
         response = self.client.table("invoices").insert(data).execute()
         if response.data:
-            return response.data[0]
-        return data
+            return _hydrate(response.data[0])
+        return _hydrate(data)
+
+    def import_invoices(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Insert many invoices, one PostgREST request per BULK_CHUNK_SIZE rows."""
+        prepared = [dates.date_fields(money.cents_fields(data)) for data in rows]
+        vendor_ids = {
+            name: self.get_or_create_vendor(name)
+            for name in {data.get("company_name") for data in prepared}
+        }
+        values = [_new_invoice_values(data, vendor_ids[data.get("company_name")]) for data in prepared]
+        for start in range(0, len(values), BULK_CHUNK_SIZE):
+            self.client.table("invoices").insert(values[start:start + BULK_CHUNK_SIZE], returning="minimal").execute()
+        return len(values)
 
     def get_invoices(
         self,
@@ -336,41 +1498,294 @@ class SupabaseBackend:
         invoice_number: Optional[str] = None,
         date_from: Optional[str] = None,
         date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
-        query = self.client.table("invoices").select("*")
+        """List invoices, newest first; with ``q``, ranked by the ``search_invoices`` SQL function."""
+        if q:
+            query = self.client.rpc("search_invoices", {
+                "p_query": q, "p_limit": SEARCH_LIMIT, "p_candidates": SEARCH_CANDIDATES,
+            })
+        else:
+            query = self.client.table("invoices").select(SUPABASE_LIST_COLUMNS)
+        if vendor_id:
+            query = query.eq("vendor_id", vendor_id)
         if company_name:
             query = query.ilike("company_name", f"%{company_name}%")
         if invoice_number:
             query = query.ilike("invoice_number", f"%{invoice_number}%")
         if date_from:
-            query = query.gte("invoice_date", date_from)
+            query = query.gte("invoice_day", dates.normalize_date(date_from))
         if date_to:
-            query = query.lte("invoice_date", date_to)
+            query = query.lte("invoice_day", dates.normalize_date(date_to))
+
+        if not q:
+            query = query.order("invoice_day", desc=True, nullsfirst=False).order("id", desc=True)
+        response = query.execute()
+        rows = response.data or []
+        for row in rows:
+            row.pop("ocr_text", None)
+        return [_hydrate(row) for row in rows]
+
+    def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        response = self.client.table("invoices").select("*").eq("id", invoice_id).limit(1).execute()
+        if response.data:
+            return _hydrate(response.data[0])
+        return None
 
-        response = query.order("invoice_date", desc=True).order("id", desc=True).execute()
-        return response.data or []
+    def update_invoice(
+        self, invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Update the writable columns in ``data``; with ``expected_version``, only if the invoice is still at it.
 
-    def update_invoice(self, invoice_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        response = self.client.table("invoices").update(data).eq("id", invoice_id).execute()
+        Raises:
+            VersionConflictError: If the invoice has moved past ``expected_version``.
+        """
+        data = dates.date_fields(money.cents_fields(data))
+        if data.get("invoice_date"):
+            data["invoice_day"] = data["invoice_date"]
+        if data.get("company_name"):
+            data["vendor_id"] = self.get_or_create_vendor(data["company_name"])
+        if "invoice_number" in data:
+            data["invoice_number_key"] = duplicates.normalize_invoice_number(data["invoice_number"])
+        values = {key: value for key, value in data.items() if key in _WRITABLE_COLUMNS}
+        if not values:
+            return self.get_invoice(invoice_id)
+        query = self.client.table("invoices").update(values).eq("id", invoice_id)
+        if expected_version is not None:
+            query = query.eq("version", expected_version)
+        response = query.execute()
         if response.data:
-            return response.data[0]
+            return _hydrate(response.data[0])
+        if expected_version is not None:
+            current = self.get_invoice(invoice_id)
+            if current:
+                raise VersionConflictError(invoice_id, expected_version, current["version"])
         return None
 
+    def get_or_create_vendor(self, name: Optional[str]) -> Optional[int]:
+        """Return the id of the vendor ``name`` normalizes to, creating it on first use."""
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        inserted = (
+            self.client.table("vendors")
+            .upsert({"name": name.strip(), "normalized_key": key}, on_conflict="normalized_key", ignore_duplicates=True)
+            .execute()
+        )
+        if inserted.data:
+            vendors.invalidate_index()
+            return inserted.data[0]["id"]
+        response = self.client.table("vendors").select("id").eq("normalized_key", key).limit(1).execute()
+        return response.data[0]["id"] if response.data else None
+
+    def find_duplicates(self, candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Existing invoices that look like ``candidate``, each with the ``reasons`` it matched.
+
+        The probes are OR-ed into one request; Postgres answers it with a
+        BitmapOr over the duplicate indexes.
+        """
+        vendor_id = None
+        key = vendors.normalize_vendor(candidate.get("company_name"))
+        if key:
+            response = self.client.table("vendors").select("id").eq("normalized_key", key).limit(1).execute()
+            vendor_id = response.data[0]["id"] if response.data else None
+        keys = _duplicate_keys(candidate, vendor_id)
+
+        conditions = []
+        if keys["vendor_id"] and keys["invoice_number_key"]:
+            conditions.append(f"and(vendor_id.eq.{keys['vendor_id']},invoice_number_key.eq.{keys['invoice_number_key']})")
+        if keys["pdf_sha256"]:
+            conditions.append(f"pdf_sha256.eq.{keys['pdf_sha256']}")
+        if keys["vendor_id"] and keys["total_cents"] is not None and keys["invoice_date"]:
+            conditions.append(
+                f"and(vendor_id.eq.{keys['vendor_id']},total_cents.eq.{keys['total_cents']},"
+                f"invoice_day.eq.{keys['invoice_date']})"
+            )
+        if not conditions:
+            return []
+
+        query = self.client.table("invoices").select(SUPABASE_DUPLICATE_COLUMNS).or_(",".join(conditions))
+        if exclude_id is not None:
+            query = query.neq("id", exclude_id)
+        response = query.order("id", desc=True).limit(duplicates.MAX_MATCHES * len(conditions)).execute()
+
+        matches = [_duplicate_match(row, keys) for row in response.data or []]
+        return matches[:duplicates.MAX_MATCHES]
+
+    def list_vendors(self) -> List[Dict[str, Any]]:
+        """All vendors with their invoice counts (feeds the autocomplete index)."""
+        rows = self._select_all("vendors", "id,name,normalized_key,invoices(count)")
+        for row in rows:
+            counts = row.pop("invoices", None) or [{}]
+            row["invoice_count"] = counts[0].get("count", 0)
+        return rows
+
     def delete_invoice(self, invoice_id: int) -> bool:
         response = self.client.table("invoices").delete().eq("id", invoice_id).execute()
         return bool(response.data)
 
-    def _ensure_table_exists(self) -> None:
-        password = os.getenv("SUPABASE_DB_PASSWORD")
-        if not password:
-            return
-
+    def apply_payment(
+        self,
+        invoice_id: int,
+        amount_cents: int,
+        payment_date: str,
+        payment_proof_path: Optional[str] = None,
+        credit_cents: Optional[int] = None,
+        notes: Optional[str] = None,
+        expected_version: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Record a payment through the ``apply_payment`` SQL function (one round trip, one transaction)."""
+        payment_date = dates.normalize_date(payment_date)
         try:
-            from urllib.parse import urlparse
-            import psycopg  # type: ignore
-        except ModuleNotFoundError:
-            return
-
+            response = self.client.rpc("apply_payment", {
+                "p_invoice_id": invoice_id,
+                "p_amount_cents": amount_cents,
+                "p_payment_date": payment_date,
+                "p_proof_path": payment_proof_path,
+                "p_credit_cents": credit_cents,
+                "p_notes": notes if notes is not None else f"Payment of ${money.format_cents(amount_cents)}",
+                "p_expected_version": expected_version,
+            }).execute()
+        except Exception as exc:
+            message = str(exc).lower()
+            if "overpayment" not in message and "version conflict" not in message:
+                raise
+            invoice = self.get_invoice(invoice_id)
+            if not invoice:
+                return None
+            if "version conflict" in message:
+                raise VersionConflictError(invoice_id, expected_version, invoice["version"]) from exc
+            raise OverpaymentError(invoice["total_cents"], invoice["paid_cents"], amount_cents) from exc
+        if response.data:
+            return _hydrate(response.data[0])
+        return None
+
+    def bulk_mark_paid(self, invoice_ids: List[int], payment_date: str) -> int:
+        """Pay off many invoices; each chunk is one transactional RPC (see ``bulk_mark_paid`` SQL)."""
+        payment_date = dates.normalize_date(payment_date)
+        updated = 0
+        for chunk in _chunks(invoice_ids):
+            response = self.client.rpc(
+                "bulk_mark_paid", {"p_ids": chunk, "p_payment_date": payment_date}
+            ).execute()
+            updated += int(response.data or 0)
+        return updated
+
+    def bulk_update_credit(self, invoice_ids: List[int], credit_cents: int) -> int:
+        updated = 0
+        for chunk in _chunks(invoice_ids):
+            response = (
+                self.client.table("invoices").update({"credit_cents": credit_cents}).in_("id", chunk).execute()
+            )
+            updated += len(response.data or [])
+        return updated
+
+    def bulk_delete(self, invoice_ids: List[int]) -> List[str]:
+        """Delete many invoices; payment_history rows go with them via ON DELETE CASCADE."""
+        files: List[str] = []
+        for chunk in _chunks(invoice_ids):
+            history = (
+                self.client.table("payment_history")
+                .select("payment_proof_path")
+                .in_("invoice_id", chunk)
+                .execute()
+            )
+            files.extend(row["payment_proof_path"] for row in history.data or [] if row.get("payment_proof_path"))
+            response = self.client.table("invoices").delete().in_("id", chunk).execute()
+            for row in response.data or []:
+                files.extend(row[key] for key in ("pdf_path", "payment_proof_path") if row.get(key))
+        return list(dict.fromkeys(files))
+
+    def list_file_references(self) -> Set[str]:
+        """Return every storage path still referenced by an invoice or payment record."""
+        references: Set[str] = set()
+        sources = (
+            ("invoices", "pdf_path,payment_proof_path"),
+            ("payment_history", "payment_proof_path"),
+        )
+        for table, columns in sources:
+            for row in self._select_all(table, columns):
+                references.update(value for value in row.values() if value)
+        return references
+
+    def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Exact money totals over invoices dated within [date_from, date_to].
+
+        Uses the ``invoice_totals`` SQL function (integer SUMs in Postgres); if it
+        is not installed, pages the cents columns and sums them in-process.
+        """
+        try:
+            response = self.client.rpc("invoice_totals", {
+                "p_date_from": dates.normalize_date(date_from) if date_from else None,
+                "p_date_to": dates.normalize_date(date_to) if date_to else None,
+            }).execute()
+            row = (response.data or [{}])[0]
+            totals = {key: int(row.get(key) or 0) for key in ("invoice_count", "total_cents", "paid_cents", "credit_cents")}
+        except Exception:
+            def date_range(query):
+                if date_from:
+                    query = query.gte("invoice_day", dates.normalize_date(date_from))
+                if date_to:
+                    query = query.lte("invoice_day", dates.normalize_date(date_to))
+                return query
+
+            rows = self._select_all("invoices", "total_cents,paid_cents,credit_cents", date_range)
+            totals = {"invoice_count": len(rows)}
+            for key in ("total_cents", "paid_cents", "credit_cents"):
+                totals[key] = money.sum_cents(row[key] for row in rows)
+        return money.add_amounts(totals)
+
+    def get_invoice_changes(self, since: Optional[str]) -> Tuple[List[Dict[str, Any]], List[int], Optional[str]]:
+        """Invoices written and invoice ids deleted after ``since`` (an ISO timestamp, None for all
+        invoices), and the newest change timestamp seen; feeds ``MirroredBackend``.
+
+        Rows carry every stored column with ``invoice_day`` as an ISO date.
+        Deletes are read from the ``invoice_deletions`` tombstones.
+        """
+        def after(column: str):
+            return lambda query: query.gt(column, since) if since else query
+
+        rows = self._select_all("invoices", SUPABASE_MIRROR_COLUMNS, after("updated_at"))
+        deletions = self._select_all("invoice_deletions", "id,invoice_id,deleted_at", after("deleted_at")) if since else []
+        latest = _latest_timestamp(
+            [row.pop("updated_at", None) for row in rows] + [row["deleted_at"] for row in deletions], since
+        )
+        return rows, [row["invoice_id"] for row in deletions], latest
+
+    def _select_all(self, table: str, columns: str, filters=None) -> List[Dict[str, Any]]:
+        """Page through a whole table; PostgREST caps each response at its max-rows setting.
+
+        Callers such as ``list_file_references`` treat the result as complete,
+        so paging only stops at an empty page, whatever the server's cap.
+        """
+        rows: List[Dict[str, Any]] = []
+        while True:
+            query = self.client.table(table).select(columns)
+            if filters:
+                query = filters(query)
+            response = (
+                query
+                .order("id")
+                .range(len(rows), len(rows) + SUPABASE_PAGE_SIZE - 1)
+                .execute()
+            )
+            page = response.data or []
+            if not page:
+                return rows
+            rows.extend(page)
+
+    def _ensure_table_exists(self) -> None:
+        password = os.getenv("SUPABASE_DB_PASSWORD")
+        if not password:
+            return
+
+        try:
+            from urllib.parse import urlparse
+            import psycopg  # type: ignore
+        except ModuleNotFoundError:
+            return
+
         parsed = urlparse(config.SUPABASE_URL)
         host_ref = parsed.netloc.split(".")[0] if parsed.netloc else ""
         host = f"db.{host_ref}.supabase.co"
@@ -384,24 +1799,6 @@ class SupabaseBackend:
             "sslmode": os.getenv("SUPABASE_DB_SSLMODE", "require"),
         }
 
-        ddl = """
-        create table if not exists public.invoices (
-            id bigint generated by default as identity primary key,
-            invoice_date text not null,
-            invoice_number text not null,
-            company_name text not null,
-            total_amount numeric not null,
-            entered_by text not null,
-            notes text,
-            pdf_path text,
-            payment_status text default 'unpaid' not null,
-            payment_proof_path text,
-            payment_date text,
-            credit numeric default 0.00 not null,
-            paid_amount numeric default 0.00 not null,
-            inserted_at timestamp with time zone default now()
-        );
-        """
         enable_rls = "alter table public.invoices enable row level security;"
         ensure_policies = """
         do $$
@@ -456,18 +1853,22 @@ class SupabaseBackend:
 
         try:
             with psycopg.connect(**connection_kwargs) as conn:
-                conn.execute(ddl)
+                conn.execute(_POSTGRES_TABLES_DDL)
                 conn.execute(enable_rls)
                 conn.execute(ensure_policies)
+                conn.execute(_POSTGRES_PAYMENT_HISTORY_DDL)
                 
                 # 自动迁移: 检测并添加缺失字段
                 self._auto_migrate_fields(conn)
+
+                conn.execute(_POSTGRES_FUNCTIONS_DDL)
                 
                 conn.commit()
         except Exception:
             return
     
-    def _auto_migrate_fields(self, conn) -> None:
+    @staticmethod
+    def _auto_migrate_fields(conn) -> None:
         """自动检测并添加缺失的字段"""
         try:
             # 1. 查询现有字段
@@ -478,11 +1879,22 @@ class SupabaseBackend:
             """)
             existing_columns = {row[0] for row in cursor.fetchall()}
             
-            # 2. 定义期望字段
-            required_fields = {
-                'credit': 'numeric default 0.00 not null',
-                'paid_amount': 'numeric default 0.00 not null'
-            }
+            # 2. 定义期望字段 (credit / paid_amount 只在旧版 numeric 表上补齐, 随后转换为分)
+            required_fields = {}
+            if 'total_amount' in existing_columns:
+                required_fields['credit'] = 'numeric default 0.00 not null'
+                required_fields['paid_amount'] = 'numeric default 0.00 not null'
+            required_fields['payment_count'] = 'integer default 0 not null'
+            required_fields['last_payment_date'] = 'text'
+            required_fields['invoice_day'] = 'date'
+            required_fields['ocr_text'] = 'text'
+            required_fields['vendor_id'] = 'bigint references public.vendors(id)'
+            required_fields['invoice_number_key'] = 'text'
+            required_fields['pdf_sha256'] = 'text'
+            required_fields['updated_at'] = 'timestamp with time zone default now() not null'
+            required_fields['version'] = 'integer default 1 not null'
+            for cents_field in ('total_cents', 'credit_cents', 'paid_cents'):
+                required_fields[cents_field] = 'bigint default 0 not null'
             
             # 3. 添加缺失字段
             for field_name, field_def in required_fields.items():
@@ -510,16 +1922,129 @@ class SupabaseBackend:
                             WHERE credit IS NULL
                         """)
                         print(f"Auto-migration: Set credit default value for existing invoices")
+                    elif field_name == 'payment_count':
+                        # 从 payment_history 回填付款次数
+                        conn.execute("""
+                            UPDATE public.invoices i
+                            SET payment_count = (
+                                SELECT COUNT(*) FROM public.payment_history h WHERE h.invoice_id = i.id
+                            )
+                        """)
+                        print(f"Auto-migration: Backfilled payment_count")
+                    elif field_name == 'last_payment_date':
+                        # 从 payment_history 回填最近付款日期
+                        conn.execute("""
+                            UPDATE public.invoices i
+                            SET last_payment_date = (
+                                SELECT MAX(payment_date) FROM public.payment_history h WHERE h.invoice_id = i.id
+                            )
+                        """)
+                        print(f"Auto-migration: Backfilled last_payment_date")
+                    elif field_name.endswith('_cents'):
+                        # 从旧版 numeric 字段换算为整数分; 旧字段保留(可为空)以便回滚
+                        legacy_field = next(k for k, v in money.CENTS_FIELDS.items() if v == field_name)
+                        if legacy_field in existing_columns or legacy_field in required_fields:
+                            conn.execute(f"""
+                                UPDATE public.invoices
+                                SET {field_name} = round({legacy_field} * 100)::bigint
+                            """)
+                            conn.execute(f"ALTER TABLE public.invoices ALTER COLUMN {legacy_field} DROP NOT NULL")
+                            print(f"Auto-migration: Converted {legacy_field} to {field_name}")
+
+            # 5. payment_history 金额换算为整数分
+            cursor = conn.execute("""
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_name = 'payment_history' AND table_schema = 'public'
+            """)
+            history_columns = {row[0] for row in cursor.fetchall()}
+            if 'amount_cents' not in history_columns:
+                print("Auto-migration: Adding column 'amount_cents' to payment_history")
+                conn.execute("ALTER TABLE public.payment_history ADD COLUMN amount_cents bigint default 0 not null")
+                conn.execute("""
+                    UPDATE public.payment_history
+                    SET amount_cents = round(payment_amount * 100)::bigint
+                """)
+                conn.execute("ALTER TABLE public.payment_history ALTER COLUMN payment_amount DROP NOT NULL")
+
+            # 6. 日期统一为 ISO 并回填 invoice_day (只处理尚未回填的行)
+            rows = conn.execute(
+                "SELECT id, invoice_date, payment_date FROM public.invoices WHERE invoice_day IS NULL"
+            ).fetchall()
+            updates, invalid = _normalize_date_rows(rows)
+            if updates:
+                with conn.cursor() as cursor:
+                    cursor.executemany("""
+                        UPDATE public.invoices
+                        SET invoice_date = %(d0)s, invoice_day = %(d0)s::date, payment_date = %(d1)s
+                        WHERE id = %(id)s
+                    """, updates)
+                print(f"Auto-migration: Normalized {len(updates)} invoice date(s)")
+            if invalid:
+                print(f"Auto-migration warning: {invalid} invoice(s) have an unrecognised invoice_date")
+
+            history = conn.execute(
+                "SELECT id, payment_date FROM public.payment_history WHERE payment_date !~ %s",
+                (dates.ISO_REGEX,),
+            ).fetchall()
+            history_updates, _ = _normalize_date_rows(history)
+            if history_updates:
+                with conn.cursor() as cursor:
+                    cursor.executemany(
+                        "UPDATE public.payment_history SET payment_date = %(d0)s WHERE id = %(id)s",
+                        history_updates,
+                    )
+                conn.execute("""
+                    UPDATE public.invoices i
+                    SET last_payment_date = (
+                        SELECT MAX(payment_date) FROM public.payment_history h WHERE h.invoice_id = i.id
+                    )
+                    WHERE payment_count > 0
+                """)
+                print(f"Auto-migration: Normalized {len(history_updates)} payment date(s)")
+
+            # 7. 为尚未关联的发票建立 vendor 记录并回填 vendor_id
+            names = [row[0] for row in conn.execute(
+                "SELECT DISTINCT company_name FROM public.invoices WHERE vendor_id IS NULL AND company_name IS NOT NULL"
+            ).fetchall()]
+            linked = 0
+            for name in names:
+                key = vendors.normalize_vendor(name)
+                if not key:
+                    continue
+                conn.execute("""
+                    INSERT INTO public.vendors (name, normalized_key) VALUES (%s, %s)
+                    ON CONFLICT (normalized_key) DO NOTHING
+                """, (name.strip(), key))
+                conn.execute("""
+                    UPDATE public.invoices
+                    SET vendor_id = (SELECT id FROM public.vendors WHERE normalized_key = %s)
+                    WHERE company_name = %s AND vendor_id IS NULL
+                """, (key, name))
+                linked += 1
+            if linked:
+                print(f"Auto-migration: Linked {linked} company name(s) to vendors")
+
+            # 8. 回填 invoice_number_key (与 duplicates.normalize_invoice_number 相同的规则)
+            rows = conn.execute(
+                "SELECT id, invoice_number FROM public.invoices WHERE invoice_number_key IS NULL"
+            ).fetchall()
+            if rows:
+                with conn.cursor() as cursor:
+                    cursor.executemany(
+                        "UPDATE public.invoices SET invoice_number_key = %s WHERE id = %s",
+                        [(duplicates.normalize_invoice_number(number), row_id) for row_id, number in rows],
+                    )
+                print(f"Auto-migration: Backfilled invoice_number_key for {len(rows)} invoice(s)")
         except Exception as e:
             print(f"Auto-migration warning: {e}")
 
-
-    
     def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
         """创建付款历史记录"""
+        data = dates.date_fields(money.cents_fields(data))
         record_data = {
             'invoice_id': data['invoice_id'],
-            'payment_amount': data['payment_amount'],
+            'amount_cents': data['amount_cents'],
             'payment_date': data['payment_date'],
             'payment_proof_path': data.get('payment_proof_path'),
             'notes': data.get('notes', '')
@@ -531,46 +2056,1078 @@ class SupabaseBackend:
     
     def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]:
         """获取发票的付款历史记录"""
-        response = self.client.table("payment_history")\
-            .select("*")\
-            .eq("invoice_id", invoice_id)\
-            .order("created_at", desc=True)\
-            .execute()
-        return response.data or []
+        response = self.client.table("payment_history").select("*").eq("invoice_id", invoice_id).order("created_at", desc=True).order("id", desc=True).execute()
+        return [_hydrate(record) for record in response.data or []]
 
+    def get_payment_history_many(self, invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """获取多张发票的付款历史记录 (one IN query per chunk/page, grouped by invoice)"""
+        grouped: Dict[int, List[Dict[str, Any]]] = {invoice_id: [] for invoice_id in invoice_ids}
+        for chunk in _chunks(invoice_ids):
+            offset = 0
+            while True:
+                response = (
+                    self.client.table("payment_history")
+                    .select("*")
+                    .in_("invoice_id", chunk)
+                    .order("invoice_id")
+                    .order("created_at", desc=True)
+                    .order("id", desc=True)
+                    .range(offset, offset + SUPABASE_PAGE_SIZE - 1)
+                    .execute()
+                )
+                page = response.data or []
+                if not page:
+                    break
+                for record in page:
+                    grouped[record["invoice_id"]].append(_hydrate(record))
+                offset += len(page)
+        return grouped
 
-    def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
-        """创建付款历史记录"""
-        record_data = {
-            'invoice_id': data['invoice_id'],
-            'payment_amount': data['payment_amount'],
-            'payment_date': data['payment_date'],
-            'payment_proof_path': data.get('payment_proof_path'),
-            'notes': data.get('notes', '')
+# ---------- Postgres Backend ----------
+
+# Rows per round trip of the server-side cursors that stream full listings
+POSTGRES_FETCH_SIZE = int(os.getenv("POSTGRES_FETCH_SIZE", "2000"))
+
+# Invoice columns returned by the Postgres backend (everything except the large ocr_text)
+POSTGRES_INVOICE_COLUMNS = SUPABASE_LIST_COLUMNS.replace(",", ", ")
+
+_POSTGRES_HISTORY_COLUMNS = (
+    "h.id, h.invoice_id, h.amount_cents, h.payment_date, h.payment_proof_path, h.notes, "
+    "to_char(h.created_at, 'YYYY-MM-DD HH24:MI:SS') AS created_at"
+)
+
+# pg_advisory_xact_lock key serializing schema setup between workers starting together
+_POSTGRES_SCHEMA_LOCK = 7_301_448
+
+
+def _timed_psycopg_cursors(psycopg: Any) -> Tuple[type, type]:
+    """psycopg cursor classes that report every statement to metrics and profiling."""
+
+    def record(cursor, query, started: float) -> None:
+        seconds = time.perf_counter() - started
+        statement = query if isinstance(query, str) else query.as_string(cursor) if hasattr(query, "as_string") else str(query)
+        metrics.observe_query("postgres", statement, seconds)
+        profiling.record_query(statement, seconds)
+
+    class Cursor(psycopg.Cursor):
+        def execute(self, query, params=None, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, params, **kwargs)
+            finally:
+                record(self, query, started)
+
+        def executemany(self, query, params_seq, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, params_seq, **kwargs)
+            finally:
+                record(self, query, started)
+
+    class ServerCursor(psycopg.ServerCursor):
+        def execute(self, query, params=None, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, params, **kwargs)
+            finally:
+                record(self, query, started)
+
+    return Cursor, ServerCursor
+
+
+class PostgresBackend:
+    """Talks to Postgres directly through a psycopg connection pool instead of PostgREST.
+
+    It uses the schema and SQL functions of the Supabase backend, so it can
+    point at a Supabase project's database (POSTGRES_URL, e.g. the session
+    pooler connection string) as well as at any other Postgres. Each pooled
+    connection block is one transaction. Statements run more than
+    POSTGRES_PREPARE_THRESHOLD times on a connection become prepared
+    statements ("none" turns that off, as transaction-mode poolers need),
+    full listings stream through server-side cursors and ``import_invoices``
+    loads rows with COPY.
+    """
+
+    def __init__(self) -> None:
+        dsn = os.getenv("POSTGRES_URL") or os.getenv("DATABASE_URL", "")
+        if not dsn.startswith(("postgres://", "postgresql://")):
+            raise RuntimeError("Postgres connection string is missing. Please set POSTGRES_URL=postgresql://...")
+        try:
+            import psycopg  # type: ignore
+            from psycopg.rows import dict_row  # type: ignore
+            from psycopg_pool import ConnectionPool  # type: ignore
+        except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+            raise RuntimeError(
+                "psycopg_pool is missing. Install it with `pip install \"psycopg[binary,pool]\"` or `pip install -r requirements.txt`."
+            ) from exc
+
+        cursor_class, server_cursor_class = _timed_psycopg_cursors(psycopg)
+
+        def configure(conn) -> None:
+            conn.cursor_factory = cursor_class
+            conn.server_cursor_factory = server_cursor_class
+
+        threshold = os.getenv("POSTGRES_PREPARE_THRESHOLD", "1").strip().lower()
+        self.dict_row = dict_row
+        self.pool = ConnectionPool(
+            dsn,
+            min_size=int(os.getenv("POSTGRES_POOL_MIN", "1")),
+            max_size=int(os.getenv("POSTGRES_POOL_MAX", "10")),
+            kwargs={"prepare_threshold": None if threshold == "none" else int(threshold)},
+            configure=configure,
+            name="invoices",
+            open=True,
+        )
+        self._ensure_schema()
+
+    def _ensure_schema(self) -> None:
+        with self.pool.connection() as conn:
+            conn.execute("SELECT pg_advisory_xact_lock(%s)", (_POSTGRES_SCHEMA_LOCK,))
+            conn.execute(_POSTGRES_TABLES_DDL, prepare=False)
+            conn.execute(_POSTGRES_PAYMENT_HISTORY_DDL, prepare=False)
+            SupabaseBackend._auto_migrate_fields(conn)
+            conn.execute(_POSTGRES_FUNCTIONS_DDL, prepare=False)
+
+    def _fetch(self, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        with self.pool.connection() as conn, conn.cursor(row_factory=self.dict_row) as cursor:
+            return cursor.execute(query, params).fetchall()
+
+    def _stream(self, name: str, query: str, params: Any = None) -> List[Dict[str, Any]]:
+        """Fetch a large result through a server-side cursor, POSTGRES_FETCH_SIZE rows at a time."""
+        with self.pool.connection() as conn, conn.cursor(name, row_factory=self.dict_row) as cursor:
+            cursor.itersize = POSTGRES_FETCH_SIZE
+            cursor.execute(query, params)
+            return list(cursor)
+
+    def get_or_create_vendor(self, name: Optional[str]) -> Optional[int]:
+        """Return the id of the vendor ``name`` normalizes to, creating it on first use."""
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        rows = self._fetch("""
+            WITH inserted AS (
+                INSERT INTO vendors (name, normalized_key) VALUES (%(name)s, %(key)s)
+                ON CONFLICT (normalized_key) DO NOTHING
+                RETURNING id
+            )
+            SELECT id, true AS created FROM inserted
+            UNION ALL
+            SELECT id, false FROM vendors WHERE normalized_key = %(key)s
+            LIMIT 1
+        """, {"name": name.strip(), "key": key})
+        if not rows:
+            # Inserted by a concurrent transaction after this statement's snapshot
+            rows = self._fetch("SELECT id, false AS created FROM vendors WHERE normalized_key = %s", (key,))
+        if rows and rows[0]["created"]:
+            vendors.invalidate_index()
+        return rows[0]["id"] if rows else None
+
+    def _find_vendor_id(self, name: Optional[str]) -> Optional[int]:
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        rows = self._fetch("SELECT id FROM vendors WHERE normalized_key = %s", (key,))
+        return rows[0]["id"] if rows else None
+
+    def list_vendors(self) -> List[Dict[str, Any]]:
+        """All vendors with their invoice counts (feeds the autocomplete index)."""
+        return self._fetch("""
+            SELECT v.id, v.name, v.normalized_key, count(i.id) AS invoice_count
+            FROM vendors v LEFT JOIN invoices i ON i.vendor_id = v.id
+            GROUP BY v.id
+        """)
+
+    def find_duplicates(self, candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Existing invoices that look like ``candidate``, each with the ``reasons`` it matched.
+
+        The probes are OR-ed into one statement (a BitmapOr over the duplicate indexes).
+        """
+        keys = _duplicate_keys(candidate, self._find_vendor_id(candidate.get("company_name")))
+        conditions = []
+        if keys["vendor_id"] and keys["invoice_number_key"]:
+            conditions.append("(vendor_id = %(vendor_id)s AND invoice_number_key = %(invoice_number_key)s)")
+        if keys["pdf_sha256"]:
+            conditions.append("pdf_sha256 = %(pdf_sha256)s")
+        if keys["vendor_id"] and keys["total_cents"] is not None and keys["invoice_date"]:
+            conditions.append(
+                "(vendor_id = %(vendor_id)s AND total_cents = %(total_cents)s AND invoice_day = %(invoice_date)s::date)"
+            )
+        if not conditions:
+            return []
+
+        exclude = " AND id <> %(exclude_id)s" if exclude_id is not None else ""
+        rows = self._fetch(f"""
+            SELECT {POSTGRES_INVOICE_COLUMNS}, invoice_number_key, pdf_sha256, invoice_day
+            FROM invoices
+            WHERE ({" OR ".join(conditions)}){exclude}
+            ORDER BY id DESC
+            LIMIT %(limit)s
+        """, dict(keys, exclude_id=exclude_id, limit=duplicates.MAX_MATCHES * len(conditions)))
+        return [_duplicate_match(row, keys) for row in rows][:duplicates.MAX_MATCHES]
+
+    def create_invoice(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = dates.date_fields(money.cents_fields(data))
+        values = _new_invoice_values(data, self.get_or_create_vendor(data.get("company_name")))
+        rows = self._fetch(f"""
+            INSERT INTO invoices ({", ".join(values)})
+            VALUES ({", ".join(f"%({column})s" for column in values)})
+            RETURNING {POSTGRES_INVOICE_COLUMNS}
+        """, values)
+        return _hydrate(rows[0])
+
+    def import_invoices(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Bulk-load invoices with COPY in one transaction; vendors are resolved once per name."""
+        prepared = [dates.date_fields(money.cents_fields(data)) for data in rows]
+        vendor_ids = {
+            name: self.get_or_create_vendor(name)
+            for name in {data.get("company_name") for data in prepared}
         }
-        response = self.client.table("payment_history").insert(record_data).execute()
-        if response.data:
-            return response.data[0]['id']
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            with cursor.copy(f"COPY invoices ({', '.join(_WRITABLE_COLUMNS)}) FROM STDIN") as copy:
+                for data in prepared:
+                    values = _new_invoice_values(data, vendor_ids[data.get("company_name")])
+                    copy.write_row([values[column] for column in _WRITABLE_COLUMNS])
+        return len(prepared)
+
+    def get_invoices(
+        self,
+        company_name: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """List invoices, newest first; with ``q``, ranked by the ``search_invoices`` SQL function."""
+        conditions = []
+        params: Dict[str, Any] = {}
+        if vendor_id:
+            conditions.append("vendor_id = %(vendor_id)s")
+            params["vendor_id"] = vendor_id
+        if company_name:
+            conditions.append("company_name ILIKE %(company_name)s")
+            params["company_name"] = f"%{company_name}%"
+        if invoice_number:
+            conditions.append("invoice_number ILIKE %(invoice_number)s")
+            params["invoice_number"] = f"%{invoice_number}%"
+        if date_from:
+            conditions.append("invoice_day >= %(date_from)s::date")
+            params["date_from"] = dates.normalize_date(date_from)
+        if date_to:
+            conditions.append("invoice_day <= %(date_to)s::date")
+            params["date_to"] = dates.normalize_date(date_to)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if q:
+            params.update(q=q, limit=SEARCH_LIMIT, candidates=SEARCH_CANDIDATES)
+            rows = self._fetch(f"""
+                SELECT {POSTGRES_INVOICE_COLUMNS}
+                FROM search_invoices(%(q)s, %(limit)s, %(candidates)s) WITH ORDINALITY AS ranked{where}
+                ORDER BY ordinality
+            """, params)
+        else:
+            rows = self._stream("invoice_list", f"""
+                SELECT {POSTGRES_INVOICE_COLUMNS}
+                FROM invoices{where}
+                ORDER BY invoice_day DESC NULLS LAST, id DESC
+            """, params)
+        return [_hydrate(row) for row in rows]
+
+    def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._fetch(f"SELECT {POSTGRES_INVOICE_COLUMNS} FROM invoices WHERE id = %s", (invoice_id,))
+        return _hydrate(rows[0]) if rows else None
+
+    def update_invoice(
+        self, invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Update the writable columns in ``data``; with ``expected_version``, only if the invoice is still at it.
+
+        Raises:
+            VersionConflictError: If the invoice has moved past ``expected_version``.
+        """
+        data = dates.date_fields(money.cents_fields(data))
+        if data.get("invoice_date"):
+            data["invoice_day"] = data["invoice_date"]
+        if data.get("company_name"):
+            data["vendor_id"] = self.get_or_create_vendor(data["company_name"])
+        if "invoice_number" in data:
+            data["invoice_number_key"] = duplicates.normalize_invoice_number(data["invoice_number"])
+        values = {key: value for key, value in data.items() if key in _WRITABLE_COLUMNS}
+        if not values:
+            return self.get_invoice(invoice_id)
+        rows = self._fetch(f"""
+            UPDATE invoices SET {", ".join(f"{column} = %({column})s" for column in values)}
+            WHERE id = %(invoice_id)s AND (%(expected_version)s::integer IS NULL OR version = %(expected_version)s)
+            RETURNING {POSTGRES_INVOICE_COLUMNS}
+        """, dict(values, invoice_id=invoice_id, expected_version=expected_version))
+        if rows:
+            return _hydrate(rows[0])
+        if expected_version is not None:
+            current = self.get_invoice(invoice_id)
+            if current:
+                raise VersionConflictError(invoice_id, expected_version, current["version"])
         return None
-    
+
+    def delete_invoice(self, invoice_id: int) -> bool:
+        """Delete one invoice; its payment_history rows go with it via ON DELETE CASCADE."""
+        return bool(self._fetch("DELETE FROM invoices WHERE id = %s RETURNING id", (invoice_id,)))
+
+    def apply_payment(
+        self,
+        invoice_id: int,
+        amount_cents: int,
+        payment_date: str,
+        payment_proof_path: Optional[str] = None,
+        credit_cents: Optional[int] = None,
+        notes: Optional[str] = None,
+        expected_version: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Record a payment in one transaction and return the updated invoice.
+
+        The conditional UPDATE holds the invoice's row lock until the history
+        row is written and the transaction commits, so concurrent payments
+        queue up behind it and cannot overpay. Returns None when the invoice
+        does not exist.
+        """
+        params = {
+            "invoice_id": invoice_id,
+            "amount_cents": amount_cents,
+            "payment_date": dates.normalize_date(payment_date),
+            "payment_proof_path": payment_proof_path or None,
+            "credit_cents": credit_cents,
+            "notes": notes if notes is not None else f"Payment of ${money.format_cents(amount_cents)}",
+            "expected_version": expected_version,
+        }
+        with self.pool.connection() as conn, conn.transaction(), conn.cursor(row_factory=self.dict_row) as cursor:
+            updated = cursor.execute("""
+                UPDATE invoices
+                SET paid_cents = paid_cents + %(amount_cents)s,
+                    payment_status = CASE
+                        WHEN paid_cents + %(amount_cents)s >= total_cents THEN 'paid'
+                        WHEN paid_cents + %(amount_cents)s > 0 THEN 'partial'
+                        ELSE 'unpaid'
+                    END,
+                    payment_date = %(payment_date)s,
+                    payment_proof_path = coalesce(%(payment_proof_path)s, payment_proof_path),
+                    credit_cents = coalesce(%(credit_cents)s, credit_cents)
+                WHERE id = %(invoice_id)s AND paid_cents + %(amount_cents)s <= total_cents
+                  AND (%(expected_version)s::integer IS NULL OR version = %(expected_version)s)
+                RETURNING id
+            """, params).fetchone()
+            if updated is None:
+                current = cursor.execute(
+                    "SELECT total_cents, paid_cents, version FROM invoices WHERE id = %s", (invoice_id,)
+                ).fetchone()
+                if current is None:
+                    return None
+                if expected_version is not None and current["version"] != expected_version:
+                    raise VersionConflictError(invoice_id, expected_version, current["version"])
+                raise OverpaymentError(current["total_cents"], current["paid_cents"], amount_cents)
+            cursor.execute("""
+                INSERT INTO payment_history (invoice_id, amount_cents, payment_date, payment_proof_path, notes)
+                VALUES (%(invoice_id)s, %(amount_cents)s, %(payment_date)s, %(payment_proof_path)s, %(notes)s)
+            """, params)
+            # Read back after the trigger has updated payment_count / last_payment_date
+            invoice = cursor.execute(
+                f"SELECT {POSTGRES_INVOICE_COLUMNS} FROM invoices WHERE id = %s", (invoice_id,)
+            ).fetchone()
+        return _hydrate(invoice)
+
+    def bulk_mark_paid(self, invoice_ids: List[int], payment_date: str) -> int:
+        """Pay off many invoices in one transaction through the ``bulk_mark_paid`` SQL function."""
+        rows = self._fetch(
+            "SELECT bulk_mark_paid(%s::bigint[], %s) AS updated",
+            (list(dict.fromkeys(invoice_ids)), dates.normalize_date(payment_date)),
+        )
+        return int(rows[0]["updated"] or 0)
+
+    def bulk_update_credit(self, invoice_ids: List[int], credit_cents: int) -> int:
+        """Set the same credit on many invoices. Returns the number of invoices updated."""
+        with self.pool.connection() as conn:
+            return conn.execute(
+                "UPDATE invoices SET credit_cents = %s WHERE id = ANY(%s::bigint[])",
+                (credit_cents, list(dict.fromkeys(invoice_ids))),
+            ).rowcount
+
+    def bulk_delete(self, invoice_ids: List[int]) -> List[str]:
+        """Delete many invoices in one transaction; returns the file paths they referenced."""
+        ids = list(dict.fromkeys(invoice_ids))
+        with self.pool.connection() as conn:
+            files = [row[0] for row in conn.execute("""
+                SELECT payment_proof_path FROM payment_history
+                WHERE invoice_id = ANY(%s::bigint[]) AND payment_proof_path IS NOT NULL
+            """, (ids,))]
+            deleted = conn.execute(
+                "DELETE FROM invoices WHERE id = ANY(%s::bigint[]) RETURNING pdf_path, payment_proof_path", (ids,)
+            )
+            files.extend(path for row in deleted for path in row if path)
+        return list(dict.fromkeys(files))
+
+    def list_file_references(self) -> Set[str]:
+        """Return every storage path still referenced by an invoice or payment record."""
+        rows = self._stream("file_references", """
+            SELECT pdf_path AS path FROM invoices WHERE pdf_path IS NOT NULL
+            UNION
+            SELECT payment_proof_path FROM invoices WHERE payment_proof_path IS NOT NULL
+            UNION
+            SELECT payment_proof_path FROM payment_history WHERE payment_proof_path IS NOT NULL
+        """)
+        return {row["path"] for row in rows}
+
+    def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Exact money totals over invoices dated within [date_from, date_to] (``invoice_totals`` SQL function)."""
+        rows = self._fetch(
+            "SELECT invoice_count, total_cents, paid_cents, credit_cents FROM invoice_totals(%s::date, %s::date)",
+            (
+                dates.normalize_date(date_from) if date_from else None,
+                dates.normalize_date(date_to) if date_to else None,
+            ),
+        )
+        return money.add_amounts({key: int(value or 0) for key, value in rows[0].items()})
+
+    def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
+        data = dates.date_fields(money.cents_fields(data))
+        rows = self._fetch("""
+            INSERT INTO payment_history (invoice_id, amount_cents, payment_date, payment_proof_path, notes)
+            VALUES (%(invoice_id)s, %(amount_cents)s, %(payment_date)s, %(payment_proof_path)s, %(notes)s)
+            RETURNING id
+        """, {
+            "invoice_id": data["invoice_id"],
+            "amount_cents": data["amount_cents"],
+            "payment_date": data["payment_date"],
+            "payment_proof_path": data.get("payment_proof_path"),
+            "notes": data.get("notes", ""),
+        })
+        return rows[0]["id"] if rows else None
+
     def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]:
-        """获取发票的付款历史记录"""
-        response = self.client.table("payment_history").select("*").eq("invoice_id", invoice_id).order("created_at", desc=True).execute()
-        return response.data or []
+        rows = self._fetch(f"""
+            SELECT {_POSTGRES_HISTORY_COLUMNS}
+            FROM payment_history h
+            WHERE h.invoice_id = %s
+            ORDER BY h.created_at DESC, h.id DESC
+        """, (invoice_id,))
+        return [_hydrate(row) for row in rows]
+
+    def get_payment_history_many(self, invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        grouped: Dict[int, List[Dict[str, Any]]] = {invoice_id: [] for invoice_id in invoice_ids}
+        rows = self._fetch(f"""
+            SELECT {_POSTGRES_HISTORY_COLUMNS}
+            FROM payment_history h
+            WHERE h.invoice_id = ANY(%s::bigint[])
+            ORDER BY h.invoice_id, h.created_at DESC, h.id DESC
+        """, (list(grouped),))
+        for row in rows:
+            grouped[row["invoice_id"]].append(_hydrate(row))
+        return grouped
+
+
+# ---------- Memory Backend ----------
+
+# Full-text weight of a word per column, as in the SQLite bm25() call
+_MEMORY_SEARCH_WEIGHTS = {"invoice_number": 10.0, "company_name": 5.0, "notes": 2.0, "ocr_text": 1.0}
+
+
+class MemoryBackend:
+    """Keeps all data in process memory: no I/O, for tests and benchmarks (DATA_BACKEND=memory).
+
+    Invoices are held in a dict by id. Listing order and date ranges come
+    from a sorted list of ``(-invoice_day, -id)`` keys maintained with
+    ``bisect``. The vendor filter, duplicate probes and full-text search are
+    dict lookups (vendor, ``(vendor_id, invoice_number_key)``, ``pdf_sha256``,
+    fingerprint and word -> ids). One lock makes every call atomic, so
+    ``apply_payment`` cannot overpay under concurrency. Every write stamps
+    ``updated_at`` and every delete leaves a tombstone, like the Supabase
+    schema, so it also stands in for Supabase behind ``MirroredBackend``.
+    Nothing survives the process.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.invoices: Dict[int, Dict[str, Any]] = {}
+        self.history: Dict[int, List[Dict[str, Any]]] = {}
+        self.vendors: Dict[str, Dict[str, Any]] = {}
+        self._order: List[Tuple[int, int]] = []
+        self._by_vendor: Dict[Optional[int], Set[int]] = {}
+        self._by_number: Dict[Tuple[Optional[int], str], Set[int]] = {}
+        self._by_file: Dict[str, Set[int]] = {}
+        self._by_fingerprint: Dict[Tuple[Optional[int], Optional[int], Optional[str]], Set[int]] = {}
+        self._words: Dict[str, Dict[int, float]] = {}
+        self._deletions: List[Tuple[str, int]] = []
+        self._next_invoice_id = 1
+        self._next_payment_id = 1
+
+    # -- indexes --
+
+    @staticmethod
+    def _order_key(row: Dict[str, Any]) -> Tuple[int, int]:
+        # Undated invoices sort last, like NULLS LAST
+        day = dates.to_ordinal(row["invoice_day"]) if row.get("invoice_day") else None
+        return (-day if day else 1, -row["id"])
+
+    @staticmethod
+    def _word_weights(row: Dict[str, Any]) -> Dict[str, float]:
+        weights: Dict[str, float] = {}
+        for column, weight in _MEMORY_SEARCH_WEIGHTS.items():
+            for word in re.findall(r"\w+", (row.get(column) or "").lower()):
+                weights[word] = weights.get(word, 0.0) + weight
+        return weights
+
+    def _index_keys(self, row: Dict[str, Any]) -> List[Tuple[Dict[Any, Set[int]], Any]]:
+        keys: List[Tuple[Dict[Any, Set[int]], Any]] = [
+            (self._by_vendor, row["vendor_id"]),
+            (self._by_number, (row["vendor_id"], row["invoice_number_key"])),
+            (self._by_fingerprint, (row["vendor_id"], row["total_cents"], row["invoice_day"])),
+        ]
+        if row.get("pdf_sha256"):
+            keys.append((self._by_file, row["pdf_sha256"]))
+        return keys
+
+    def _index(self, row: Dict[str, Any]) -> None:
+        bisect.insort(self._order, self._order_key(row))
+        for index, key in self._index_keys(row):
+            index.setdefault(key, set()).add(row["id"])
+        for word, weight in self._word_weights(row).items():
+            self._words.setdefault(word, {})[row["id"]] = weight
+
+    def _unindex(self, row: Dict[str, Any]) -> None:
+        key = self._order_key(row)
+        del self._order[bisect.bisect_left(self._order, key)]
+        for index, value in self._index_keys(row):
+            ids = index.get(value)
+            if ids is not None:
+                ids.discard(row["id"])
+                if not ids:
+                    del index[value]
+        for word in self._word_weights(row):
+            postings = self._words.get(word)
+            if postings is not None:
+                postings.pop(row["id"], None)
+                if not postings:
+                    del self._words[word]
+
+    def _ids_between(self, date_from: Optional[str], date_to: Optional[str]) -> List[int]:
+        """Invoice ids dated within [date_from, date_to], newest first (a slice of the sorted keys)."""
+        start, end = 0, len(self._order)
+        if date_to:
+            start = bisect.bisect_left(self._order, (-dates.to_ordinal(dates.normalize_date(date_to)), -sys.maxsize))
+        if date_from:
+            end = bisect.bisect_right(self._order, (-dates.to_ordinal(dates.normalize_date(date_from)), sys.maxsize))
+        return [-invoice_id for _, invoice_id in self._order[start:end]]
+
+    def _to_dict(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        return _hydrate({column: row.get(column) for column in SUPABASE_LIST_COLUMNS.split(",")})
+
+    def _refresh_payments(self, invoice_id: int) -> None:
+        """What the payment_history triggers maintain: payment_count and last_payment_date."""
+        records = self.history.get(invoice_id, [])
+        invoice = self.invoices[invoice_id]
+        invoice["payment_count"] = len(records)
+        invoice["last_payment_date"] = max((record["payment_date"] for record in records), default=None)
+        self._touch(invoice)
+
+    @staticmethod
+    def _touch(row: Dict[str, Any], **values: Any) -> None:
+        """Write ``values`` as the invoice update triggers would: updated_at always, version
+        when one of the ``_VERSIONED_COLUMNS`` changes."""
+        if any(row.get(column) != value for column, value in values.items() if column in _VERSIONED_COLUMNS):
+            row["version"] += 1
+        row.update(values)
+        row["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    # -- vendors --
+
+    def get_or_create_vendor(self, name: Optional[str]) -> Optional[int]:
+        """Return the id of the vendor ``name`` normalizes to, creating it on first use."""
+        key = vendors.normalize_vendor(name)
+        if not key:
+            return None
+        with self.lock:
+            vendor = self.vendors.get(key)
+            if vendor is None:
+                vendor = {"id": len(self.vendors) + 1, "name": name.strip(), "normalized_key": key}
+                self.vendors[key] = vendor
+                vendors.invalidate_index()
+            return vendor["id"]
+
+    def list_vendors(self) -> List[Dict[str, Any]]:
+        """All vendors with their invoice counts (feeds the autocomplete index)."""
+        with self.lock:
+            return [
+                dict(vendor, invoice_count=len(self._by_vendor.get(vendor["id"], ())))
+                for vendor in self.vendors.values()
+            ]
+
+    def _find_vendor_id(self, name: Optional[str]) -> Optional[int]:
+        vendor = self.vendors.get(vendors.normalize_vendor(name))
+        return vendor["id"] if vendor else None
+
+    def find_duplicates(self, candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Existing invoices that look like ``candidate``, each with the ``reasons`` it matched."""
+        with self.lock:
+            keys = _duplicate_keys(candidate, self._find_vendor_id(candidate.get("company_name")))
+            probes = []
+            if keys["vendor_id"] and keys["invoice_number_key"]:
+                probes.append(("invoice_number", self._by_number.get((keys["vendor_id"], keys["invoice_number_key"]))))
+            if keys["pdf_sha256"]:
+                probes.append(("file", self._by_file.get(keys["pdf_sha256"])))
+            if keys["vendor_id"] and keys["total_cents"] is not None and keys["invoice_date"]:
+                probes.append(("fingerprint", self._by_fingerprint.get(
+                    (keys["vendor_id"], keys["total_cents"], keys["invoice_date"])
+                )))
+
+            matches: Dict[int, Dict[str, Any]] = {}
+            for reason, ids in probes:
+                found = sorted((ids or set()) - {exclude_id}, reverse=True)[:duplicates.MAX_MATCHES]
+                for invoice_id in found:
+                    match = matches.setdefault(invoice_id, dict(self._to_dict(self.invoices[invoice_id]), reasons=[]))
+                    match["reasons"].append(reason)
+            return list(matches.values())[:duplicates.MAX_MATCHES]
+
+    # -- invoices --
+
+    # Invoice columns the SQL schemas declare NOT NULL
+    _NOT_NULL = tuple(column.name for column in Invoice.__table__.columns if not column.nullable)
+
+    @classmethod
+    def _check_not_null(cls, values: Dict[str, Any]) -> None:
+        """Reject a write the SQL backends' NOT NULL constraints would reject."""
+        for column in cls._NOT_NULL:
+            if column in values and values[column] is None:
+                raise ValueError(f"NOT NULL constraint failed: invoices.{column}")
+
+    def _insert(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        row = dict(
+            values, id=self._next_invoice_id, payment_count=0, last_payment_date=None, version=1,
+            updated_at=datetime.now(timezone.utc).isoformat(),
+        )
+        self._next_invoice_id += 1
+        self.invoices[row["id"]] = row
+        self._index(row)
+        return row
+
+    def create_invoice(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        values = _new_invoice_values(dates.date_fields(money.cents_fields(data)), None)
+        self._check_not_null(values)
+        with self.lock:
+            values["vendor_id"] = self.get_or_create_vendor(values["company_name"])
+            return self._to_dict(self._insert(values))
+
+    def import_invoices(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Add many invoices under one lock; one invalid row rejects them all."""
+        prepared = [_new_invoice_values(dates.date_fields(money.cents_fields(data)), None) for data in rows]
+        for values in prepared:
+            self._check_not_null(values)
+        with self.lock:
+            for values in prepared:
+                values["vendor_id"] = self.get_or_create_vendor(values["company_name"])
+                self._insert(values)
+        return len(prepared)
+
+    def get_invoices(
+        self,
+        company_name: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """List invoices, newest first; with ``q``, the best full-text matches first."""
+        with self.lock:
+            ids = self._ids_between(date_from, date_to)
+            if vendor_id:
+                in_vendor = self._by_vendor.get(vendor_id, set())
+                ids = [invoice_id for invoice_id in ids if invoice_id in in_vendor]
+            rows = [self.invoices[invoice_id] for invoice_id in ids]
+            if company_name:
+                rows = [row for row in rows if company_name.lower() in (row["company_name"] or "").lower()]
+            if invoice_number:
+                rows = [row for row in rows if invoice_number.lower() in (row["invoice_number"] or "").lower()]
+
+            if q:
+                words = re.findall(r"\w+", q.lower())
+                postings = [self._words.get(word, {}) for word in words]
+                if not postings:
+                    return []
+                matched = set.intersection(*(set(posting) for posting in postings))
+                candidates = set(sorted(matched, reverse=True)[:SEARCH_CANDIDATES])
+                rank = {invoice_id: sum(posting[invoice_id] for posting in postings) for invoice_id in candidates}
+                rows = sorted(
+                    (row for row in rows if row["id"] in candidates),
+                    key=lambda row: (-rank[row["id"]], -row["id"]),
+                )[:SEARCH_LIMIT]
+            return [self._to_dict(row) for row in rows]
+
+    def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.invoices.get(invoice_id)
+            return self._to_dict(row) if row else None
+
+    def update_invoice(
+        self, invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        data = dates.date_fields(money.cents_fields(data))
+        if data.get("invoice_date"):
+            data["invoice_day"] = data["invoice_date"]
+        if "invoice_number" in data:
+            data["invoice_number_key"] = duplicates.normalize_invoice_number(data["invoice_number"])
+        with self.lock:
+            row = self.invoices.get(invoice_id)
+            if row is None:
+                return None
+            values = {key: value for key, value in data.items() if key in _WRITABLE_COLUMNS}
+            if not values:
+                return self._to_dict(row)
+            if expected_version is not None and row["version"] != expected_version:
+                raise VersionConflictError(invoice_id, expected_version, row["version"])
+            self._check_not_null(values)
+            if values.get("company_name"):
+                values["vendor_id"] = self.get_or_create_vendor(values["company_name"])
+            self._unindex(row)
+            self._touch(row, **values)
+            self._index(row)
+            return self._to_dict(row)
+
+    def delete_invoice(self, invoice_id: int) -> bool:
+        with self.lock:
+            row = self.invoices.pop(invoice_id, None)
+            if row is None:
+                return False
+            self._unindex(row)
+            self.history.pop(invoice_id, None)
+            self._deletions.append((datetime.now(timezone.utc).isoformat(), invoice_id))
+            return True
+
+    # -- payments --
+
+    def _add_payment(self, invoice_id: int, data: Dict[str, Any]) -> int:
+        from datetime import datetime
+        record = {
+            "id": self._next_payment_id,
+            "invoice_id": invoice_id,
+            "amount_cents": data["amount_cents"],
+            "payment_date": data["payment_date"],
+            "payment_proof_path": data.get("payment_proof_path"),
+            "notes": data.get("notes", ""),
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._next_payment_id += 1
+        self.history.setdefault(invoice_id, []).append(record)
+        self._refresh_payments(invoice_id)
+        return record["id"]
+
+    def apply_payment(
+        self,
+        invoice_id: int,
+        amount_cents: int,
+        payment_date: str,
+        payment_proof_path: Optional[str] = None,
+        credit_cents: Optional[int] = None,
+        notes: Optional[str] = None,
+        expected_version: Optional[int] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Record a payment and return the updated invoice; None when the invoice does not exist."""
+        payment_date = dates.normalize_date(payment_date)
+        with self.lock:
+            row = self.invoices.get(invoice_id)
+            if row is None:
+                return None
+            if expected_version is not None and row["version"] != expected_version:
+                raise VersionConflictError(invoice_id, expected_version, row["version"])
+            paid_cents = row["paid_cents"] + amount_cents
+            if paid_cents > row["total_cents"]:
+                raise OverpaymentError(row["total_cents"], row["paid_cents"], amount_cents)
+            values = {
+                "paid_cents": paid_cents,
+                "payment_status": "paid" if paid_cents >= row["total_cents"] else "partial" if paid_cents > 0 else "unpaid",
+                "payment_date": payment_date,
+            }
+            if payment_proof_path:
+                values["payment_proof_path"] = payment_proof_path
+            if credit_cents is not None:
+                values["credit_cents"] = credit_cents
+            self._touch(row, **values)
+            self._add_payment(invoice_id, {
+                "amount_cents": amount_cents,
+                "payment_date": payment_date,
+                "payment_proof_path": payment_proof_path,
+                "notes": notes if notes is not None else f"Payment of ${money.format_cents(amount_cents)}",
+            })
+            return self._to_dict(row)
+
+    def bulk_mark_paid(self, invoice_ids: List[int], payment_date: str) -> int:
+        """Pay off the remaining balance of many invoices. Returns the number of invoices updated."""
+        payment_date = dates.normalize_date(payment_date)
+        updated = 0
+        with self.lock:
+            for invoice_id in dict.fromkeys(invoice_ids):
+                row = self.invoices.get(invoice_id)
+                if row is None or row["paid_cents"] >= row["total_cents"]:
+                    continue
+                balance = row["total_cents"] - row["paid_cents"]
+                self._add_payment(invoice_id, {
+                    "amount_cents": balance,
+                    "payment_date": payment_date,
+                    "notes": f"Bulk payment of ${money.from_cents(balance)}",
+                })
+                self._touch(row, paid_cents=row["total_cents"], payment_status="paid", payment_date=payment_date)
+                updated += 1
+        return updated
+
+    def bulk_update_credit(self, invoice_ids: List[int], credit_cents: int) -> int:
+        """Set the same credit on many invoices. Returns the number of invoices updated."""
+        with self.lock:
+            rows = [self.invoices[invoice_id] for invoice_id in dict.fromkeys(invoice_ids) if invoice_id in self.invoices]
+            for row in rows:
+                self._touch(row, credit_cents=credit_cents)
+            return len(rows)
+
+    def bulk_delete(self, invoice_ids: List[int]) -> List[str]:
+        """Delete many invoices and their payment history; returns the file paths they referenced."""
+        files: List[str] = []
+        with self.lock:
+            for invoice_id in dict.fromkeys(invoice_ids):
+                row = self.invoices.get(invoice_id)
+                if row is None:
+                    continue
+                files.extend(path for path in (row["pdf_path"], row["payment_proof_path"]) if path)
+                files.extend(record["payment_proof_path"] for record in self.history.get(invoice_id, ()) if record["payment_proof_path"])
+                self.delete_invoice(invoice_id)
+        return list(dict.fromkeys(files))
+
+    def list_file_references(self) -> Set[str]:
+        """Return every storage path still referenced by an invoice or payment record."""
+        with self.lock:
+            paths = {path for row in self.invoices.values() for path in (row["pdf_path"], row["payment_proof_path"]) if path}
+            paths.update(
+                record["payment_proof_path"]
+                for records in self.history.values() for record in records if record["payment_proof_path"]
+            )
+            return paths
+
+    def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Exact money totals over invoices dated within [date_from, date_to]."""
+        with self.lock:
+            rows = [self.invoices[invoice_id] for invoice_id in self._ids_between(date_from, date_to)]
+        return money.add_amounts({
+            "invoice_count": len(rows),
+            "total_cents": sum(row["total_cents"] or 0 for row in rows),
+            "paid_cents": sum(row["paid_cents"] or 0 for row in rows),
+            "credit_cents": sum(row["credit_cents"] or 0 for row in rows),
+        })
+
+    def get_invoice_changes(self, since: Optional[str]) -> Tuple[List[Dict[str, Any]], List[int], Optional[str]]:
+        """Same contract as ``SupabaseBackend.get_invoice_changes``."""
+        after = datetime.fromisoformat(since) if since else None
+        with self.lock:
+            rows = [
+                dict(row) for row in self.invoices.values()
+                if after is None or datetime.fromisoformat(row["updated_at"]) > after
+            ]
+            deletions = [
+                (stamp, invoice_id) for stamp, invoice_id in self._deletions
+                if after is not None and datetime.fromisoformat(stamp) > after
+            ]
+        latest = _latest_timestamp([row.pop("updated_at") for row in rows] + [stamp for stamp, _ in deletions], since)
+        return rows, [invoice_id for _, invoice_id in deletions], latest
+
+    def create_payment_record(self, data: Dict[str, Any]) -> Optional[int]:
+        data = dates.date_fields(money.cents_fields(data))
+        with self.lock:
+            if data["invoice_id"] not in self.invoices:
+                return None
+            return self._add_payment(data["invoice_id"], data)
+
+    def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]:
+        return self.get_payment_history_many([invoice_id])[invoice_id]
+
+    def get_payment_history_many(self, invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        with self.lock:
+            return {
+                invoice_id: [
+                    _hydrate(dict(record))
+                    for record in sorted(
+                        self.history.get(invoice_id, ()),
+                        key=lambda record: (record["created_at"], record["id"]),
+                        reverse=True,
+                    )
+                ]
+                for invoice_id in invoice_ids
+            }
+
+
+# ---------- Read Mirror ----------
+
+# SUPABASE_READ_MIRROR=true serves listing and search from a local SQLite copy of the invoices
+READ_MIRROR_ENABLED = os.getenv("SUPABASE_READ_MIRROR", "false").strip().lower() in ("true", "1", "yes")
+READ_MIRROR_DATABASE_URL = os.getenv(
+    "READ_MIRROR_DATABASE_URL",
+    f"sqlite:///{Path(__file__).resolve().parent / 'mirror.db'}",
+)
+
+# A read pulls changes first once the last pull is this many seconds old (0: before every read)
+READ_MIRROR_MAX_STALENESS = float(os.getenv("READ_MIRROR_MAX_STALENESS", "30"))
+
+# Each pull re-reads this many seconds before the newest change already seen:
+# Postgres stamps updated_at at transaction start, so a slow transaction can
+# commit a change older than the watermark
+READ_MIRROR_OVERLAP_SECONDS = 60
+
+# Remote methods after which the mirror is stale until the next pull
+_READ_MIRROR_WRITES = frozenset({
+    "create_invoice", "import_invoices", "update_invoice", "delete_invoice", "apply_payment",
+    "bulk_mark_paid", "bulk_update_credit", "bulk_delete", "create_payment_record",
+})
+
+_INVOICE_COLUMNS = [column.name for column in Invoice.__table__.columns]
+
+
+class MirroredBackend:
+    """Serves ``get_invoices`` (listing and search) from a local SQLite copy of a remote backend.
+
+    Everything else, every write included, goes to ``remote``, which must
+    provide ``get_invoice_changes`` (Supabase; ``MemoryBackend`` in tests).
+    The copy is kept current by incremental pulls keyed on ``updated_at``:
+    a listing pulls first when the last pull is older than ``max_staleness``
+    seconds or a write has happened since it started, otherwise it is
+    answered without a network call. Pull state lives in the mirror database,
+    so gunicorn workers sharing the file share freshness, and a write in one
+    worker makes every worker pull before its next listing. If a pull fails
+    the listing falls back to the remote.
+    """
+
+    def __init__(self, remote: Any, local: SQLiteBackend, max_staleness: float = READ_MIRROR_MAX_STALENESS) -> None:
+        self.remote = remote
+        self.local = local
+        self.max_staleness = max_staleness
+        self._sync_lock = threading.Lock()
+        with self.local.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS mirror_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    watermark TEXT,
+                    synced_at REAL NOT NULL DEFAULT 0,
+                    invalidated_at REAL NOT NULL DEFAULT 0
+                )
+            """))
+            conn.execute(text("INSERT OR IGNORE INTO mirror_state (id) VALUES (1)"))
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self.remote, name)
+        if name not in _READ_MIRROR_WRITES:
+            return method
+
+        def write(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.invalidate()
+
+        return write
+
+    def _state(self) -> Tuple[Optional[str], float, float]:
+        with self.local.engine.connect() as conn:
+            return tuple(conn.execute(text(
+                "SELECT watermark, synced_at, invalidated_at FROM mirror_state WHERE id = 1"
+            )).one())
+
+    def invalidate(self) -> None:
+        """Make the next listing (in any process sharing the mirror) pull first."""
+        with self.local.engine.begin() as conn:
+            conn.execute(text("UPDATE mirror_state SET invalidated_at = :now WHERE id = 1"), {"now": time.time()})
+
+    def is_fresh(self) -> bool:
+        _, synced_at, invalidated_at = self._state()
+        return synced_at > invalidated_at and time.time() - synced_at < self.max_staleness
+
+    def sync(self, force: bool = False) -> int:
+        """Pull the changes since the last pull unless the mirror is fresh; returns the rows applied.
+
+        The first pull (or ``force=True`` with an empty watermark) copies every invoice.
+        """
+        with self._sync_lock:
+            if not force and self.is_fresh():
+                return 0
+            started = time.time()
+            watermark, _, _ = self._state()
+            since = None
+            if watermark:
+                since = (datetime.fromisoformat(watermark) - timedelta(seconds=READ_MIRROR_OVERLAP_SECONDS)).isoformat()
+            rows, deleted_ids, latest = self.remote.get_invoice_changes(since)
+
+            values = []
+            for row in rows:
+                value = {column: row.get(column) for column in _INVOICE_COLUMNS}
+                value["invoice_day"] = dates.to_ordinal(row.get("invoice_day"))
+                values.append(value)
+            upsert = sqlite_insert(Invoice)
+            # Rows re-read by the overlap are unchanged and skipped. Copied rows carry the remote
+            # version, and the local version trigger only fires when the version is unchanged and a
+            # versioned column differs, which the remote would have bumped, so it stays quiet.
+            copied = [column for column in _INVOICE_COLUMNS if column != "id"]
+            upsert = upsert.on_conflict_do_update(
+                index_elements=[Invoice.id],
+                set_={column: upsert.excluded[column] for column in copied},
+                where=or_(*(Invoice.__table__.c[column].is_distinct_from(upsert.excluded[column]) for column in copied)),
+            )
+            with self.local.engine.begin() as conn:
+                if since is None:
+                    conn.execute(delete(Invoice))
+                if values:
+                    conn.execute(upsert, values)
+                for chunk in _chunks(deleted_ids):
+                    conn.execute(delete(Invoice).where(Invoice.id.in_(chunk)))
+                conn.execute(text("""
+                    UPDATE mirror_state SET watermark = :watermark, synced_at = MAX(synced_at, :started)
+                    WHERE id = 1
+                """), {"watermark": _latest_timestamp([watermark, latest]), "started": started})
+            return len(values) + len(deleted_ids)
+
+    def get_invoices(
+        self,
+        company_name: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        q: Optional[str] = None,
+        vendor_id: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """List invoices from the mirror, pulling first when it is stale."""
+        filters = (company_name, invoice_number, date_from, date_to, q, vendor_id)
+        if self.is_fresh():
+            metrics.CACHE_HITS.inc(cache="read_mirror")
+        else:
+            metrics.CACHE_MISSES.inc(cache="read_mirror")
+            try:
+                self.sync()
+            except Exception as exc:
+                print(f"Read mirror pull failed, listing from the primary: {exc}")
+                return self.remote.get_invoices(*filters)
+        return self.local.get_invoices(*filters)
+
 
 # ---------- Backend Dispatch ----------
 
 _BACKEND_NAME = _determine_backend()
-_BACKEND: Optional[Any] = None
+_BACKEND: Optional[Backend] = None
 
 
-def _get_backend():
+def _get_backend() -> Backend:
     global _BACKEND
     if _BACKEND is None:
-        if _BACKEND_NAME == "supabase":
-            _BACKEND = SupabaseBackend()
+        if _BACKEND_NAME == "supabase" and READ_MIRROR_ENABLED:
+            _BACKEND = profiling.wrap_backend(
+                MirroredBackend(SupabaseBackend(), SQLiteBackend(READ_MIRROR_DATABASE_URL))
+            )
+        elif _BACKEND_NAME == "supabase":
+            _BACKEND = profiling.wrap_backend(SupabaseBackend())
+        elif _BACKEND_NAME == "postgres":
+            _BACKEND = profiling.wrap_backend(PostgresBackend())
+        elif _BACKEND_NAME == "memory":
+            _BACKEND = profiling.wrap_backend(MemoryBackend())
         else:
-            _BACKEND = SQLiteBackend()
+            _BACKEND = profiling.wrap_backend(SQLiteBackend())
     return _BACKEND
 
 
@@ -583,18 +3140,99 @@ def get_invoices(
     invoice_number: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
+    q: Optional[str] = None,
+    vendor_id: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
-    return _get_backend().get_invoices(company_name, invoice_number, date_from, date_to)
+    return _get_backend().get_invoices(company_name, invoice_number, date_from, date_to, q, vendor_id)
 
 
-def update_invoice(invoice_id: int, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-    return _get_backend().update_invoice(invoice_id, data)
+def import_invoices(rows: Iterable[Dict[str, Any]]) -> int:
+    return _get_backend().import_invoices(rows)
+
+
+def update_invoice(
+    invoice_id: int, data: Dict[str, Any], expected_version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    return _get_backend().update_invoice(invoice_id, data, expected_version)
 
 
 def delete_invoice(invoice_id: int) -> bool:
     return _get_backend().delete_invoice(invoice_id)
 
 
+def get_invoice(invoice_id: int) -> Optional[Dict[str, Any]]:
+    return _get_backend().get_invoice(invoice_id)
+
+
+def apply_payment(
+    invoice_id: int,
+    amount_cents: int,
+    payment_date: str,
+    payment_proof_path: Optional[str] = None,
+    credit_cents: Optional[int] = None,
+    notes: Optional[str] = None,
+    expected_version: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    return _get_backend().apply_payment(
+        invoice_id, amount_cents, payment_date, payment_proof_path, credit_cents, notes, expected_version
+    )
+
+
+def bulk_mark_paid(invoice_ids: List[int], payment_date: str) -> int:
+    return _get_backend().bulk_mark_paid(invoice_ids, payment_date)
+
+
+def bulk_update_credit(invoice_ids: List[int], credit_cents: int) -> int:
+    return _get_backend().bulk_update_credit(invoice_ids, credit_cents)
+
+
+def bulk_delete(invoice_ids: List[int]) -> List[str]:
+    return _get_backend().bulk_delete(invoice_ids)
+
+
+def create_payment_record(data: Dict[str, Any]) -> Optional[int]:
+    return _get_backend().create_payment_record(data)
+
+
+def get_payment_history(invoice_id: int) -> List[Dict[str, Any]]:
+    return _get_backend().get_payment_history(invoice_id)
+
+
+def get_payment_history_many(invoice_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    return _get_backend().get_payment_history_many(invoice_ids)
+
+
+def list_file_references() -> Set[str]:
+    return _get_backend().list_file_references()
+
+
+def get_or_create_vendor(name: Optional[str]) -> Optional[int]:
+    return _get_backend().get_or_create_vendor(name)
+
+
+def list_vendors() -> List[Dict[str, Any]]:
+    return _get_backend().list_vendors()
+
+
+def find_duplicates(candidate: Dict[str, Any], exclude_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    return _get_backend().find_duplicates(candidate, exclude_id)
+
+
+def get_totals(date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+    return _get_backend().get_totals(date_from, date_to)
+
+
+def preload_modules() -> None:
+    """Imports the client libraries of the configured backend without connecting to it."""
+    names = {"supabase": ("supabase", "psycopg"), "postgres": ("psycopg", "psycopg_pool")}.get(_BACKEND_NAME, ())
+    if names:
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+
+
 def current_backend() -> str:
     """Expose the active data backend name for diagnostics."""
     return _BACKEND_NAME
@@ -0,0 +1,183 @@
+"""
+Asyncio access to the data backend for pages that make several independent calls.
+
+With the Supabase backend, ``AsyncSupabaseBackend`` talks to PostgREST through
+supabase's ``AsyncClient`` on one shared ``httpx.AsyncClient`` (up to
+SUPABASE_ASYNC_POOL_SIZE keep-alive connections per process). Flask runs each
+async view on an event loop of its own and connections cannot move between
+loops, so the client lives on one loop in a background thread per process and
+views hand their coroutines over to it (``_run``). Calls that do not depend on
+each other then overlap instead of queueing: the invoice and payment history
+of the edit page, the three totals of /stats.
+
+The other backends have no async client; their sync methods run in the loop's
+thread pool, which overlaps them the same way. SUPABASE_ASYNC=false keeps the
+Supabase backend on the sync client too.
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+import database
+import dates
+import money
+
+POOL_SIZE = int(os.getenv("SUPABASE_ASYNC_POOL_SIZE", "10"))
+TIMEOUT = float(os.getenv("SUPABASE_ASYNC_TIMEOUT", "30"))
+
+
+def enabled() -> bool:
+    """True when the Supabase backend is active and its async client is not switched off."""
+    use_async = os.getenv("SUPABASE_ASYNC", "true").strip().lower() in ("true", "1", "yes")
+    return use_async and database.current_backend() == "supabase"
+
+
+class AsyncSupabaseBackend:
+    """The read paths of ``SupabaseBackend`` that pages combine, on supabase's AsyncClient."""
+
+    def __init__(self, client: Any) -> None:
+        self.client = client
+
+    @classmethod
+    async def connect(cls) -> "AsyncSupabaseBackend":
+        if not config.SUPABASE_URL or not config.SUPABASE_KEY:
+            raise RuntimeError("Supabase credentials are missing. Please set SUPABASE_URL and SUPABASE_KEY.")
+        try:
+            import httpx
+            from supabase import AsyncClientOptions, acreate_client  # type: ignore
+        except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+            raise RuntimeError(
+                "supabase client library is missing. Install it with `pip install supabase` or `pip install -r requirements.txt`."
+            ) from exc
+
+        http_client = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+        )
+        client = await acreate_client(
+            config.SUPABASE_URL, config.SUPABASE_KEY, options=AsyncClientOptions(httpx_client=http_client)
+        )
+        return cls(client)
+
+    async def get_invoice(self, invoice_id: int) -> Optional[Dict[str, Any]]:
+        response = await self.client.table("invoices").select("*").eq("id", invoice_id).limit(1).execute()
+        if response.data:
+            return database._hydrate(response.data[0])
+        return None
+
+    async def get_payment_history(self, invoice_id: int) -> List[Dict[str, Any]]:
+        response = await (
+            self.client.table("payment_history")
+            .select("*")
+            .eq("invoice_id", invoice_id)
+            .order("created_at", desc=True)
+            .order("id", desc=True)
+            .execute()
+        )
+        return [database._hydrate(record) for record in response.data or []]
+
+    async def get_totals(self, date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+        """Same as ``SupabaseBackend.get_totals``; without the SQL function it falls back to the sync paging."""
+        try:
+            response = await self.client.rpc("invoice_totals", {
+                "p_date_from": dates.normalize_date(date_from) if date_from else None,
+                "p_date_to": dates.normalize_date(date_to) if date_to else None,
+            }).execute()
+        except Exception:
+            return await asyncio.to_thread(database.get_totals, date_from, date_to)
+        row = (response.data or [{}])[0]
+        totals = {key: int(row.get(key) or 0) for key in ("invoice_count", "total_cents", "paid_cents", "credit_cents")}
+        return money.add_amounts(totals)
+
+
+class _ThreadedBackend:
+    """Async face of a sync backend: each call runs in the loop's thread pool."""
+
+    def __init__(self, backend: Any) -> None:
+        self._backend = backend
+
+    def __getattr__(self, name: str) -> Any:
+        method = getattr(self._backend, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+# ---------- Shared event loop ----------
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+_backend_task: Optional["asyncio.Future"] = None
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """The loop of this process, started on first use (again after a gunicorn fork)."""
+    global _loop, _loop_pid, _backend_task
+    with _loop_lock:
+        if _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="database-async", daemon=True).start()
+            _loop_pid = os.getpid()
+            _backend_task = None
+        return _loop
+
+
+async def _connect() -> Any:
+    if enabled():
+        return await AsyncSupabaseBackend.connect()
+    return _ThreadedBackend(database._get_backend())
+
+
+async def _get_backend() -> Any:
+    """Runs on the shared loop; concurrent first calls wait for the same connect."""
+    global _backend_task
+    if _backend_task is None:
+        _backend_task = asyncio.ensure_future(_connect())
+    try:
+        return await asyncio.shield(_backend_task)
+    except Exception:
+        _backend_task = None  # retried by the next call
+        raise
+
+
+async def _run(coroutine) -> Any:
+    """Runs ``coroutine`` on the shared loop and waits for it from the caller's loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, _get_loop()))
+
+
+# ---------- Page helpers ----------
+
+async def get_invoice_with_history(invoice_id: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """The invoice and its payment history, fetched concurrently.
+
+    A failing history query leaves the history empty, like ``get_payment_history`` in app.py.
+    """
+    async def fetch():
+        backend = await _get_backend()
+        invoice, history = await asyncio.gather(
+            backend.get_invoice(invoice_id), backend.get_payment_history(invoice_id), return_exceptions=True
+        )
+        if isinstance(invoice, BaseException):
+            raise invoice
+        if isinstance(history, BaseException):
+            print(f"Error getting payment history: {history}")
+            history = []
+        return invoice, history
+
+    return await _run(fetch())
+
+
+async def get_totals_many(ranges: Dict[str, Tuple[Optional[str], Optional[str]]]) -> Dict[str, Dict[str, Any]]:
+    """``get_totals`` for every ``name: (date_from, date_to)`` in ``ranges``, concurrently."""
+    async def fetch():
+        backend = await _get_backend()
+        results = await asyncio.gather(*(backend.get_totals(date_from, date_to) for date_from, date_to in ranges.values()))
+        return dict(zip(ranges, results))
+
+    return await _run(fetch())
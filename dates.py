@@ -0,0 +1,114 @@
+"""
+Date parsing and normalization shared by OCR, the routes and both backends.
+
+Dates are validated once on write and stored as ISO ``YYYY-MM-DD`` strings
+plus a range-scannable day column (``invoice_day``): an INTEGER day ordinal in
+SQLite and a native ``date`` in Postgres. Display strings are derived when a
+row is loaded, so templates never try formats one by one.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%m-%d-%Y",
+    "%d.%m.%Y",
+    "%Y/%m/%d",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+    "%Y.%m.%d",
+    "%d-%b-%Y",
+    "%d %b, %Y",
+]
+
+DISPLAY_FORMAT = "%B %d, %Y"
+
+# Columns holding a calendar date that is normalized to ISO on write
+DATE_FIELDS = ("invoice_date", "payment_date")
+
+# Columns that get a precomputed ``<name>_display`` key when a row is loaded
+DISPLAY_FIELDS = ("invoice_date", "payment_date", "last_payment_date")
+
+# Patterns matching values that are already stored as YYYY-MM-DD
+ISO_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"  # SQLite GLOB
+ISO_REGEX = r"^\d{4}-\d{2}-\d{2}$"  # Postgres ~
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """Parse any supported date shape; ISO strings take the fast path."""
+    if not value:
+        return None
+    candidate = str(value).strip()
+    try:
+        return date.fromisoformat(candidate)
+    except ValueError:
+        pass
+
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(candidate, fmt).date()
+        except ValueError:
+            continue
+
+    # Textual dates without commas (e.g., "January 5 2023")
+    candidate_without_comma = candidate.replace(",", "")
+    if candidate_without_comma != candidate:
+        for fmt in ("%b %d %Y", "%B %d %Y"):
+            try:
+                return datetime.strptime(candidate_without_comma, fmt).date()
+            except ValueError:
+                continue
+    return None
+
+
+def normalize_date(value: Any) -> str:
+    """Return ``value`` as ``YYYY-MM-DD``.
+
+    Raises:
+        ValueError: If the value is not a recognisable date.
+    """
+    if isinstance(value, date):
+        return value.isoformat()
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date: {value!r}")
+    return parsed.isoformat()
+
+
+def to_ordinal(value: Optional[str]) -> Optional[int]:
+    """ISO date string -> day ordinal (the SQLite ``invoice_day`` value)."""
+    parsed = parse_date(value)
+    return parsed.toordinal() if parsed else None
+
+
+def display_date(value: Optional[str]) -> str:
+    """Format a stored date as "November 05, 2025"; unparseable values are returned unchanged."""
+    parsed = parse_date(value)
+    if parsed is None:
+        return value or ""
+    return parsed.strftime(DISPLAY_FORMAT)
+
+
+def date_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of ``data`` with its date fields normalized to ISO (empty values become None)."""
+    converted = dict(data)
+    for key in DATE_FIELDS:
+        if key in converted:
+            converted[key] = normalize_date(converted[key]) if converted[key] else None
+    return converted
+
+
+def add_display(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Add ``<field>_display`` strings for the row's date fields."""
+    for key in DISPLAY_FIELDS:
+        if key in row:
+            row[f"{key}_display"] = display_date(row[key])
+    return row
@@ -0,0 +1,45 @@
+"""
+Duplicate-invoice detection keys.
+
+An upload is compared against existing invoices three ways, each answered by
+an index probe in the backend (``find_duplicates``):
+
+- same vendor and invoice number (``vendor_id, invoice_number_key``),
+- byte-identical file (``pdf_sha256``),
+- same vendor, amount and date (``vendor_id, total_cents, invoice_day``), which
+  catches a re-scan of the same paper invoice under a mistyped number.
+"""
+
+import hashlib
+import re
+from typing import Any, Dict, List, Optional
+
+REASON_LABELS = {
+    "invoice_number": "same vendor and invoice number",
+    "file": "identical file",
+    "fingerprint": "same vendor, amount and date",
+}
+
+# Probes stop after this many matches; the warning only needs a few examples
+MAX_MATCHES = 5
+
+
+def normalize_invoice_number(value: Optional[str]) -> str:
+    """"INV-0042", "inv 0042" and "INV0042" all become "inv0042"."""
+    return re.sub(r"[\W_]+", "", (value or "").casefold())
+
+
+def file_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def duplicate_warnings(matches: List[Dict[str, Any]]) -> List[str]:
+    """One human-readable warning per matching invoice."""
+    warnings = []
+    for match in matches:
+        reasons = ", ".join(REASON_LABELS.get(reason, reason) for reason in match["reasons"])
+        warnings.append(
+            f"Possible duplicate of invoice {match['invoice_number']} from {match['company_name']} "
+            f"dated {match.get('invoice_date_display') or match['invoice_date']} ({reasons})."
+        )
+    return warnings
@@ -0,0 +1,236 @@
+"""
+Layout-aware field lookup for PDFs with a text layer.
+
+``page.get_text("text")`` flattens a page into lines and throws away where each
+word sits, so the regex finders have to guess (the largest currency amount in
+the whole document is taken as the total). ``PageIndex`` keeps every word's
+bounding box from ``page.get_text("words")``, bucketed by vertical band, so a
+question like "the amount to the right of 'Total'" is a lookup in a few
+buckets of one page. ``LayoutIndex`` builds page indexes lazily: header fields
+only read the first page and totals walk back from the last one.
+"""
+
+import re
+from collections import defaultdict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from dates import parse_date
+
+# Height of a vertical bucket, in points
+BAND = 8.0
+
+# Labels in priority order; the first label that yields a value wins
+NUMBER_LABELS = ["invoice number", "invoice no", "invoice #", "invoice#", "invoice id", "inv no", "inv #", "bill no", "receipt no"]
+DATE_LABELS = ["invoice date", "date of invoice", "issue date", "date issued", "issued on", "billing date", "bill date", "date"]
+# A date label right after one of these words labels some other date ("Due Date", "Ship Date")
+OTHER_DATE_WORDS = {"due", "ship", "shipping", "shipment", "delivery", "order", "payment", "expiry", "expiration"}
+TOTAL_LABELS = [
+    "grand total",
+    "total amount due",
+    "amount due",
+    "balance due",
+    "total due",
+    "invoice total",
+    "total amount",
+    "net total",
+    "total",
+]
+
+# Totals are looked for on this many pages, walking back from the last
+TOTAL_PAGES = 3
+
+# Share of the first page searched for the vendor name
+HEADER_FRACTION = 0.4
+
+_AMOUNT_RE = re.compile(r"^[$¥€£]?\(?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{1,2})?\)?$")
+_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9\-/\\_]*$")
+_CURRENCY_CODE_RE = re.compile(r"^[A-Z]{3}$")
+
+
+class Word(NamedTuple):
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    text: str
+    block: int
+    line: int
+    word: int
+
+
+def _norm(text: str) -> str:
+    return text.casefold().rstrip(":").rstrip(".")
+
+
+def parse_amount(text: str) -> Optional[float]:
+    match = _AMOUNT_RE.match(text.strip())
+    if not match:
+        return None
+    return float(match.group(1).replace(",", "") + (match.group(2) or ""))
+
+
+class PageIndex:
+    """Words of one page with their boxes, indexed by vertical band and by normalized text."""
+
+    def __init__(self, words: List[tuple]) -> None:
+        self.words = [Word(*word[:8]) for word in words]
+        self._bands: Dict[int, List[Word]] = defaultdict(list)
+        self._by_text: Dict[str, List[Word]] = defaultdict(list)
+        self._lines: Dict[Tuple[int, int], List[Word]] = defaultdict(list)
+        for word in self.words:
+            for band in range(int(word.y0 // BAND), int(word.y1 // BAND) + 1):
+                self._bands[band].append(word)
+            self._by_text[_norm(word.text)].append(word)
+            self._lines[(word.block, word.line)].append(word)
+        for line_words in self._lines.values():
+            line_words.sort(key=lambda word: word.word)
+
+    def find_phrase(self, phrase: str) -> List[Tuple[Word, Word]]:
+        """(first word, last word) of each occurrence of ``phrase`` within a text line."""
+        tokens = phrase.split()
+        occurrences = []
+        for first in self._by_text.get(tokens[0], []):
+            line_words = self._lines[(first.block, first.line)]
+            position = line_words.index(first)
+            following = line_words[position + 1:position + len(tokens)]
+            if [_norm(word.text) for word in following] == tokens[1:]:
+                occurrences.append((first, following[-1] if following else first))
+        return occurrences
+
+    def previous(self, word: Word) -> Optional[Word]:
+        """The word before ``word`` on its text line, if any."""
+        line_words = self._lines[(word.block, word.line)]
+        position = line_words.index(word)
+        return line_words[position - 1] if position else None
+
+    def right_of(self, word: Word) -> List[Word]:
+        """Words on the same visual row to the right of ``word``, nearest first."""
+        height = word.y1 - word.y0
+        seen = set()
+        found = []
+        for band in range(int(word.y0 // BAND), int(word.y1 // BAND) + 1):
+            for other in self._bands.get(band, []):
+                if other.x0 < word.x1 - 1 or id(other) in seen:
+                    continue
+                seen.add(id(other))
+                overlap = min(word.y1, other.y1) - max(word.y0, other.y0)
+                if overlap >= 0.5 * min(height, other.y1 - other.y0):
+                    found.append(other)
+        return sorted(found, key=lambda other: other.x0)
+
+    def below(self, word: Word, max_distance: float = 40.0) -> List[Word]:
+        """Words starting under ``word`` (overlapping its column) within ``max_distance``, nearest first."""
+        seen = set()
+        found = []
+        for band in range(int(word.y1 // BAND), int((word.y1 + max_distance) // BAND) + 1):
+            for other in self._bands.get(band, []):
+                if id(other) in seen or other.y0 < word.y1 - 1 or other.y0 > word.y1 + max_distance:
+                    continue
+                seen.add(id(other))
+                if other.x1 >= word.x0 and other.x0 <= word.x1 + 100:
+                    found.append(other)
+        return sorted(found, key=lambda other: (other.y0, other.x0))
+
+
+class LayoutIndex:
+    """Lazily built page indexes for an open PyMuPDF document."""
+
+    def __init__(self, doc) -> None:
+        self.doc = doc
+        self._pages: Dict[int, PageIndex] = {}
+
+    def page(self, number: int) -> PageIndex:
+        """Index of the 0-based page ``number`` (empty for pages without a text layer)."""
+        if number not in self._pages:
+            self._pages[number] = PageIndex(self.doc[number].get_text("words"))
+        return self._pages[number]
+
+
+def _values_after(index: PageIndex, label_end: Word) -> List[List[Word]]:
+    """Candidate value words for a label: the rest of its row, then the words under it."""
+    return [index.right_of(label_end), index.below(label_end)]
+
+
+def find_invoice_number(layout: LayoutIndex) -> Optional[str]:
+    index = layout.page(0)
+    for label in NUMBER_LABELS:
+        for _, label_end in index.find_phrase(label):
+            for candidates in _values_after(index, label_end):
+                for word in candidates[:3]:
+                    value = word.text.strip(":#")
+                    if len(value) >= 3 and _ID_RE.match(value) and re.search(r"\d", value):
+                        return value
+    return None
+
+
+def find_invoice_date(layout: LayoutIndex) -> Optional[str]:
+    index = layout.page(0)
+    for label in DATE_LABELS:
+        for label_start, label_end in index.find_phrase(label):
+            before = index.previous(label_start)
+            if before is not None and _norm(before.text) in OTHER_DATE_WORDS:
+                continue
+            for candidates in _values_after(index, label_end):
+                words = [word.text.strip(":") for word in candidates[:4]]
+                # "March 14, 2025" spans three words, "2025-03-14" one
+                for size in (3, 2, 1):
+                    for start in range(0, max(0, len(words) - size) + 1):
+                        parsed = parse_date(" ".join(words[start:start + size]))
+                        if parsed and 2000 <= parsed.year <= 2050:
+                            return parsed.isoformat()
+    return None
+
+
+def find_total_amount(layout: LayoutIndex) -> Optional[float]:
+    last = len(layout.doc) - 1
+    for number in range(last, max(-1, last - TOTAL_PAGES), -1):
+        index = layout.page(number)
+        if not index.words:
+            continue
+        for label in TOTAL_LABELS:
+            # The bottom-most occurrence is the final total (above it sit subtotals and page totals)
+            for _, label_end in sorted(index.find_phrase(label), key=lambda pair: -pair[0].y0):
+                for word in index.right_of(label_end):
+                    text = word.text.strip(":")
+                    if not text or text in "$¥€£" or _CURRENCY_CODE_RE.match(text):
+                        continue
+                    amount = parse_amount(text)
+                    # "Total Tax 51.76" is not the total: the label must be followed by the amount
+                    if amount is not None and amount > 0:
+                        return amount
+                    break
+    return None
+
+
+def header_lines(page, fraction: float = HEADER_FRACTION) -> List[Tuple[str, float]]:
+    """(text, font size) of each line in the top ``fraction`` of a page, top to bottom."""
+    rect = page.rect
+    header = (rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * fraction)
+    lines = []
+    for block in page.get_text("dict", clip=header)["blocks"]:
+        for line in block.get("lines", []):
+            spans = line["spans"]
+            text = "".join(span["text"] for span in spans).strip()
+            if text:
+                lines.append((line["bbox"][1], line["bbox"][0], text, max(span["size"] for span in spans)))
+    lines.sort()
+    return [(text, size) for _, _, text, size in lines]
+
+
+def find_company_name(layout: LayoutIndex, score: Callable[[List[str], int], float]) -> Optional[str]:
+    """Best-scoring header line of the first page; the largest type gets a bonus (it is usually the vendor)."""
+    lines = header_lines(layout.doc[0])
+    if not lines:
+        return None
+    texts = [text for text, _ in lines]
+    largest = max(size for _, size in lines)
+    best_value, best_score = None, -float("inf")
+    for position, (text, size) in enumerate(lines):
+        line_score = score(texts, position)
+        if line_score == -float("inf"):
+            continue
+        if size >= largest - 0.5:
+            line_score += 3
+        if line_score > best_score:
+            best_value, best_score = text, line_score
+    return best_value if best_score >= 0 else None
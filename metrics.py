@@ -0,0 +1,451 @@
+"""
+Request, database, OCR and storage timings in the Prometheus text format.
+
+Every process keeps its counters and histograms in memory and writes a
+snapshot to ``METRICS_DIR`` (one JSON file per process) at most every
+``METRICS_FLUSH_SECONDS`` and when it exits. ``/metrics`` merges all the
+snapshots in the directory with the live values of the worker that answers,
+so a scrape covers every Gunicorn worker (and the OCR service workers) on the
+host whichever one takes it. Snapshots of exited workers are kept so counters
+never go backwards when a worker restarts.
+
+Snapshots live in a ``run-<pgid>`` subdirectory named after the process
+group, which the Gunicorn master, its workers and the OCR service started
+next to it share. A scrape only merges its own run, and the first flush of a
+run removes the runs whose process group has exited, so neither a previous
+deploy nor a test process on the same host leaks into the totals.
+
+Gauges are read when ``/metrics`` is rendered and are not summed across
+processes. ``METRICS_ENABLED=false`` turns all recording into no-ops.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import ContextDecorator
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() not in ("false", "0", "no")
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "invoice-metrics"))
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; requests and queries are mostly milliseconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# OCR stages run from milliseconds (parse) to a minute (Tesseract on a dense page)
+OCR_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_metrics: Dict[str, "_Metric"] = {}
+_snapshot_hooks: List[Callable[[], None]] = []
+_observers: List[Callable[[str, float, Dict[str, Any]], None]] = []
+_process_id = uuid.uuid4().hex[:8]
+_next_flush = 0.0
+_pruned = False
+
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, Any] = {}
+        _metrics[name] = self
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        _maybe_flush()
+
+    def _set(self, value: float, **labels: Any) -> None:
+        """For snapshot hooks that export a total kept elsewhere (e.g. ``lru_cache`` statistics)."""
+        with _lock:
+            self._values[_key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        for observer in _observers:
+            observer(self.name, value, labels)
+        if not METRICS_ENABLED:
+            return
+        key = _key(labels)
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+        _maybe_flush()
+
+    def time(self, **labels: Any) -> "_Timer":
+        """Context manager (or decorator) observing the seconds its block takes."""
+        return _Timer(self, labels)
+
+
+class _Timer(ContextDecorator):
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def _recreate_cm(self) -> "_Timer":
+        # A fresh timer per decorated call, so concurrent calls do not share ``started``
+        return _Timer(self.histogram, self.labels)
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Gauge:
+    """A value read from ``function()`` (a list of ``(labels, value)``) when /metrics is rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function: Callable[[], List[Tuple[Dict[str, Any], float]]]) -> None:
+        self.name = name
+        self.help = help
+        self.function = function
+        _gauges.append(self)
+
+
+_gauges: List[Gauge] = []
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Flask request latency by route, method and status.")
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "SQL statement latency by backend and statement type.")
+OCR_STAGE_SECONDS = Histogram(
+    "ocr_stage_duration_seconds", "Time spent in each OCR stage (render, preprocess, tesseract, layout, parse).",
+    OCR_BUCKETS)
+STORAGE_SECONDS = Histogram(
+    "storage_request_duration_seconds", "Supabase Storage call latency by operation.")
+CACHE_HITS = Counter("cache_hits_total", "Lookups answered from an in-process cache.")
+CACHE_MISSES = Counter("cache_misses_total", "Lookups that had to fill an in-process cache.")
+
+
+def add_observer(observer: Callable[[str, float, Dict[str, Any]], None]) -> None:
+    """Call ``observer(name, value, labels)`` on every histogram observation (see profiling.py)."""
+    _observers.append(observer)
+
+
+def on_snapshot(hook: Callable[[], None]) -> None:
+    """Run ``hook`` before every snapshot, to copy totals kept elsewhere into counters."""
+    _snapshot_hooks.append(hook)
+
+
+def track_lru_cache(name: str, function: Any) -> None:
+    """Export hits and misses of a ``functools.lru_cache`` function as ``cache="<name>"``."""
+    def export() -> None:
+        info = function.cache_info()
+        CACHE_HITS._set(info.hits, cache=name)
+        CACHE_MISSES._set(info.misses, cache=name)
+
+    on_snapshot(export)
+
+
+# ---------------------------------------------------------------------------
+# Snapshots
+# ---------------------------------------------------------------------------
+
+def _snapshot() -> Dict[str, Any]:
+    for hook in _snapshot_hooks:
+        try:
+            hook()
+        except Exception as exc:
+            print(f"Metrics snapshot hook failed: {exc}")
+    with _lock:
+        snapshot = {}
+        for metric in _metrics.values():
+            entry: Dict[str, Any] = {"kind": metric.kind, "help": metric.help}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+                entry["series"] = [[dict(key), list(counts), total] for key, (counts, total) in metric._values.items()]
+            else:
+                entry["series"] = [[dict(key), value] for key, value in metric._values.items()]
+            snapshot[metric.name] = entry
+    return snapshot
+
+
+def _run_id() -> int:
+    return os.getpgrp() if hasattr(os, "getpgrp") else os.getpid()
+
+
+def _run_dir() -> str:
+    return os.path.join(METRICS_DIR, f"run-{_run_id()}")
+
+
+def _snapshot_path() -> str:
+    return os.path.join(_run_dir(), f"{os.getpid()}-{_process_id}.json")
+
+
+def _group_alive(pgid: int) -> bool:
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, AttributeError):
+        return True  # owned by another user, or no process groups here
+    return True
+
+
+def _prune_stale_runs() -> None:
+    """Remove the snapshots of runs whose process group has exited."""
+    own = _run_dir()
+    for run_dir in glob.glob(os.path.join(METRICS_DIR, "run-*")):
+        try:
+            pgid = int(os.path.basename(run_dir)[len("run-"):])
+        except ValueError:
+            continue
+        if run_dir == own or _group_alive(pgid):
+            continue
+        # Only the snapshot files go: METRICS_DIR may hold other data
+        for path in glob.glob(os.path.join(run_dir, "*.json")) + glob.glob(os.path.join(run_dir, "*.json.tmp")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        try:
+            os.rmdir(run_dir)
+        except OSError:
+            pass  # not empty, or another process pruned it first
+
+
+def flush() -> None:
+    """Write this process's snapshot for the other workers to merge."""
+    global _pruned
+    if not METRICS_ENABLED:
+        return
+    snapshot = _snapshot()
+    if not any(entry["series"] for entry in snapshot.values()):
+        return  # nothing recorded (e.g. a CLI run); leave no empty file behind
+    if not _pruned:
+        _pruned = True
+        _prune_stale_runs()
+    try:
+        os.makedirs(_run_dir(), exist_ok=True)
+        path = _snapshot_path()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            json.dump(snapshot, handle)
+        os.replace(temp_path, path)
+    except OSError as exc:
+        print(f"Metrics snapshot failed: {exc}")
+
+
+def _maybe_flush() -> None:
+    global _next_flush
+    now = time.monotonic()
+    if now < _next_flush:
+        return
+    _next_flush = now + FLUSH_SECONDS
+    flush()
+
+
+def _reset_after_fork() -> None:
+    """A forked worker (Gunicorn --preload) starts empty under its own snapshot name."""
+    global _process_id, _next_flush
+    _process_id = uuid.uuid4().hex[:8]
+    _next_flush = 0.0
+    for metric in _metrics.values():
+        metric._values = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
+
+def _merge_into(merged: Dict[str, Any], snapshot: Dict[str, Any]) -> None:
+    for name, entry in snapshot.items():
+        target = merged.setdefault(name, {
+            "kind": entry["kind"], "help": entry["help"], "buckets": entry.get("buckets"), "series": {},
+        })
+        if target["kind"] != entry["kind"] or target["buckets"] != entry.get("buckets"):
+            continue  # a snapshot from an older release with a different layout
+        series = target["series"]
+        for item in entry["series"]:
+            key = _key(item[0])
+            if entry["kind"] == "histogram":
+                counts, total = series.get(key, ([0] * len(item[1]), 0.0))
+                series[key] = ([a + b for a, b in zip(counts, item[1])], total + item[2])
+            else:
+                series[key] = series.get(key, 0.0) + item[1]
+
+
+def collect() -> Dict[str, Any]:
+    """Every process's metrics on this host, merged; this process's values are live."""
+    # Live values first, so HELP texts come from this release
+    merged: Dict[str, Any] = {}
+    _merge_into(merged, _snapshot())
+    own = _snapshot_path()
+    for path in glob.glob(os.path.join(_run_dir(), "*.json")):
+        if path == own:
+            continue
+        try:
+            with open(path, encoding="utf-8") as handle:
+                _merge_into(merged, json.load(handle))
+        except (OSError, ValueError):
+            continue  # being replaced or truncated; the next scrape reads it
+    return merged
+
+
+# ---------------------------------------------------------------------------
+# Exposition
+# ---------------------------------------------------------------------------
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    if not METRICS_ENABLED:
+        return "# metrics disabled (METRICS_ENABLED=false)\n"
+    lines: List[str] = []
+    merged = collect()
+    for name in sorted(merged):
+        entry = merged[name]
+        if not entry["series"]:
+            continue
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['kind']}")
+        for key in sorted(entry["series"]):
+            value = entry["series"][key]
+            if entry["kind"] != "histogram":
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(entry["buckets"] + [float("inf")], counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{name}_bucket{_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(key)} {total!r}")
+            lines.append(f"{name}_count{_labels(key)} {cumulative}")
+
+    # Derived from the merged totals so the ratio covers the whole host
+    hits = merged.get("cache_hits_total", {}).get("series", {})
+    misses = merged.get("cache_misses_total", {}).get("series", {})
+    if hits or misses:
+        lines.append("# HELP cache_hit_ratio Share of lookups answered from the cache, over all processes.")
+        lines.append("# TYPE cache_hit_ratio gauge")
+        for key in sorted(set(hits) | set(misses)):
+            lookups = hits.get(key, 0.0) + misses.get(key, 0.0)
+            if lookups:
+                lines.append(f"cache_hit_ratio{_labels(key)} {round(hits.get(key, 0.0) / lookups, 4)!r}")
+
+    for gauge in _gauges:
+        try:
+            samples = gauge.function()
+        except Exception as exc:
+            print(f"Metrics gauge {gauge.name} failed: {exc}")
+            continue
+        lines.append(f"# HELP {gauge.name} {gauge.help}")
+        lines.append(f"# TYPE {gauge.name} gauge")
+        for labels, value in samples:
+            lines.append(f"{gauge.name}{_labels(_key(labels))} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------------------
+# Instrumentation
+# ---------------------------------------------------------------------------
+
+def start_request() -> None:
+    """Flask ``before_request`` hook."""
+    from flask import g
+
+    g.metrics_started = time.perf_counter()
+
+
+def record_response(response):
+    """Flask ``after_request`` hook; remembers the status for ``finish_request``."""
+    from flask import g
+
+    g.metrics_status = response.status_code
+    return response
+
+
+def finish_request(exc: Optional[BaseException] = None) -> None:
+    """Flask ``teardown_request`` hook; also sees requests that raised."""
+    from flask import g, request
+
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    status = g.pop("metrics_status", 500)
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method, status=status)
+
+
+def _statement_type(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def observe_query(backend: str, statement: str, seconds: float) -> None:
+    """Record a statement run outside SQLAlchemy (the Postgres backend's psycopg cursors)."""
+    DB_QUERY_SECONDS.observe(seconds, backend=backend, operation=_statement_type(statement))
+
+
+def instrument_engine(engine, backend: str) -> None:
+    """Time every statement ``engine`` runs through SQLAlchemy's cursor events."""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_query_started", None)
+        if started is not None:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, backend=backend, operation=_statement_type(statement))
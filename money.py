@@ -0,0 +1,89 @@
+"""
+Fixed-point money helpers.
+
+Amounts are stored as integer cents in every backend. Parsing, comparison and
+aggregation happen on integers, and values are only turned into ``Decimal``
+for display, so sums over many invoices never drift the way floats do.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, Optional
+
+CENT = Decimal("0.01")
+
+# Legacy float/numeric field name -> integer-cents column
+CENTS_FIELDS = {
+    "total_amount": "total_cents",
+    "credit": "credit_cents",
+    "paid_amount": "paid_cents",
+    "payment_amount": "amount_cents",
+}
+
+
+def to_cents(value: Any) -> int:
+    """Convert user input or a stored amount ("1,234.56", 12.5, Decimal) to integer cents.
+
+    Raises:
+        ValueError: If the value is not a valid amount.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid amount: {value!r}")
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        # repr() gives the shortest string that round-trips, e.g. 0.1 -> "0.1"
+        value = repr(value)
+    cleaned = str(value).strip().replace(",", "").replace("$", "")
+    if not cleaned:
+        raise ValueError("Amount is empty")
+    try:
+        amount = Decimal(cleaned)
+    except InvalidOperation as exc:
+        raise ValueError(f"Invalid amount: {value!r}") from exc
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    return int(amount.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents: Optional[int]) -> Decimal:
+    """Integer cents -> Decimal with two places (None is treated as zero)."""
+    return (Decimal(int(cents or 0)) / 100).quantize(CENT)
+
+
+def format_cents(cents: Optional[int]) -> str:
+    """Integer cents -> "1,234.56"."""
+    return f"{from_cents(cents):,.2f}"
+
+
+def cents_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of ``data`` with legacy amount keys converted to their cents columns.
+
+    Callers may pass either ``total_amount=12.5`` or ``total_cents=1250``; an
+    explicit cents value wins.
+    """
+    converted = dict(data)
+    for amount_key, cents_key in CENTS_FIELDS.items():
+        if amount_key in converted:
+            value = converted.pop(amount_key)
+            if cents_key not in converted and value is not None:
+                converted[cents_key] = to_cents(value)
+    return converted
+
+
+def add_amounts(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the display amounts (``total_amount``, ``credit``, ...) derived from a row's cents columns."""
+    for amount_key, cents_key in CENTS_FIELDS.items():
+        if cents_key in row:
+            row[amount_key] = from_cents(row[cents_key])
+    return row
+
+
+def sum_cents(values: Iterable[Optional[int]]) -> int:
+    """Exact sum of cents values; vectorised with NumPy int64 when it is installed."""
+    try:
+        import numpy as np
+    except ImportError:
+        return sum(int(value or 0) for value in values)
+
+    array = np.fromiter((value or 0 for value in values), dtype=np.int64)
+    return int(array.sum())
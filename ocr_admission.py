@@ -0,0 +1,294 @@
+"""
+Admission control for OCR requests.
+
+Rendering a page at 400 DPI, the OpenCV buffers and Tesseract together need a
+few hundred MB, and every Gunicorn worker (and thread) can be doing it at the
+same time. Admission is shared across all workers on the host through lock
+files:
+
+- the memory budget (``OCR_MEMORY_BUDGET_MB``) is split into slot files of
+  ``OCR_MEMORY_UNIT_MB`` each; a request holds ``flock`` on as many slots as
+  its estimated footprint needs,
+- a request that cannot be admitted right away waits holding one of
+  ``OCR_QUEUE_SIZE`` queue ticket files, for at most ``OCR_QUEUE_TIMEOUT``
+  seconds,
+- with no free ticket (or after the timeout) ``Saturated`` is raised and the
+  route answers 429 with ``Retry-After``.
+
+``flock`` locks are released by the kernel when a process dies, so a crashed
+or OOM-killed worker never leaks budget. Without ``fcntl`` (Windows)
+admission is disabled.
+"""
+
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import metrics
+import ocr_handler
+
+ADMISSION_DIR = os.getenv(
+    "OCR_ADMISSION_DIR",
+    os.path.join(tempfile.gettempdir(), "invoice-ocr-admission"),
+)
+MEMORY_BUDGET_MB = int(os.getenv("OCR_MEMORY_BUDGET_MB", "1024"))
+MEMORY_UNIT_MB = int(os.getenv("OCR_MEMORY_UNIT_MB", "64"))
+QUEUE_SIZE = int(os.getenv("OCR_QUEUE_SIZE", "8"))
+QUEUE_TIMEOUT = float(os.getenv("OCR_QUEUE_TIMEOUT", "20"))
+RETRY_AFTER_SECONDS = int(os.getenv("OCR_RETRY_AFTER_SECONDS", "10"))
+
+SLOTS = max(1, MEMORY_BUDGET_MB // MEMORY_UNIT_MB)
+
+# Peak bytes per rendered pixel: RGB pixmap, its PNG and PIL copies, the
+# OpenCV grayscale/CLAHE/denoise/threshold/deskew buffers and Tesseract's own
+# page images.
+BYTES_PER_PIXEL = 20
+# Interpreter, PyMuPDF document and Tesseract model overhead per request
+BASE_MB = 32
+# Every retained page adds a little (its text and the open document)
+PER_PAGE_MB = 1
+# Resident memory of one preprocessing worker (interpreter, NumPy, OpenCV); see
+# ocr_handler.OCR_PREPROCESS_WORKERS
+PREPROCESS_WORKER_MB = int(os.getenv("OCR_PREPROCESS_WORKER_MB", "96"))
+
+POLL_INTERVAL = 0.05
+POLL_INTERVAL_MAX = 0.5
+
+
+class Saturated(Exception):
+    """OCR capacity is exhausted; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, message: str, retry_after: int = RETRY_AFTER_SECONDS) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# Per-process counters (each Gunicorn worker reports its own)
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "admitted": 0,
+    "rejected": 0,
+    "waited": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+
+def _record(key: str, wait_seconds: Optional[float] = None) -> None:
+    with _stats_lock:
+        _stats[key] += 1
+        if wait_seconds is not None and wait_seconds > 0:
+            _stats["waited"] += 1
+            _stats["wait_seconds_total"] += wait_seconds
+            _stats["wait_seconds_max"] = max(_stats["wait_seconds_max"], wait_seconds)
+
+
+def estimate_memory_mb(path: str) -> int:
+    """Estimate the peak memory OCR of ``path`` needs; 0 when no page needs OCR.
+
+    PDF pages are OCR'd one at a time, so the largest page without a text
+    layer sets the peak and the page count only adds a small per-page
+    overhead. Frames of a raster image are OCR'd OCR_IMAGE_WORKERS at a time.
+    When pages are preprocessed on this process's worker pool, the request
+    may start that pool and keep it alive, so its resident memory is charged
+    too.
+    """
+    try:
+        sizes = ocr_handler.raster_page_sizes(path)
+    except ValueError:
+        # Refused by the decompression-bomb guard before anything is decoded
+        return BASE_MB
+    if sizes is not None:
+        page_count = len(sizes)
+        largest = float(max(width * height for width, height in sizes)) * min(page_count, ocr_handler.OCR_IMAGE_WORKERS)
+    else:
+        try:
+            import fitz  # PyMuPDF
+
+            with fitz.open(path) as doc:
+                page_count = len(doc)
+                largest = 0.0
+                for page in doc:
+                    if page.get_text("text").strip():
+                        continue
+                    rect = page.rect
+                    # Page size is in points (1/72 inch)
+                    pixels = (rect.width / 72 * ocr_handler.OCR_DPI) * (rect.height / 72 * ocr_handler.OCR_DPI)
+                    largest = max(largest, pixels)
+        except Exception:
+            return BASE_MB
+
+    if not largest:
+        return 0
+    base_mb = BASE_MB
+    if ocr_handler.preprocesses_in_pool():
+        base_mb += PREPROCESS_WORKER_MB * max(1, ocr_handler.OCR_PREPROCESS_WORKERS)
+    return int(base_mb + page_count * PER_PAGE_MB + largest * BYTES_PER_PIXEL / (1024 * 1024))
+
+
+def _units(cost_mb: int) -> int:
+    # A request larger than the whole budget still runs, just alone
+    return min(SLOTS, max(1, math.ceil(cost_mb / MEMORY_UNIT_MB)))
+
+
+def _open(name: str) -> int:
+    return os.open(os.path.join(ADMISSION_DIR, name), os.O_RDWR | os.O_CREAT, 0o600)
+
+
+def _try_lock(name: str) -> Optional[int]:
+    fd = _open(name)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _release(fds: List[int]) -> None:
+    for fd in fds:
+        os.close(fd)  # closing the descriptor drops its flock
+
+
+@contextmanager
+def _arbiter() -> Iterator[None]:
+    """Serialises slot acquisition so two requests never each grab half of what they need."""
+    fd = _open("arbiter.lock")
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _try_acquire(units: int) -> Optional[List[int]]:
+    with _arbiter():
+        held: List[int] = []
+        for slot in range(SLOTS):
+            fd = _try_lock(f"slot-{slot:03d}")
+            if fd is not None:
+                held.append(fd)
+                if len(held) == units:
+                    return held
+        _release(held)
+        return None
+
+
+def _take_ticket() -> Optional[int]:
+    # Under the arbiter, so stats() probing every ticket never makes them all look taken
+    with _arbiter():
+        for ticket in range(QUEUE_SIZE):
+            fd = _try_lock(f"queue-{ticket:03d}")
+            if fd is not None:
+                return fd
+        return None
+
+
+@contextmanager
+def admit(cost_mb: int) -> Iterator[float]:
+    """Hold OCR capacity for ``cost_mb`` for the duration of the block; yields the seconds spent waiting.
+
+    Raises:
+        Saturated: If the wait queue is full or the wait exceeded ``OCR_QUEUE_TIMEOUT``.
+    """
+    if fcntl is None or cost_mb <= 0:
+        yield 0.0
+        return
+
+    os.makedirs(ADMISSION_DIR, exist_ok=True)
+    units = _units(cost_mb)
+    started = time.monotonic()
+    held = _try_acquire(units)
+    queued = held is None
+    if held is None:
+        ticket = _take_ticket()
+        if ticket is None:
+            _record("rejected")
+            raise Saturated("OCR queue is full")
+        try:
+            interval = POLL_INTERVAL
+            while held is None:
+                if time.monotonic() - started > QUEUE_TIMEOUT:
+                    _record("rejected", time.monotonic() - started)
+                    raise Saturated("Timed out waiting for OCR capacity")
+                time.sleep(interval)
+                interval = min(interval * 2, POLL_INTERVAL_MAX)
+                held = _try_acquire(units)
+        finally:
+            _release([ticket])
+
+    waited = time.monotonic() - started if queued else 0.0
+    _record("admitted", waited)
+    try:
+        yield waited
+    finally:
+        _release(held)
+
+
+def _count_locked(prefix: str, count: int) -> int:
+    """Files of ``prefix`` held by a request; call under ``_arbiter()``, as probing briefly locks each free one."""
+    locked = 0
+    for index in range(count):
+        fd = _try_lock(f"{prefix}-{index:03d}")
+        if fd is None:
+            locked += 1
+        else:
+            _release([fd])
+    return locked
+
+
+ADMISSIONS = metrics.Counter("ocr_admissions_total", "OCR requests admitted or rejected (429) by this host.")
+ADMISSION_WAIT_SECONDS = metrics.Counter("ocr_admission_wait_seconds_total", "Seconds admitted OCR requests spent queued.")
+
+
+def _export_metrics() -> None:
+    with _stats_lock:
+        ADMISSIONS._set(_stats["admitted"], result="admitted")
+        ADMISSIONS._set(_stats["rejected"], result="rejected")
+        ADMISSION_WAIT_SECONDS._set(_stats["wait_seconds_total"])
+
+
+def _host_usage() -> List[Tuple[Dict[str, Any], float]]:
+    if fcntl is None:
+        return []
+    current = stats()
+    return [
+        ({"resource": "memory_mb"}, current["memory_in_use_mb"]),
+        ({"resource": "queue"}, current["queue_depth"]),
+    ]
+
+
+def _host_limits() -> List[Tuple[Dict[str, Any], float]]:
+    return [({"resource": "memory_mb"}, SLOTS * MEMORY_UNIT_MB), ({"resource": "queue"}, QUEUE_SIZE)]
+
+
+metrics.on_snapshot(_export_metrics)
+metrics.Gauge("ocr_admission_in_use", "Host-wide OCR memory budget and queue tickets currently held.", _host_usage)
+metrics.Gauge("ocr_admission_limit", "Host-wide OCR memory budget and queue size.", _host_limits)
+
+
+def stats() -> Dict[str, Any]:
+    """Host-wide budget and queue usage plus this process's admission counters."""
+    with _stats_lock:
+        local = dict(_stats)
+    result: Dict[str, Any] = {
+        "enabled": fcntl is not None,
+        "memory_budget_mb": SLOTS * MEMORY_UNIT_MB,
+        "queue_size": QUEUE_SIZE,
+        "process": local,
+    }
+    if fcntl is not None:
+        os.makedirs(ADMISSION_DIR, exist_ok=True)
+        with _arbiter():
+            result["memory_in_use_mb"] = _count_locked("slot", SLOTS) * MEMORY_UNIT_MB
+            result["queue_depth"] = _count_locked("queue", QUEUE_SIZE)
+    return result
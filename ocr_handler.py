@@ -1,34 +1,48 @@
 import io
+import multiprocessing
+import os
 import re
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-
-import fitz  # PyMuPDF
-
-try:
-    import cv2
-    import numpy as np
-    CV2_AVAILABLE = True
-except ImportError:
-    CV2_AVAILABLE = False
-
-
-DATE_FORMATS = [
-    "%Y-%m-%d",
-    "%d/%m/%Y",
-    "%m/%d/%Y",
-    "%d-%m-%Y",
-    "%m-%d-%Y",
-    "%d.%m.%Y",
-    "%Y/%m/%d",
-    "%d %b %Y",
-    "%d %B %Y",
-    "%b %d, %Y",
-    "%B %d, %Y",
-    "%Y.%m.%d",
-    "%d-%b-%Y",
-    "%d %b, %Y",
-]
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import layout
+import metrics
+from companies import COMPANY_SUFFIXES
+from dates import parse_date
+
+# fitz (PyMuPDF), cv2 and numpy are imported on first use: a worker that only
+# serves listing pages never loads them (see preload_modules for the opposite)
+_OPENCV: Optional[tuple] = None
+
+
+def _opencv() -> Optional[tuple]:
+    """``(cv2, numpy)``, or None when OpenCV is not installed."""
+    global _OPENCV
+    if _OPENCV is None:
+        try:
+            import cv2
+            import numpy as np
+            _OPENCV = (cv2, np)
+        except ImportError:
+            _OPENCV = ()
+    return _OPENCV or None
+
+
+def preload_modules() -> None:
+    """Imports the OCR dependencies now instead of on the first OCR request."""
+    import fitz  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+    _opencv()
+    try:
+        import pytesseract  # noqa: F401
+    except ImportError:
+        pass
+
 
 DATE_REGEXES = [
     r"\b(\d{4}[-/\.]\d{1,2}[-/\.]\d{1,2})\b",  # 2025-01-15, 2025.01.15
@@ -60,32 +74,6 @@ COMPANY_EXCLUDE_TERMS = [
     "ship to",
 ]
 
-COMPANY_SUFFIXES = [
-    "inc",
-    "inc.",
-    "co",
-    "co.",
-    "corp",
-    "corp.",
-    "ltd",
-    "ltd.",
-    "llc",
-    "gmbh",
-    "pte",
-    "pte.",
-    "company",
-    "limited",
-    "corporation",
-    "plc",
-    "sas",
-    "sa",
-    "kg",
-    "ag",
-    "bv",
-    "srl",
-    "oy",
-]
-
 ADDRESS_TERMS = [
     "street",
     "st.",
@@ -137,9 +125,11 @@ def _preprocess_image(image):
     - Binarization
     - Deskew
     """
-    if not CV2_AVAILABLE:
+    opencv = _opencv()
+    if opencv is None:
         # Return original image if OpenCV not available
         return image
+    cv2, np = opencv
 
     try:
         # Convert PIL Image to numpy array
@@ -201,16 +191,82 @@ def _preprocess_image(image):
 
 def extract_invoice_data(pdf_path: str) -> Tuple[Dict[str, Optional[str]], List[str]]:
     """Extracts invoice information from a PDF or image file and returns the detected fields plus warnings."""
-    text = _extract_text(pdf_path)
+    return parse_invoice_text(extract_text(pdf_path), extract_layout_fields(pdf_path))
+
+
+@metrics.OCR_STAGE_SECONDS.time(stage="layout")
+def extract_layout_fields(pdf_path: str) -> Dict[str, Any]:
+    """Reads fields by position from the PDF's text layer (see layout.py).
+
+    Header fields come from the first page, the total from the last pages.
+    Fields that cannot be placed are left out, as is everything for scans
+    without a text layer; ``parse_invoice_text`` falls back to the text regexes.
+    """
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception:
+        return {}
+    with doc:
+        if not len(doc):
+            return {}
+        index = layout.LayoutIndex(doc)
+        fields: Dict[str, Any] = {}
+        if index.page(0).words:
+            fields["invoice_number"] = layout.find_invoice_number(index)
+            fields["invoice_date"] = layout.find_invoice_date(index)
+            fields["company_name"] = layout.find_company_name(index, _company_line_score)
+        fields["total_amount"] = layout.find_total_amount(index)
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+def extract_text(pdf_path: str) -> str:
+    """Returns the full text of a PDF or image file (text layer or OCR), e.g. for search indexing."""
+    return _extract_text(pdf_path)[0]
+
+
+def extract_text_within_budget(
+    pdf_path: str,
+    page_timeout: Optional[float] = None,
+    document_timeout: Optional[float] = None,
+    mode: Optional[str] = None,
+) -> Tuple[str, List[int], bool]:
+    """Like ``extract_text`` but bounded in time and optionally limited to the field regions.
+
+    Returns the text, the 1-based pages that ran out of time, and whether the
+    text only covers the field regions (``mode="roi"``, default OCR_MODE).
+    Defaults to OCR_PAGE_TIMEOUT / OCR_DOCUMENT_TIMEOUT. Once the document
+    budget is spent the remaining pages that need OCR are skipped and reported.
+    """
+    return _extract_text(
+        pdf_path,
+        OCR_PAGE_TIMEOUT if page_timeout is None else page_timeout,
+        OCR_DOCUMENT_TIMEOUT if document_timeout is None else document_timeout,
+        OCR_MODE if mode is None else mode,
+    )
+
+
+@metrics.OCR_STAGE_SECONDS.time(stage="parse")
+def parse_invoice_text(
+    text: str,
+    layout_fields: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Optional[str]], List[str]]:
+    """Detects invoice fields in already extracted text and returns them plus warnings.
+
+    Fields in ``layout_fields`` (from ``extract_layout_fields``) are taken as
+    they are; only the missing ones are searched for in the text.
+    """
     if not text.strip():
         raise ValueError("No readable text detected in the file. Please fill the fields manually.")
 
+    layout_fields = layout_fields or {}
     lines = [line.strip() for line in text.splitlines() if line.strip()]
 
-    invoice_number = _find_invoice_number(text)
-    total_amount = _find_total_amount(text)
-    invoice_date = _find_invoice_date(text, lines)
-    company_name = _find_company_name(lines)
+    invoice_number = layout_fields.get("invoice_number") or _find_invoice_number(text)
+    total_amount = layout_fields.get("total_amount") or _find_total_amount(text)
+    invoice_date = layout_fields.get("invoice_date") or _find_invoice_date(text, lines)
+    company_name = layout_fields.get("company_name") or _find_company_name(lines)
 
     if (
         invoice_number is None
@@ -255,115 +311,509 @@ def _clean_ocr_text(text: str) -> str:
     return cleaned
 
 
-def _extract_text(pdf_path: str) -> str:
-    """Returns combined text from all pages in the PDF or image file with enhanced OCR."""
-    text_segments = []
+# Enhanced Tesseract configuration
+# PSM 3: Fully automatic page segmentation (default)
+# PSM 1: Automatic page segmentation with OSD (Orientation and Script Detection)
+# OEM 3: Default (both Legacy and LSTM engines)
+TESSERACT_CONFIG = r'--oem 3 --psm 3 -c preserve_interword_spaces=1'
+
+# Render resolution for pages without a text layer (400 DPI for better accuracy)
+OCR_DPI = 400
+
+# Time budgets for request-time OCR; both stay below gunicorn's --timeout 120
+OCR_PAGE_TIMEOUT = float(os.getenv("OCR_PAGE_TIMEOUT", "30"))
+OCR_DOCUMENT_TIMEOUT = float(os.getenv("OCR_DOCUMENT_TIMEOUT", "90"))
+
+# "full" OCRs whole pages; "roi" first OCRs only the regions that hold the
+# invoice fields and falls back to whole pages when a field is missing
+OCR_MODE = os.getenv("OCR_MODE", "full").strip().lower()
+
+# Page-height fractions of the field regions: number, date and vendor in the
+# header of the first page, totals at the bottom of the last page
+HEADER_ZONE = (0.0, 0.35)
+TOTALS_ZONE = (0.6, 1.0)
+
+# The layout pass renders each region at this DPI to find where the ink is
+LAYOUT_DPI = 50
+INK_THRESHOLD = 160
+ZONE_PADDING = 12  # points
+
+# Raster uploads (TIFF, JPEG, PNG) are OCR'd at their own resolution, reduced
+# to about OCR_DPI (US Letter at 400 DPI when the file has no DPI) on load
+OCR_TARGET_PIXELS = 3400 * 4400
+# Decompression-bomb guard: frames that would decode to more pixels are refused
+OCR_MAX_IMAGE_PIXELS = int(os.getenv("OCR_MAX_IMAGE_PIXELS", "100000000"))
+# Frames of a multi-page TIFF OCR'd at the same time
+OCR_IMAGE_WORKERS = int(os.getenv("OCR_IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Processes that run time-bounded image preprocessing for this process. Each
+# holds its own interpreter, NumPy and OpenCV (see ocr_admission), so the pool
+# is small and shut down after OCR_PREPROCESS_IDLE_SECONDS without work.
+OCR_PREPROCESS_WORKERS = int(os.getenv("OCR_PREPROCESS_WORKERS", "1"))
+OCR_PREPROCESS_IDLE_SECONDS = float(os.getenv("OCR_PREPROCESS_IDLE_SECONDS", "60"))
+
+
+class OCRTimeout(Exception):
+    """A page ran past its OCR time budget."""
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise OCRTimeout("Page time budget exhausted")
+    return remaining
+
 
-    # Enhanced Tesseract configuration
-    # PSM 3: Fully automatic page segmentation (default)
-    # PSM 1: Automatic page segmentation with OSD (Orientation and Script Detection)
-    # OEM 3: Default (both Legacy and LSTM engines)
-    tesseract_config = r'--oem 3 --psm 3 -c preserve_interword_spaces=1'
+def _tesseract(image, timeout: Optional[float] = None) -> str:
+    """Runs the tesseract binary on one image (English only); forks a new process per call."""
+    import pytesseract
 
     try:
-        # Try to open with PyMuPDF (supports PDF, images like JPEG, PNG, TIFF)
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                # First try to extract embedded text
-                page_text = page.get_text("text")
-                if page_text and page_text.strip():
-                    text_segments.append(page_text)
-                else:
-                    # If no embedded text, try OCR with pytesseract
-                    try:
-                        import pytesseract
-                        from PIL import Image
-
-                        # Convert page to higher resolution image (400 DPI for better accuracy)
-                        pix = page.get_pixmap(dpi=400)
-                        img_data = pix.tobytes("png")
-                        img = Image.open(io.BytesIO(img_data))
-
-                        # Preprocess image for better OCR
-                        processed_img = _preprocess_image(img)
-
-                        # Perform OCR (English only)
-                        ocr_text = None
-                        try:
-                            ocr_text = pytesseract.image_to_string(
-                                processed_img,
-                                lang='eng',
-                                config=tesseract_config
-                            )
-                        except Exception:
-                            pass
-
-                        # If preprocessed image didn't work well, try original
-                        if not ocr_text or len(ocr_text.strip()) < 10:
-                            try:
-                                ocr_text = pytesseract.image_to_string(
-                                    img,
-                                    lang='eng',
-                                    config=tesseract_config
-                                )
-                            except Exception:
-                                pass
-
-                        if ocr_text and ocr_text.strip():
-                            cleaned_text = _clean_ocr_text(ocr_text)
-                            text_segments.append(cleaned_text)
-
-                    except ImportError:
-                        # pytesseract not available, skip OCR
-                        pass
-                    except Exception as e:
-                        # OCR failed, skip this page
-                        print(f"OCR warning for page: {e}")
-                        pass
+        return pytesseract.image_to_string(image, lang='eng', config=TESSERACT_CONFIG, timeout=timeout or 0)
+    except RuntimeError as exc:
+        # pytesseract kills the binary and raises RuntimeError("Tesseract process timeout")
+        if timeout and "timeout" in str(exc).lower():
+            raise OCRTimeout(f"Tesseract exceeded {timeout:.0f}s") from exc
+        raise
+
+
+_preprocess_pool: Optional[ProcessPoolExecutor] = None
+_preprocess_pool_lock = threading.Lock()
+# One slot per worker: a page is only submitted once a worker is free to start it
+_preprocess_slots = threading.BoundedSemaphore(max(1, OCR_PREPROCESS_WORKERS))
+_preprocess_in_flight = 0
+_preprocess_idle_timer: Optional[threading.Timer] = None
+
+
+def preprocesses_in_pool() -> bool:
+    """Whether request-time pages are preprocessed on this process's worker pool (not the OCR service)."""
+    import ocr_service
+
+    return not ocr_service.SOCKET_PATH and _opencv() is not None
+
+
+def _warm_preprocess_worker() -> None:
+    _opencv()
+    # Held briefly so each warm-up task lands on a different worker
+    time.sleep(0.2)
+
+
+def _checkout_preprocess_pool() -> ProcessPoolExecutor:
+    """The preprocessing pool, started with every worker warm when there is none."""
+    global _preprocess_pool, _preprocess_in_flight, _preprocess_idle_timer
+    with _preprocess_pool_lock:
+        _preprocess_in_flight += 1
+        if _preprocess_idle_timer is not None:
+            _preprocess_idle_timer.cancel()
+            _preprocess_idle_timer = None
+        if _preprocess_pool is None:
+            # Never fork: the web and OCR threads of this process may hold locks a forked child inherits
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            workers = max(1, OCR_PREPROCESS_WORKERS)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            # Start-up and the OpenCV import happen here, outside any page's budget
+            for future in [pool.submit(_warm_preprocess_worker) for _ in range(workers)]:
+                future.result()
+            _preprocess_pool = pool
+        return _preprocess_pool
+
+
+def _checkin_preprocess_pool() -> None:
+    """Shut the pool down once it has been idle for OCR_PREPROCESS_IDLE_SECONDS."""
+    global _preprocess_in_flight, _preprocess_idle_timer
+    with _preprocess_pool_lock:
+        _preprocess_in_flight -= 1
+        if _preprocess_in_flight or _preprocess_pool is None:
+            return
+        _preprocess_idle_timer = threading.Timer(OCR_PREPROCESS_IDLE_SECONDS, _shut_down_idle_pool, (_preprocess_pool,))
+        _preprocess_idle_timer.daemon = True
+        _preprocess_idle_timer.start()
+
+
+def _shut_down_idle_pool(pool: ProcessPoolExecutor) -> None:
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is not pool or _preprocess_in_flight:
+            return
+        _preprocess_pool = None
+    pool.shutdown(wait=False)
+
+
+def _discard_preprocess_pool(pool: ProcessPoolExecutor) -> None:
+    """Kill the workers of ``pool`` (a stuck one included) and start a fresh pool on next use."""
+    global _preprocess_pool
+    with _preprocess_pool_lock:
+        if _preprocess_pool is not pool:
+            return
+        _preprocess_pool = None
+    # ProcessPoolExecutor cannot cancel a running task; killing its workers is the only way out
+    for process in list((pool._processes or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _preprocess_with_timeout(image, timeout: Optional[float]):
+    """Runs ``_preprocess_image`` in a worker process that is killed if it overruns ``timeout``.
+
+    OpenCV calls such as fastNlMeansDenoising cannot be interrupted from Python,
+    so a bounded run needs its own process. Waiting for a free worker counts
+    against ``timeout`` but never kills one: only a page that is running past
+    its budget does, and pages preprocessed on the same pool at that moment
+    fall back to their original image.
+    """
+    if timeout is None or _opencv() is None:
+        return _preprocess_image(image)
 
-    except Exception as e:
-        # If PyMuPDF fails, try with PIL + pytesseract directly for image files
+    started = time.monotonic()
+    if not _preprocess_slots.acquire(timeout=timeout):
+        raise OCRTimeout(f"No preprocessing worker was free within {timeout:.0f}s")
+    try:
+        remaining = timeout - (time.monotonic() - started)
+        pool = _checkout_preprocess_pool()
+        try:
+            if remaining <= 0:
+                raise OCRTimeout(f"No preprocessing worker was free within {timeout:.0f}s")
+            return pool.submit(_preprocess_image, image).result(remaining)
+        except TimeoutError:
+            _discard_preprocess_pool(pool)
+            raise OCRTimeout(f"Image preprocessing exceeded {timeout:.0f}s")
+        except BrokenProcessPool:
+            # A worker died without answering; OCR the original image instead
+            _discard_preprocess_pool(pool)
+            return image
+        finally:
+            _checkin_preprocess_pool()
+    finally:
+        _preprocess_slots.release()
+
+
+def recognize_image(
+    img, recognize=_tesseract, timeout: Optional[float] = None, preprocess=_preprocess_with_timeout
+) -> Optional[str]:
+    """OCR one page image, preprocessed first and falling back to the original; returns cleaned text.
+
+    ``recognize(image, timeout)`` runs the OCR engine and ``preprocess(image,
+    timeout)`` cleans the image up for it. With ``timeout`` the whole page
+    (preprocessing and both OCR attempts) must finish in that many seconds or
+    ``OCRTimeout`` is raised.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ocr_text = None
+    try:
+        with metrics.OCR_STAGE_SECONDS.time(stage="preprocess"):
+            preprocessed = preprocess(img, _remaining(deadline))
+        with metrics.OCR_STAGE_SECONDS.time(stage="tesseract"):
+            ocr_text = recognize(preprocessed, _remaining(deadline))
+    except (ImportError, OCRTimeout):
+        raise
+    except Exception:
+        pass
+
+    # If preprocessed image didn't work well, try original
+    if not ocr_text or len(ocr_text.strip()) < 10:
+        try:
+            with metrics.OCR_STAGE_SECONDS.time(stage="tesseract"):
+                ocr_text = recognize(img, _remaining(deadline))
+        except (ImportError, OCRTimeout):
+            raise
+        except Exception:
+            pass
+
+    if ocr_text and ocr_text.strip():
+        return _clean_ocr_text(ocr_text)
+    return None
+
+
+def _ocr_image(image_data: bytes, timeout: Optional[float] = None) -> Optional[str]:
+    """OCR an encoded page image, on the OCR service when OCR_SERVICE_SOCKET is set."""
+    import ocr_service
+
+    if ocr_service.SOCKET_PATH:
+        try:
+            return ocr_service.recognize(image_data, timeout=timeout)
+        except TimeoutError as e:
+            raise OCRTimeout(f"OCR service did not answer within {timeout or ocr_service.TIMEOUT:.0f}s") from e
+        except OSError as e:
+            print(f"OCR service unavailable, running Tesseract locally: {e}")
+
+    from PIL import Image
+
+    return recognize_image(Image.open(io.BytesIO(image_data)), timeout=timeout)
+
+
+def _ocr_frame(image, timeout: Optional[float] = None) -> Optional[str]:
+    """OCR a decoded image, on the OCR service when OCR_SERVICE_SOCKET is set."""
+    import ocr_service
+
+    if ocr_service.SOCKET_PATH:
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        return _ocr_image(buffer.getvalue(), timeout)
+    return recognize_image(image, timeout=timeout)
+
+
+def _open_raster(path: str):
+    """The file as a lazily decoded PIL image, or None when it is not a raster image (e.g. a PDF)."""
+    from PIL import Image
+
+    try:
+        return Image.open(path)
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Image is too large to process: {e}")
+    except Exception:
+        return None
+
+
+def _reduction(image) -> int:
+    """Integer downscale factor that brings a frame to about OCR_DPI."""
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0] and float(dpi[0]) > OCR_DPI:
+        return max(1, int(float(dpi[0]) // OCR_DPI))
+    pixels = image.width * image.height
+    if pixels > OCR_TARGET_PIXELS:
+        return max(1, int((pixels / OCR_TARGET_PIXELS) ** 0.5 + 0.999))
+    return 1
+
+
+def _decoded_size(image, factor: int) -> Tuple[int, int]:
+    # JPEG decoders scale by 1/2, 1/4 or 1/8 while decoding; other formats decode in full
+    if image.format == "JPEG" and factor > 1:
+        scale = min(8, 1 << (factor.bit_length() - 1))
+        return -(-image.width // scale), -(-image.height // scale)
+    return image.width, image.height
+
+
+def raster_page_sizes(path: str) -> Optional[List[Tuple[int, int]]]:
+    """Decoded size of each frame of a raster image, without decoding it (None for non-images)."""
+    image = _open_raster(path)
+    if image is None:
+        return None
+    sizes = []
+    with image:
+        for frame in range(getattr(image, "n_frames", 1)):
+            image.seek(frame)
+            sizes.append(_decoded_size(image, _reduction(image)))
+    return sizes
+
+
+@metrics.OCR_STAGE_SECONDS.time(stage="render")
+def _load_frame(image, frame: int):
+    """Decode one frame, reduced on load, refusing frames above OCR_MAX_IMAGE_PIXELS."""
+    image.seek(frame)
+    factor = _reduction(image)
+    target = (max(1, image.width // factor), max(1, image.height // factor))
+    width, height = _decoded_size(image, factor)
+    if width * height > OCR_MAX_IMAGE_PIXELS:
+        raise ValueError(
+            f"Page {frame + 1} is {image.width}x{image.height} pixels, above the "
+            f"{OCR_MAX_IMAGE_PIXELS} pixel limit (OCR_MAX_IMAGE_PIXELS)."
+        )
+    if image.format == "JPEG" and factor > 1:
+        image.draft(image.mode if image.mode in ("L", "RGB") else "RGB", target)
+    page = image.copy()
+    remaining = page.width // target[0]
+    if remaining > 1:
+        page = page.reduce(remaining)
+    return page
+
+
+def _extract_image_text(image, page_timeout, deadline) -> Tuple[List[str], List[int]]:
+    """OCR every frame of a raster image, up to OCR_IMAGE_WORKERS frames at a time.
+
+    Frames are decoded one by one on this thread (PIL images are not thread
+    safe) and only as many are held in memory as are being OCR'd.
+    """
+    frame_count = getattr(image, "n_frames", 1)
+    texts: Dict[int, str] = {}
+    timed_out: List[int] = []
+
+    def collect(page_number, future):
+        try:
+            cleaned_text = future.result()
+            if cleaned_text:
+                texts[page_number] = cleaned_text
+        except OCRTimeout as e:
+            print(f"OCR timeout on page {page_number}: {e}")
+            timed_out.append(page_number)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(OCR_IMAGE_WORKERS, frame_count))) as executor:
+        pending = []
+        for frame in range(frame_count):
+            page_number = frame + 1
+            budget = _page_budget(page_timeout, deadline)
+            if budget is not None and budget <= 0:
+                timed_out.append(page_number)
+                continue
+            pending.append((page_number, executor.submit(_ocr_frame, _load_frame(image, frame), budget)))
+            if len(pending) >= OCR_IMAGE_WORKERS:
+                collect(*pending.pop(0))
+        for page_number, future in pending:
+            collect(page_number, future)
+
+    return [texts[page_number] for page_number in sorted(texts)], timed_out
+
+
+def _page_budget(page_timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    """Seconds the next page may use: the per-page limit capped by what is left of the document's."""
+    if deadline is None:
+        return page_timeout
+    left = deadline - time.monotonic()
+    return left if page_timeout is None else min(page_timeout, left)
+
+
+def _ink_box(page, zone: Tuple[float, float]):
+    """Layout pass: the part of a page region that actually holds ink, or None if it is blank."""
+    import fitz  # PyMuPDF
+    from PIL import Image
+
+    rect = page.rect
+    region = fitz.Rect(rect.x0, rect.y0 + rect.height * zone[0], rect.x1, rect.y0 + rect.height * zone[1])
+    pix = page.get_pixmap(dpi=LAYOUT_DPI, clip=region, colorspace=fitz.csGRAY, alpha=False)
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride)
+    box = image.point(lambda value: 255 if value < INK_THRESHOLD else 0).getbbox()
+    if box is None:
+        return None
+    scale = 72 / LAYOUT_DPI
+    ink = fitz.Rect(
+        region.x0 + box[0] * scale - ZONE_PADDING,
+        region.y0 + box[1] * scale - ZONE_PADDING,
+        region.x0 + box[2] * scale + ZONE_PADDING,
+        region.y0 + box[3] * scale + ZONE_PADDING,
+    )
+    return ink & region
+
+
+def _ocr_field_zones(doc, ocr_pages: List[int], page_timeout, deadline) -> Tuple[Dict[int, str], List[int]]:
+    """OCR only the header of the first page and the totals of the last (where they need OCR)."""
+    zones = []
+    if 1 in ocr_pages:
+        zones.append((1, HEADER_ZONE))
+    if len(doc) in ocr_pages:
+        zones.append((len(doc), TOTALS_ZONE))
+
+    texts: Dict[int, List[str]] = defaultdict(list)
+    timed_out: List[int] = []
+    for page_number, zone in zones:
+        page = doc[page_number - 1]
+        clip = _ink_box(page, zone)
+        if clip is None:
+            continue
+        budget = _page_budget(page_timeout, deadline)
+        if budget is not None and budget <= 0:
+            timed_out.append(page_number)
+            continue
         try:
-            import pytesseract
-            from PIL import Image
+            with metrics.OCR_STAGE_SECONDS.time(stage="render"):
+                image_data = page.get_pixmap(dpi=OCR_DPI, clip=clip).tobytes("png")
+            cleaned_text = _ocr_image(image_data, budget)
+        except OCRTimeout as e:
+            print(f"OCR timeout on page {page_number} region: {e}")
+            timed_out.append(page_number)
+            continue
+        if cleaned_text:
+            texts[page_number].append(cleaned_text)
+    return {page_number: "\n".join(parts) for page_number, parts in texts.items()}, timed_out
 
-            img = Image.open(pdf_path)
 
-            # Preprocess image
-            processed_img = _preprocess_image(img)
+def _missing_fields(text: str) -> List[str]:
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    found = {
+        "invoice_number": _find_invoice_number(text),
+        "invoice_date": _find_invoice_date(text, lines),
+        "company_name": _find_company_name(lines),
+        "total_amount": _find_total_amount(text),
+    }
+    return [name for name, value in found.items() if value is None]
+
 
-            # English-only OCR
-            ocr_text = None
+def _extract_text(
+    pdf_path: str,
+    page_timeout: Optional[float] = None,
+    document_timeout: Optional[float] = None,
+    mode: str = "full",
+) -> Tuple[str, List[int], bool]:
+    """Returns combined text from the PDF or image file with enhanced OCR, the pages that
+    timed out, and whether only the field regions were OCR'd."""
+    text_segments = []
+    timed_out: List[int] = []
+    regions_only = False
+    deadline = None if document_timeout is None else time.monotonic() + document_timeout
+
+    # Raster images (every frame of a multi-page TIFF) go through PIL at their own resolution
+    image = _open_raster(pdf_path)
+    if image is not None:
+        with image:
             try:
-                ocr_text = pytesseract.image_to_string(
-                    processed_img,
-                    lang='eng',
-                    config=tesseract_config
-                )
-            except Exception:
-                pass
+                text_segments, timed_out = _extract_image_text(image, page_timeout, deadline)
+            except ImportError:
+                raise ValueError("Cannot process image files: pytesseract library not installed. Please install it with: pip install pytesseract")
+            except ValueError:
+                raise
+            except Exception as ex:
+                raise ValueError(f"Failed to extract text from file: {str(ex)}")
+        return "\n".join(text_segments), sorted(timed_out), False
+
+    import fitz  # PyMuPDF
 
-            # Try original image if preprocessed didn't work
-            if not ocr_text or len(ocr_text.strip()) < 10:
+    try:
+        # Try to open with PyMuPDF (PDF and the other formats it reads)
+        with fitz.open(pdf_path) as doc:
+            # First try to extract embedded text
+            page_texts: Dict[int, str] = {}
+            ocr_pages: List[int] = []
+            for page_number, page in enumerate(doc, start=1):
+                page_text = page.get_text("text")
+                if page_text and page_text.strip():
+                    page_texts[page_number] = page_text
+                else:
+                    ocr_pages.append(page_number)
+
+            if mode == "roi" and ocr_pages:
                 try:
-                    ocr_text = pytesseract.image_to_string(
-                        img,
-                        lang='eng',
-                        config=tesseract_config
-                    )
-                except Exception:
+                    zone_texts, zone_timed_out = _ocr_field_zones(doc, ocr_pages, page_timeout, deadline)
+                except ImportError:
+                    zone_texts, zone_timed_out = {}, []
+                combined = {**page_texts, **zone_texts}
+                missing = _missing_fields("\n".join(combined[n] for n in sorted(combined)))
+                if not missing:
+                    page_texts, timed_out, regions_only = combined, zone_timed_out, True
+                    ocr_pages = []
+                else:
+                    print(f"Region OCR missed {', '.join(missing)}; falling back to full pages")
+
+            for page_number in ocr_pages:
+                page = doc[page_number - 1]
+                # If no embedded text, try OCR
+                budget = _page_budget(page_timeout, deadline)
+                if budget is not None and budget <= 0:
+                    timed_out.append(page_number)
+                    continue
+                try:
+                    with metrics.OCR_STAGE_SECONDS.time(stage="render"):
+                        image_data = page.get_pixmap(dpi=OCR_DPI).tobytes("png")
+                    cleaned_text = _ocr_image(image_data, budget)
+                    if cleaned_text:
+                        page_texts[page_number] = cleaned_text
+
+                except OCRTimeout as e:
+                    print(f"OCR timeout on page {page_number}: {e}")
+                    timed_out.append(page_number)
+                except ImportError:
+                    # pytesseract not available, skip OCR
+                    pass
+                except Exception as e:
+                    # OCR failed, skip this page
+                    print(f"OCR warning for page: {e}")
                     pass
 
-            if ocr_text and ocr_text.strip():
-                cleaned_text = _clean_ocr_text(ocr_text)
-                text_segments.append(cleaned_text)
+            text_segments = [page_texts[page_number] for page_number in sorted(page_texts)]
 
-        except ImportError:
-            raise ValueError("Cannot process image files: pytesseract library not installed. Please install it with: pip install pytesseract")
-        except Exception as ex:
-            raise ValueError(f"Failed to extract text from file: {str(ex)}")
+    except Exception as e:
+        # Neither PIL (checked above) nor PyMuPDF can read the file
+        raise ValueError(f"Failed to extract text from file: {str(e)}")
 
-    return "\n".join(text_segments)
+    return "\n".join(text_segments), sorted(timed_out), regions_only
 
 
 def _find_invoice_number(text: str) -> Optional[str]:
@@ -471,67 +921,57 @@ def _find_company_name(lines: List[str]) -> Optional[str]:
     best_score: float = -float("inf")
 
     for index, raw_line in enumerate(lines[:20]):
-        line = raw_line.strip()
-        if not line:
-            continue
+        score = _company_line_score(lines, index)
+        if score > best_score:
+            best_score = score
+            best_value = raw_line.strip()
 
-        lower = line.lower()
-        if _looks_like_contact(line):
-            continue
+    if best_score < 0:
+        return None
+    return best_value
 
-        score = _base_company_score(line)
 
-        if any(term in lower for term in COMPANY_EXCLUDE_TERMS):
-            score -= 4
-        if _looks_like_address(line):
-            score -= 6
+def _company_line_score(lines: List[str], index: int) -> float:
+    """How likely ``lines[index]`` is the vendor name (-inf for lines that can never be)."""
+    line = lines[index].strip()
+    if not line:
+        return -float("inf")
 
-        # Company name is often directly above an address block.
-        if index + 1 < len(lines) and _looks_like_address(lines[index + 1]):
-            score += 7
-        if index + 1 < len(lines) and _looks_like_contact(lines[index + 1].strip()):
-            score += 2
+    lower = line.lower()
+    if _looks_like_contact(line):
+        return -float("inf")
 
-        # If previous line is address, this line might be continuation -> penalise.
-        if index > 0 and _looks_like_address(lines[index - 1]):
-            score -= 2
+    score = _base_company_score(line)
 
-        # Prioritise early lines.
-        if index <= 2:
-            score += 1
+    if any(term in lower for term in COMPANY_EXCLUDE_TERMS):
+        score -= 4
+    if _looks_like_address(line):
+        score -= 6
 
-        # Encourage succinct names.
-        if len(line.split()) > 4:
-            score -= 1
+    # Company name is often directly above an address block.
+    if index + 1 < len(lines) and _looks_like_address(lines[index + 1]):
+        score += 7
+    if index + 1 < len(lines) and _looks_like_contact(lines[index + 1].strip()):
+        score += 2
 
-        if score > best_score:
-            best_score = score
-            best_value = line
+    # If previous line is address, this line might be continuation -> penalise.
+    if index > 0 and _looks_like_address(lines[index - 1]):
+        score -= 2
 
-    if best_score < 0:
-        return None
-    return best_value
+    # Prioritise early lines.
+    if index <= 2:
+        score += 1
 
+    # Encourage succinct names.
+    if len(line.split()) > 4:
+        score -= 1
 
-def _normalize_date(value: str) -> Optional[str]:
-    candidate = value.strip()
-    for fmt in DATE_FORMATS:
-        try:
-            parsed = datetime.strptime(candidate, fmt)
-            return parsed.strftime("%Y-%m-%d")
-        except ValueError:
-            continue
+    return score
 
-    # Try normalizing textual dates without commas (e.g., "January 5 2023")
-    candidate_without_comma = re.sub(r",", "", candidate)
-    if candidate_without_comma != candidate:
-        for fmt in ("%b %d %Y", "%B %d %Y"):
-            try:
-                parsed = datetime.strptime(candidate_without_comma, fmt)
-                return parsed.strftime("%Y-%m-%d")
-            except ValueError:
-                continue
-    return None
+
+def _normalize_date(value: str) -> Optional[str]:
+    parsed = parse_date(value)
+    return parsed.isoformat() if parsed else None
 
 
 def _to_number(value: str) -> Optional[float]:
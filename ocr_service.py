@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Long-lived local OCR service.
+
+Running ``pytesseract`` forks a new ``tesseract`` binary for every page, and
+each fork reloads ``eng.traineddata`` before it can read a single pixel. This
+service keeps a fixed pool of worker processes that load Tesseract once (in
+process through the ``tesserocr`` C API when it is installed, otherwise still
+by subprocess) and answers page images over a UNIX socket.
+
+    python ocr_service.py serve [--socket PATH] [--workers N]
+
+``ocr_handler`` sends pages here whenever ``OCR_SERVICE_SOCKET`` is set and
+falls back to local Tesseract if the service cannot be reached.
+
+Wire format: one request per connection, every frame a 4-byte big-endian
+length followed by the payload. The client sends a JSON header
+``{"timeout": seconds}`` (``null`` for OCR_SERVICE_TIMEOUT) and then the
+encoded image (PNG, JPEG, TIFF ...); the service answers with a JSON object
+``{"text": ...}``, or ``{"error": ..., "timeout": true|false}``. A page that
+overruns its timeout is answered with an error and the worker pool is
+recycled, since a stuck OpenCV or Tesseract call cannot be interrupted.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+SOCKET_PATH = os.getenv("OCR_SERVICE_SOCKET")
+WORKERS = int(os.getenv("OCR_SERVICE_WORKERS", str(os.cpu_count() or 1)))
+TIMEOUT = float(os.getenv("OCR_SERVICE_TIMEOUT", "120"))
+
+# A 400 DPI A4 page is ~40 MB as raw RGB; encoded pages are far smaller
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+_HEADER = struct.Struct(">I")
+
+
+class OCRServiceError(RuntimeError):
+    """The service was reached but could not OCR the image."""
+
+
+def _send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    return _recv_exact(sock, size)
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+def recognize(image_data: bytes, socket_path: Optional[str] = None, timeout: Optional[float] = None) -> Optional[str]:
+    """OCR one encoded page image on the service; returns cleaned text or None.
+
+    ``timeout`` bounds the whole page on the service as well as the wait here.
+
+    Raises:
+        TimeoutError: If the page ran past ``timeout`` (on the service or in transit).
+        OSError: If the service cannot be reached.
+        OCRServiceError: If the service failed to process the image.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(TIMEOUT if timeout is None else timeout)
+        sock.connect(socket_path or SOCKET_PATH)
+        _send_frame(sock, json.dumps({"timeout": timeout}).encode("utf-8"))
+        _send_frame(sock, image_data)
+        reply = json.loads(_recv_frame(sock))
+    if "error" in reply:
+        if reply.get("timeout"):
+            raise TimeoutError(reply["error"])
+        raise OCRServiceError(reply["error"])
+    return reply.get("text")
+
+
+# ---------------------------------------------------------------------------
+# Worker processes
+# ---------------------------------------------------------------------------
+
+_engine = None
+
+
+def _init_worker() -> None:
+    """Load Tesseract once per worker process."""
+    global _engine
+    # Importing ocr_handler pulls in PyMuPDF, OpenCV and NumPy up front as well
+    import ocr_handler  # noqa: F401
+
+    try:
+        import tesserocr
+
+        _engine = tesserocr.PyTessBaseAPI(lang="eng", psm=tesserocr.PSM.AUTO, oem=tesserocr.OEM.DEFAULT)
+        _engine.SetVariable("preserve_interword_spaces", "1")
+    except ImportError:
+        _engine = None
+    except RuntimeError as exc:
+        print(f"OCR service: tesserocr failed to initialise, using the tesseract binary: {exc}")
+        _engine = None
+
+
+def _engine_recognize(image, timeout: Optional[float] = None) -> str:
+    if _engine is None:
+        import ocr_handler
+
+        return ocr_handler._tesseract(image, timeout)
+    _engine.SetImage(image)
+    return _engine.GetUTF8Text()
+
+
+def _preprocess(image, timeout: Optional[float] = None):
+    # Runs inline: the server kills this whole worker when the page overruns its budget
+    import ocr_handler
+
+    return ocr_handler._preprocess_image(image)
+
+
+def _recognize(image_data: bytes, timeout: Optional[float] = None) -> Optional[str]:
+    import ocr_handler
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_data))
+    image.load()
+    return ocr_handler.recognize_image(image, _engine_recognize, timeout, preprocess=_preprocess)
+
+
+def _warm_up() -> int:
+    # Held briefly so each warm-up task lands on a different worker
+    time.sleep(0.2)
+    return os.getpid()
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        self.request.settimeout(TIMEOUT)
+        try:
+            header = json.loads(_recv_frame(self.request))
+            image_data = _recv_frame(self.request)
+            timeout = min(float(header["timeout"]), TIMEOUT) if header.get("timeout") else TIMEOUT
+        except (OSError, ValueError, TypeError, AttributeError) as exc:
+            print(f"OCR service: bad request: {exc}")
+            return
+
+        try:
+            reply = {"text": self.server.run(image_data, timeout)}
+        except Exception as exc:
+            # ocr_handler.OCRTimeout comes back from the worker when a stage ran out of budget
+            timed_out = isinstance(exc, TimeoutError) or exc.__class__.__name__ == "OCRTimeout"
+            reply = {"error": str(exc) or exc.__class__.__name__, "timeout": timed_out}
+        try:
+            _send_frame(self.request, json.dumps(reply).encode("utf-8"))
+        except OSError:
+            pass
+
+
+class OCRServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Accepts connections on threads and runs the OCR itself on a fixed process pool."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workers: int) -> None:
+        self.workers = workers
+        self._pool_lock = threading.Lock()
+        # One slot per worker: a page is only submitted once a worker is free to start it
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pool = self._start_pool()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        # Never fork: the pool is replaced from handler threads, which a forked child would inherit mid-flight
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(method), initializer=_init_worker
+        )
+        pids = {future.result() for future in [pool.submit(_warm_up) for _ in range(self.workers)]}
+        print(f"OCR service: {len(pids)} warm worker(s) ready")
+        return pool
+
+    def run(self, image_data: bytes, timeout: float = TIMEOUT) -> Optional[str]:
+        """OCR one page on the pool; raises ``TimeoutError`` if it takes longer than ``timeout``.
+
+        Waiting for a free worker counts against ``timeout`` but never recycles
+        the pool; only a page running past its budget does.
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No OCR worker was free within {timeout:.0f}s")
+        try:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                raise TimeoutError(f"No OCR worker was free within {timeout:.0f}s")
+            pool = self._pool
+            try:
+                return pool.submit(_recognize, image_data, remaining).result(remaining)
+            except TimeoutError:
+                # The worker is stuck in C code; kill the pool so it stops burning a CPU
+                self._replace_pool(pool, f"a page overran its {timeout:.0f}s budget")
+                raise TimeoutError(f"OCR exceeded {timeout:.0f}s") from None
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed)
+                self._replace_pool(pool, "worker pool broke")
+                raise
+        finally:
+            self._slots.release()
+
+    def _replace_pool(self, pool: ProcessPoolExecutor, reason: str) -> None:
+        """Replace ``pool`` once for everyone and kill its workers; pages still on it fail."""
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            print(f"OCR service: {reason}, restarting the worker pool")
+            self._pool = self._start_pool()
+        # ProcessPoolExecutor cannot cancel a running task; killing its workers is the only way out
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.shutdown(cancel_futures=True)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def serve(socket_path: str, workers: int) -> None:
+    with OCRServer(socket_path, workers) as server:
+        def _stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, _stop)
+        print(f"OCR service listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local OCR service")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="Run the OCR service in the foreground")
+    serve_parser.add_argument("--socket", default=SOCKET_PATH, help="UNIX socket path (default: $OCR_SERVICE_SOCKET)")
+    serve_parser.add_argument("--workers", type=int, default=WORKERS, help="Worker processes (default: $OCR_SERVICE_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if not args.socket:
+            parser.error("--socket or OCR_SERVICE_SOCKET is required")
+        serve(args.socket, max(1, args.workers))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
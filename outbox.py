@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Durable outbox for side effects that should not block a request.
+
+Routes record work (for example "delete this uploaded file" or "OCR this
+invoice again without the request time limit") in a local SQLite table and
+return immediately. A background worker thread drains the table,
+batching file deletes into a single Supabase ``remove()`` call per batch and
+retrying failures with exponential backoff, so a flaky storage call no longer
+leaves orphan blobs behind.
+
+The module doubles as a maintenance command:
+
+    python outbox.py drain        # process every due entry and exit
+    python outbox.py status       # show pending / failed counts
+    python outbox.py retry-failed # re-queue entries that ran out of retries
+    python outbox.py reconcile    # delete stored files no invoice references
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import storage_handler
+
+OUTBOX_PATH = os.getenv(
+    "OUTBOX_DATABASE_PATH",
+    str(Path(__file__).resolve().parent / "outbox.db"),
+)
+LOCAL_UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", str(Path(__file__).resolve().parent / "uploads"))
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 3600.0
+
+# Uploads happen before the invoice row is written, so very new objects are
+# never treated as orphans.
+RECONCILE_GRACE_SECONDS = 3600
+
+KIND_DELETE_FILE = "delete_file"
+KIND_OCR_REPROCESS = "ocr_reprocess"
+
+# OCR runs far longer than a delete; its lease must outlast the reprocessing budget
+LEASE_SECONDS_BY_KIND = {KIND_OCR_REPROCESS: 30 * 60.0}
+
+# Background OCR is not bound by gunicorn's timeout, only by these budgets
+OCR_REPROCESS_PAGE_TIMEOUT = float(os.getenv("OCR_REPROCESS_PAGE_TIMEOUT", "300"))
+OCR_REPROCESS_DOCUMENT_TIMEOUT = float(os.getenv("OCR_REPROCESS_DOCUMENT_TIMEOUT", "900"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    locked_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    global _schema_ready
+    conn = sqlite3.connect(OUTBOX_PATH, timeout=30, isolation_level=None)
+    try:
+        if not _schema_ready:
+            with _schema_lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+# ---------- Enqueueing ----------
+
+def enqueue(kind: str, payloads: Iterable[Dict[str, Any]]) -> int:
+    """Persist one outbox entry per payload and wake the worker. Returns the number queued."""
+    now = time.time()
+    rows = [(kind, json.dumps(payload), now, now) for payload in payloads]
+    if not rows:
+        return 0
+    with _connect() as conn:
+        conn.executemany(
+            "INSERT INTO outbox (kind, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+    ensure_worker()
+    _wake.set()
+    return len(rows)
+
+
+def enqueue_file_deletes(paths: Iterable[Optional[str]], upload_folder: Optional[str] = None) -> int:
+    """Queue uploaded files for deletion from whichever storage is active."""
+    paths = [path for path in paths if path]
+    if storage_handler.should_use_storage():
+        payloads = [{"location": "storage", "path": path} for path in paths]
+    else:
+        folder = upload_folder or LOCAL_UPLOAD_FOLDER
+        payloads = [{"location": "local", "path": os.path.join(folder, path)} for path in paths]
+    return enqueue(KIND_DELETE_FILE, payloads)
+
+
+def enqueue_ocr_reprocess(invoice_id: int, path: str, upload_folder: Optional[str] = None) -> int:
+    """Queue an invoice whose request-time OCR was partial (timed out, or regions only) for a full OCR pass."""
+    if storage_handler.should_use_storage():
+        payload = {"invoice_id": invoice_id, "location": "storage", "path": path}
+    else:
+        payload = {"invoice_id": invoice_id, "location": "local", "path": os.path.join(upload_folder or LOCAL_UPLOAD_FOLDER, path)}
+    return enqueue(KIND_OCR_REPROCESS, [payload])
+
+
+# ---------- Handlers ----------
+
+Result = Tuple[bool, Optional[str]]
+
+
+def _handle_file_deletes(payloads: List[Dict[str, Any]]) -> List[Result]:
+    """Delete files; storage paths go out in one batched remove() per bucket."""
+    results: List[Optional[Result]] = [None] * len(payloads)
+
+    by_bucket: Dict[str, List[int]] = defaultdict(list)
+    for index, payload in enumerate(payloads):
+        if payload.get("location") == "storage":
+            by_bucket[payload.get("bucket", "invoices")].append(index)
+        else:
+            try:
+                if os.path.isfile(payload["path"]):
+                    os.remove(payload["path"])
+                results[index] = (True, None)
+            except OSError as exc:
+                results[index] = (False, f"Local delete error: {exc}")
+
+    for bucket, indexes in by_bucket.items():
+        success, error = storage_handler.delete_files([payloads[i]["path"] for i in indexes], bucket)
+        for i in indexes:
+            results[i] = (success, error)
+
+    return [result or (False, "not processed") for result in results]
+
+
+def _handle_ocr_reprocess(payloads: List[Dict[str, Any]]) -> List[Result]:
+    """OCR stored invoice files again with the long background budgets and save their text."""
+    # Imported here so the maintenance commands do not load PyMuPDF/OpenCV
+    import database
+    import ocr_admission
+    import ocr_handler
+
+    results: List[Result] = []
+    for payload in payloads:
+        if payload.get("location") == "storage":
+            data, error = storage_handler.download_file(payload["path"], payload.get("bucket", "invoices"))
+            if data is None:
+                results.append((False, error))
+                continue
+        else:
+            try:
+                with open(payload["path"], "rb") as handle:
+                    data = handle.read()
+            except OSError as exc:
+                results.append((False, f"Local read error: {exc}"))
+                continue
+
+        suffix = os.path.splitext(payload["path"])[1] or ".pdf"
+        with tempfile.NamedTemporaryFile(suffix=suffix) as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            try:
+                with ocr_admission.admit(ocr_admission.estimate_memory_mb(temp_file.name)):
+                    text, timed_out, _ = ocr_handler.extract_text_within_budget(
+                        temp_file.name,
+                        OCR_REPROCESS_PAGE_TIMEOUT,
+                        OCR_REPROCESS_DOCUMENT_TIMEOUT,
+                        mode="full",
+                    )
+            except ocr_admission.Saturated as exc:
+                results.append((False, f"OCR busy: {exc}"))
+                continue
+            except Exception as exc:
+                results.append((False, f"OCR error: {exc}"))
+                continue
+
+        if timed_out:
+            results.append((False, f"OCR still timed out on page(s) {', '.join(map(str, timed_out))}"))
+            continue
+        if database.update_invoice(payload["invoice_id"], {"ocr_text": text}) is None:
+            print(f"Outbox {KIND_OCR_REPROCESS}: invoice {payload['invoice_id']} no longer exists")
+        results.append((True, None))
+    return results
+
+
+HANDLERS: Dict[str, Callable[[List[Dict[str, Any]]], List[Result]]] = {
+    KIND_DELETE_FILE: _handle_file_deletes,
+    KIND_OCR_REPROCESS: _handle_ocr_reprocess,
+}
+
+
+# ---------- Draining ----------
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE ** attempts)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _claim_batch(limit: int) -> List[Tuple[int, str, Dict[str, Any], int]]:
+    """Lease up to ``limit`` due entries so concurrent workers never process the same row."""
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """
+                SELECT id, kind, payload, attempts FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ? AND locked_until <= ?
+                ORDER BY id
+                LIMIT ?
+                """,
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET locked_until = ? WHERE id = ?",
+                [(now + LEASE_SECONDS_BY_KIND.get(row[1], LEASE_SECONDS), row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return [(row[0], row[1], json.loads(row[2]), row[3]) for row in rows]
+
+
+def drain_once(limit: int = BATCH_SIZE) -> int:
+    """Process one batch of due entries. Returns how many entries were claimed."""
+    batch = _claim_batch(limit)
+    if not batch:
+        return 0
+
+    by_kind: Dict[str, List[Tuple[int, Dict[str, Any], int]]] = defaultdict(list)
+    for entry_id, kind, payload, attempts in batch:
+        by_kind[kind].append((entry_id, payload, attempts))
+
+    done: List[Tuple[int]] = []
+    retry: List[Tuple[str, float, str, int]] = []
+    now = time.time()
+
+    for kind, entries in by_kind.items():
+        handler = HANDLERS.get(kind)
+        if handler is None:
+            results: List[Result] = [(False, f"No handler for outbox kind '{kind}'")] * len(entries)
+        else:
+            try:
+                results = handler([payload for _, payload, _ in entries])
+            except Exception as exc:
+                results = [(False, str(exc))] * len(entries)
+
+        for (entry_id, _, attempts), (success, error) in zip(entries, results):
+            if success:
+                done.append((entry_id,))
+                continue
+            attempts += 1
+            new_status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+            retry.append((new_status, now + _backoff(attempts), error or "unknown error", entry_id))
+            print(f"Outbox {kind} #{entry_id} attempt {attempts} failed: {error}")
+
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM outbox WHERE id = ?", done)
+            conn.executemany(
+                """
+                UPDATE outbox
+                SET status = ?, next_attempt_at = ?, last_error = ?, attempts = attempts + 1, locked_until = 0
+                WHERE id = ?
+                """,
+                retry,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    return len(batch)
+
+
+def drain_all() -> int:
+    """Process due entries until none are left. Returns the total claimed."""
+    total = 0
+    while True:
+        processed = drain_once()
+        if not processed:
+            return total
+        total += processed
+
+
+def retry_failed() -> int:
+    """Move entries that exhausted their attempts back into the queue."""
+    with _connect() as conn:
+        cursor = conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'failed'",
+            (time.time(),),
+        )
+        return cursor.rowcount
+
+
+def status() -> Dict[str, int]:
+    with _connect() as conn:
+        rows = conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+# ---------- Background worker ----------
+
+_wake = threading.Event()
+_worker_pid: Optional[int] = None
+_worker_lock = threading.Lock()
+
+
+def _worker_loop() -> None:
+    while True:
+        try:
+            if drain_once():
+                continue
+        except Exception as exc:
+            print(f"Outbox worker error: {exc}")
+        _wake.wait(POLL_INTERVAL)
+        _wake.clear()
+
+
+def worker_enabled() -> bool:
+    return os.getenv("OUTBOX_WORKER_ENABLED", "true").strip().lower() in ("true", "1", "yes")
+
+
+def ensure_worker() -> None:
+    """Start the drain thread once per process (again after a gunicorn fork)."""
+    global _worker_pid
+    if _worker_pid == os.getpid() or not worker_enabled():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        thread = threading.Thread(target=_worker_loop, name="outbox-worker", daemon=True)
+        thread.start()
+        _worker_pid = os.getpid()
+
+
+# ---------- Reconciliation ----------
+
+def find_orphans(references: Iterable[str], objects: Iterable[Dict[str, Any]], now: Optional[float] = None) -> List[str]:
+    """Return stored object names that nothing references and that are past the grace period."""
+    from datetime import datetime
+
+    referenced = set(references)
+    cutoff = (now or time.time()) - RECONCILE_GRACE_SECONDS
+    orphans = []
+    for obj in objects:
+        name = obj.get("name")
+        if not name or name in referenced:
+            continue
+        created = obj.get("created_at")
+        if created:
+            try:
+                if datetime.fromisoformat(str(created).replace("Z", "+00:00")).timestamp() > cutoff:
+                    continue
+            except ValueError:
+                pass
+        orphans.append(name)
+    return orphans
+
+
+def _list_local_files(folder: str) -> List[Dict[str, Any]]:
+    from datetime import datetime, timezone
+
+    objects = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and not entry.name.startswith("."):
+            created = datetime.fromtimestamp(entry.stat().st_mtime, tz=timezone.utc).isoformat()
+            objects.append({"name": entry.name, "created_at": created})
+    return objects
+
+
+def reconcile(dry_run: bool = False, upload_folder: Optional[str] = None) -> List[str]:
+    """Diff stored files against invoice references and delete the orphans in bulk."""
+    import database
+
+    references = database.list_file_references()
+    if storage_handler.should_use_storage():
+        objects = storage_handler.list_files()
+    else:
+        objects = _list_local_files(upload_folder or LOCAL_UPLOAD_FOLDER)
+
+    orphans = find_orphans(references, objects)
+    if orphans and not dry_run:
+        if storage_handler.should_use_storage():
+            success, error = storage_handler.delete_files(orphans)
+            if not success:
+                raise storage_handler.StorageError(error or "Failed to delete orphaned files")
+        else:
+            folder = upload_folder or LOCAL_UPLOAD_FOLDER
+            for name in orphans:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError as exc:
+                    print(f"Failed to delete local orphan {name}: {exc}")
+    return orphans
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Invoice side-effect outbox maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("drain", help="Process every due outbox entry and exit")
+    subparsers.add_parser("status", help="Show outbox entry counts by status")
+    subparsers.add_parser("retry-failed", help="Re-queue entries that exhausted their retries")
+    reconcile_parser = subparsers.add_parser("reconcile", help="Delete stored files no invoice references")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="Only list orphaned files")
+    args = parser.parse_args()
+
+    if args.command == "drain":
+        print(f"Processed {drain_all()} outbox entries")
+        print(json.dumps(status()))
+    elif args.command == "status":
+        print(json.dumps(status()))
+    elif args.command == "retry-failed":
+        print(f"Re-queued {retry_failed()} failed outbox entries")
+    elif args.command == "reconcile":
+        orphans = reconcile(dry_run=args.dry_run)
+        verb = "Found" if args.dry_run else "Deleted"
+        print(f"{verb} {len(orphans)} orphaned file(s)")
+        for name in orphans:
+            print(f"  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Opt-in request profiling: span breakdowns for slow requests and sampled stack profiles.
+
+Off unless one of these is set:
+
+- ``PROFILE_SLOW_REQUEST_MS``: requests slower than this are logged with the
+  time spent in each span,
+- ``PROFILE_SLOW_QUERY_MS``: SQL statements slower than this are logged with
+  the route that ran them,
+- ``PROFILE_SAMPLE_RATE`` (0-1): this share of requests is also stack sampled
+  every ``PROFILE_INTERVAL_MS``; each sample's stacks are written to
+  ``PROFILE_DIR`` as ``<name>.folded`` (one ``frame;frame;... count`` line per
+  stack, the input of flamegraph.pl, speedscope and inferno) next to a
+  ``<name>.json`` with the spans. Only the newest ``PROFILE_MAX_FILES``
+  profiles are kept.
+
+Spans of a request: ``backend`` (calls into the data backend, i.e. queries plus
+ORM hydration and ``_to_dict``, or the Supabase round trips), ``sql`` (the part
+of ``backend`` spent executing SQL), ``template`` (Jinja rendering including
+filters), ``storage`` (Supabase Storage calls) and ``ocr`` (OCR stages).
+``other`` is whatever is left. When disabled the request hooks return at once
+and the backend is not wrapped.
+
+The current request lives in a ``ContextVar``, so async views keep their
+spans: the context follows them onto asgiref's loop, the shared
+``database_async`` loop and ``asyncio.to_thread`` workers. Calls such a view
+overlaps are each charged in full.
+"""
+
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import metrics
+
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+SLOW_QUERY_MS = float(os.getenv("PROFILE_SLOW_QUERY_MS", "0"))
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "invoice-profiles"))
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+ENABLED = SAMPLE_RATE > 0 or SLOW_REQUEST_MS > 0 or SLOW_QUERY_MS > 0
+
+# Metric histograms whose observations are also request spans
+_METRIC_SPANS = {
+    metrics.OCR_STAGE_SECONDS.name: "ocr",
+    metrics.STORAGE_SECONDS.name: "storage",
+}
+SPAN_ORDER = ("backend", "sql", "template", "storage", "ocr")
+# Spans nested inside another span; not subtracted again for "other"
+NESTED_SPANS = {"sql"}
+
+class _Request:
+    def __init__(self, method: str, route: str) -> None:
+        self.method = method
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = defaultdict(float)
+        self.stacks: Optional[Counter] = None
+        self.template_started: Optional[float] = None
+        # Spans of an async view are charged from several threads at once
+        self.lock = threading.Lock()
+
+    def charge(self, name: str, seconds: float) -> None:
+        with self.lock:
+            self.spans[name] += seconds
+
+
+_request: contextvars.ContextVar[Optional[_Request]] = contextvars.ContextVar("profiling_request", default=None)
+# Set while a backend call is timed, so the calls it makes are not timed again
+_in_backend: contextvars.ContextVar[bool] = contextvars.ContextVar("profiling_in_backend", default=False)
+
+
+def _current() -> Optional[_Request]:
+    return _request.get()
+
+
+def add_span(name: str, seconds: float) -> None:
+    """Charge ``seconds`` to span ``name`` of the request this code runs for."""
+    current = _current()
+    if current is not None:
+        current.charge(name, seconds)
+
+
+# ---------------------------------------------------------------------------
+# Stack sampler
+# ---------------------------------------------------------------------------
+
+class _Sampler(threading.Thread):
+    """One thread per process that samples the stacks of the threads serving sampled requests."""
+
+    def __init__(self) -> None:
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.targets: Dict[int, Counter] = {}
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+
+    def add(self, thread_id: int, stacks: Counter) -> None:
+        with self.lock:
+            self.targets[thread_id] = stacks
+            self.active.set()
+
+    def remove(self, thread_id: int) -> None:
+        with self.lock:
+            self.targets.pop(thread_id, None)
+            if not self.targets:
+                self.active.clear()
+
+    def run(self) -> None:
+        interval = INTERVAL_MS / 1000
+        while True:
+            self.active.wait()
+            time.sleep(interval)
+            with self.lock:
+                targets = list(self.targets.items())
+            frames = sys._current_frames()
+            for thread_id, stacks in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[_fold(frame)] += 1
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+_sampler: Optional[_Sampler] = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler() -> _Sampler:
+    global _sampler
+    with _sampler_lock:
+        # Recreated after a fork: threads do not survive it
+        if _sampler is None or not _sampler.is_alive():
+            _sampler = _Sampler()
+            _sampler.start()
+        return _sampler
+
+
+# ---------------------------------------------------------------------------
+# Flask hooks
+# ---------------------------------------------------------------------------
+
+def start_request() -> None:
+    """Flask ``before_request`` hook."""
+    if not ENABLED:
+        return
+    from flask import request
+
+    current = _Request(request.method, request.url_rule.rule if request.url_rule else "<unmatched>")
+    _request.set(current)
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        current.stacks = Counter()
+        _get_sampler().add(threading.get_ident(), current.stacks)
+
+
+def finish_request(exc: Optional[BaseException] = None) -> None:
+    """Flask ``teardown_request`` hook: logs slow requests and stores sampled profiles."""
+    if not ENABLED:
+        return
+    current = _current()
+    _request.set(None)
+    if current is None:
+        return
+    if current.stacks is not None:
+        _get_sampler().remove(threading.get_ident())
+
+    elapsed_ms = (time.perf_counter() - current.started) * 1000
+    spans = {name: round(current.spans.get(name, 0.0) * 1000, 1) for name in SPAN_ORDER}
+    spans["other"] = round(max(0.0, elapsed_ms - sum(
+        value for name, value in spans.items() if name not in NESTED_SPANS
+    )), 1)
+
+    if SLOW_REQUEST_MS and elapsed_ms >= SLOW_REQUEST_MS:
+        breakdown = " ".join(f"{name}={value:.0f}ms" for name, value in spans.items() if value)
+        print(f"Slow request {current.method} {current.route} {elapsed_ms:.0f}ms: {breakdown}")
+    if current.stacks:
+        _write_profile(current, elapsed_ms, spans)
+
+
+def _write_profile(current: _Request, elapsed_ms: float, spans: Dict[str, float]) -> None:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", current.route).strip("_") or "root"
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{current.method}-{slug}-{elapsed_ms:.0f}ms"
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{name}.folded"), "w", encoding="utf-8") as handle:
+            for stack, count in current.stacks.most_common():
+                handle.write(f"{stack} {count}\n")
+        with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w", encoding="utf-8") as handle:
+            json.dump({
+                "method": current.method,
+                "route": current.route,
+                "duration_ms": round(elapsed_ms, 1),
+                "spans_ms": spans,
+                "samples": sum(current.stacks.values()),
+                "interval_ms": INTERVAL_MS,
+                "pid": os.getpid(),
+            }, handle, indent=2)
+        _prune()
+    except OSError as exc:
+        print(f"Could not write profile {name}: {exc}")
+
+
+def _prune() -> None:
+    profiles = sorted(path for path in os.listdir(PROFILE_DIR) if path.endswith(".folded"))
+    for path in profiles[:max(0, len(profiles) - MAX_FILES)]:
+        for suffix in (".folded", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, path[:-len(".folded")] + suffix))
+            except OSError:
+                pass
+
+
+def _template_started(sender, template, context, **extra) -> None:
+    current = _current()
+    if current is not None:
+        current.template_started = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra) -> None:
+    current = _current()
+    if current is not None and current.template_started is not None:
+        current.charge("template", time.perf_counter() - current.template_started)
+        current.template_started = None
+
+
+def _metric_observed(name: str, seconds: float, labels: Dict[str, Any]) -> None:
+    span = _METRIC_SPANS.get(name)
+    if span:
+        add_span(span, seconds)
+
+
+def init_app(app) -> None:
+    """Register the request hooks and signal handlers; does nothing when profiling is off."""
+    if not ENABLED:
+        return
+    from flask import before_render_template, template_rendered
+
+    app.before_request(start_request)
+    app.teardown_request(finish_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+    metrics.add_observer(_metric_observed)
+
+
+# ---------------------------------------------------------------------------
+# Data backend
+# ---------------------------------------------------------------------------
+
+class _TimedBackend:
+    """Proxy charging every backend method call to the ``backend`` span."""
+
+    def __init__(self, backend: Any) -> None:
+        self._backend = backend
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._backend, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        def timed(*args, **kwargs):
+            current = _current()
+            if current is None or _in_backend.get():
+                return attribute(*args, **kwargs)
+            token = _in_backend.set(True)
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                _in_backend.reset(token)
+                current.charge("backend", time.perf_counter() - started)
+
+        return timed
+
+
+def wrap_backend(backend: Any) -> Any:
+    """``backend`` itself when profiling is off, otherwise a proxy timing its calls."""
+    return _TimedBackend(backend) if ENABLED else backend
+
+
+def instrument_engine(engine) -> None:
+    """Charge SQL execution to the ``sql`` span and log statements over PROFILE_SLOW_QUERY_MS."""
+    if not ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["profiling_query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("profiling_query_started", None)
+        if started is not None:
+            record_query(statement, time.perf_counter() - started)
+
+
+def record_query(statement: str, seconds: float) -> None:
+    """Charge a statement to the ``sql`` span and log it when slower than PROFILE_SLOW_QUERY_MS."""
+    if not ENABLED:
+        return
+    add_span("sql", seconds)
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        current = _current()
+        where = f"{current.method} {current.route}" if current else "outside a request"
+        print(f"Slow query {seconds * 1000:.0f}ms ({where}): {' '.join(statement.split())[:500]}")
@@ -8,6 +8,21 @@ WORKERS=${GUNICORN_WORKERS:-1}
 TIMEOUT=${GUNICORN_TIMEOUT:-120}
 PORT=${PORT:-8000}
 
+# Optional warm OCR workers shared by all Gunicorn workers (see ocr_service.py)
+if [ -n "${OCR_SERVICE_SOCKET}" ]; then
+    echo "Starting OCR service on ${OCR_SERVICE_SOCKET}..."
+    python ocr_service.py serve &
+fi
+
+# GUNICORN_PRELOAD=true imports the app and its heavy modules (PyMuPDF, OpenCV,
+# Supabase) once in the master; workers are forked with them already loaded.
+# Faster worker respawns and shared memory, at the cost of no per-worker reload.
+PRELOAD_ARGS=()
+if [ "${GUNICORN_PRELOAD:-false}" = "true" ]; then
+    export PRELOAD_HEAVY_MODULES=${PRELOAD_HEAVY_MODULES:-true}
+    PRELOAD_ARGS=(--preload)
+fi
+
 echo "Starting Gunicorn with ${WORKERS} worker(s) on port ${PORT}..."
 echo "Timeout: ${TIMEOUT}s"
 
@@ -17,4 +32,5 @@ exec gunicorn \
     --timeout ${TIMEOUT} \
     --access-logfile - \
     --error-logfile - \
+    "${PRELOAD_ARGS[@]}" \
     app:app
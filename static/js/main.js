@@ -35,6 +35,60 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // Bulk selection on the invoice list
+  const selectAll = document.getElementById("bulk-select-all");
+  const bulkCheckboxes = document.querySelectorAll(".bulk-select");
+  const selectedCount = document.getElementById("bulk-selected-count");
+  const updateSelectedCount = () => {
+    if (selectedCount) {
+      selectedCount.textContent = document.querySelectorAll(".bulk-select:checked").length;
+    }
+  };
+  if (selectAll) {
+    selectAll.addEventListener("change", () => {
+      bulkCheckboxes.forEach(checkbox => {
+        checkbox.checked = selectAll.checked;
+      });
+      updateSelectedCount();
+    });
+  }
+  bulkCheckboxes.forEach(checkbox => checkbox.addEventListener("change", updateSelectedCount));
+
+  // Vendor autocomplete on the upload form (responses cached per prefix)
+  const companyInput = document.getElementById("companyName");
+  const vendorOptions = document.getElementById("vendorOptions");
+  if (companyInput && vendorOptions) {
+    const vendorCache = new Map();
+    let vendorTimer = null;
+    const renderVendors = (items) => {
+      vendorOptions.replaceChildren(...items.map(vendor => {
+        const option = document.createElement("option");
+        option.value = vendor.name;
+        return option;
+      }));
+    };
+    companyInput.addEventListener("input", () => {
+      clearTimeout(vendorTimer);
+      const prefix = companyInput.value.trim().toLowerCase();
+      if (vendorCache.has(prefix)) {
+        renderVendors(vendorCache.get(prefix));
+        return;
+      }
+      vendorTimer = setTimeout(async () => {
+        try {
+          const response = await fetch(`/api/vendors?prefix=${encodeURIComponent(prefix)}`);
+          const result = await response.json();
+          if (response.ok && result.success) {
+            vendorCache.set(prefix, result.vendors);
+            renderVendors(result.vendors);
+          }
+        } catch (error) {
+          console.error(error);
+        }
+      }, 150);
+    });
+  }
+
   // Smooth scroll for alerts
   const alerts = document.querySelectorAll(".alert");
   alerts.forEach(alert => {
@@ -117,6 +171,7 @@ document.addEventListener("DOMContentLoaded", () => {
   // OCR functionality
   const fileInput = document.getElementById("invoiceFile");
   const statusBox = document.getElementById("ocr-status");
+  const ocrTokenInput = document.getElementById("ocrToken");
 
   if (!fileInput || !statusBox) {
     return;
@@ -148,6 +203,9 @@ document.addEventListener("DOMContentLoaded", () => {
   };
 
   fileInput.addEventListener("change", async () => {
+    if (ocrTokenInput) {
+      ocrTokenInput.value = "";
+    }
     if (!fileInput.files || fileInput.files.length === 0) {
       hideStatus();
       return;
@@ -184,11 +242,17 @@ document.addEventListener("DOMContentLoaded", () => {
 
       const result = await response.json();
 
+      // Lets the upload post store the recognised text for full-text search
+      if (ocrTokenInput && result && result.ocr_token) {
+        ocrTokenInput.value = result.ocr_token;
+      }
+
       if (!response.ok || !result.success) {
         const message =
           (result && result.message) ||
           "Failed to recognise the invoice. Please fill in the fields manually.";
-        showStatus(message, "danger");
+        const duplicateWarnings = result && Array.isArray(result.warnings) ? result.warnings : [];
+        showStatus([message, ...duplicateWarnings].join(" "), "danger");
         return;
       }
 
@@ -214,12 +278,17 @@ document.addEventListener("DOMContentLoaded", () => {
         }
       });
 
+      // Duplicate-invoice warnings are appended after the field warnings
       const warnings = Array.isArray(result.warnings) ? result.warnings : [];
+      const duplicateCount = Array.isArray(result.duplicates) ? result.duplicates.length : 0;
+      const fieldWarnings = warnings.slice(0, warnings.length - duplicateCount);
+      const duplicateWarnings = warnings.slice(warnings.length - duplicateCount);
       if (warnings.length > 0) {
-        showStatus(
-          `Some details were not detected automatically: ${warnings.join(" ")}`,
-          "warning"
-        );
+        const parts = [...duplicateWarnings];
+        if (fieldWarnings.length > 0) {
+          parts.push(`Some details were not detected automatically: ${fieldWarnings.join(" ")}`);
+        }
+        showStatus(parts.join(" "), "warning");
       } else {
         showStatus("Invoice details populated. Please review before saving.", "success");
       }
@@ -4,16 +4,23 @@ Supabase Storage handler for managing invoice PDF files.
 This module provides functions to:
 - Upload PDF files to Supabase Storage
 - Get public URLs for uploaded files
-- Delete files from storage
+- Download files for background reprocessing
+- Delete files from storage (one at a time or in batches)
+- List bucket contents for orphan reconciliation
 - Automatically create and configure storage buckets
 """
 
 import io
 import os
 from datetime import datetime
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import config
+import metrics
+
+# Supabase Storage accepts up to 1000 paths per remove() call and pages list() results
+DELETE_BATCH_SIZE = 1000
+LIST_PAGE_SIZE = 1000
 
 
 class StorageError(Exception):
@@ -98,6 +105,7 @@ def init_storage_bucket(bucket_name: str = "invoices") -> Tuple[bool, str]:
         return False, f"Failed to initialize bucket: {str(e)}"
 
 
+@metrics.STORAGE_SECONDS.time(operation="upload")
 def upload_file(file_data: bytes, original_filename: str, bucket_name: str = "invoices") -> Tuple[Optional[str], Optional[str]]:
     """
     Upload a file to Supabase Storage.
@@ -166,6 +174,7 @@ def upload_file(file_data: bytes, original_filename: str, bucket_name: str = "in
             return None, f"Upload error: {error_msg}"
 
 
+@metrics.STORAGE_SECONDS.time(operation="public_url")
 def get_public_url(storage_path: str, bucket_name: str = "invoices") -> Optional[str]:
     """
     Get public URL for a file in storage.
@@ -193,6 +202,26 @@ def get_public_url(storage_path: str, bucket_name: str = "invoices") -> Optional
         return None
 
 
+@metrics.STORAGE_SECONDS.time(operation="download")
+def download_file(storage_path: str, bucket_name: str = "invoices") -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Download a file from storage.
+
+    Args:
+        storage_path: Path to file in storage
+        bucket_name: Storage bucket name (default: "invoices")
+
+    Returns:
+        Tuple of (file contents or None, error_message: str or None)
+    """
+    try:
+        client = _get_storage_client()
+        return client.storage.from_(bucket_name).download(storage_path), None
+    except Exception as e:
+        return None, f"Download error: {str(e)}"
+
+
+@metrics.STORAGE_SECONDS.time(operation="delete")
 def delete_file(storage_path: str, bucket_name: str = "invoices") -> Tuple[bool, Optional[str]]:
     """
     Delete a file from storage.
@@ -219,6 +248,78 @@ def delete_file(storage_path: str, bucket_name: str = "invoices") -> Tuple[bool,
         return False, f"Delete error: {str(e)}"
 
 
+@metrics.STORAGE_SECONDS.time(operation="delete_many")
+def delete_files(storage_paths: List[str], bucket_name: str = "invoices") -> Tuple[bool, Optional[str]]:
+    """
+    Delete several files from storage in one request per chunk.
+
+    Supabase ``remove()`` accepts a list of paths, so a batch of N files costs
+    ceil(N / DELETE_BATCH_SIZE) round trips instead of N.
+
+    Args:
+        storage_paths: Paths to files in storage
+        bucket_name: Storage bucket name (default: "invoices")
+
+    Returns:
+        Tuple of (success: bool, error_message: str or None)
+    """
+    paths = [path for path in storage_paths if path]
+    if not paths:
+        return True, None
+
+    try:
+        client = _get_storage_client()
+        bucket = client.storage.from_(bucket_name)
+
+        for start in range(0, len(paths), DELETE_BATCH_SIZE):
+            response = bucket.remove(paths[start:start + DELETE_BATCH_SIZE])
+            if hasattr(response, 'error') and response.error:
+                return False, f"Delete failed: {response.error}"
+
+        return True, None
+
+    except Exception as e:
+        return False, f"Delete error: {str(e)}"
+
+
+@metrics.STORAGE_SECONDS.time(operation="list")
+def list_files(bucket_name: str = "invoices") -> List[Dict[str, Any]]:
+    """
+    List every object stored at the root of a bucket.
+
+    Args:
+        bucket_name: Storage bucket name (default: "invoices")
+
+    Returns:
+        List of object metadata dicts (``name``, ``created_at``, ...).
+
+    Raises:
+        StorageError: If the bucket cannot be listed.
+    """
+    try:
+        client = _get_storage_client()
+        bucket = client.storage.from_(bucket_name)
+
+        objects: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = bucket.list("", {"limit": LIST_PAGE_SIZE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+            if not page:
+                break
+            # Folders are returned with an empty id; uploads are stored flat
+            objects.extend(item for item in page if item.get("id"))
+            if len(page) < LIST_PAGE_SIZE:
+                break
+            offset += LIST_PAGE_SIZE
+
+        return objects
+
+    except StorageError:
+        raise
+    except Exception as e:
+        raise StorageError(f"Failed to list bucket '{bucket_name}': {str(e)}") from e
+
+
 def test_connection() -> Tuple[bool, str]:
     """
     Test Supabase Storage connection.
@@ -245,3 +346,12 @@ def should_use_storage() -> bool:
     use_storage = os.getenv("USE_SUPABASE_STORAGE", "").strip().lower() in ("true", "1", "yes")
     has_credentials = bool(config.SUPABASE_URL and config.SUPABASE_KEY)
     return use_storage and has_credentials
+
+
+def preload_modules() -> None:
+    """Imports the Supabase client library now when Storage is in use (it is otherwise loaded on first use)."""
+    if should_use_storage():
+        try:
+            import supabase  # noqa: F401
+        except ImportError:
+            pass
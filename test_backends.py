@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Backend conformance tests: every data backend must behave the same.
+
+    python -m pytest -q test_backends.py
+
+Runs each test against:
+
+- ``sqlite``: ``SQLiteBackend`` on a fresh database file,
+- ``memory``: ``MemoryBackend``,
+- ``postgres``: ``PostgresBackend`` on a fresh schema of POSTGRES_TEST_URL or,
+  without it, of a throwaway local server started with ``pgserver``
+  (``pip install pgserver``); skipped when neither is available.
+
+The Supabase backend runs the same SQL functions as ``postgres`` behind
+PostgREST and is not covered here.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import database
+
+INVOICE_KEYS = set(database.SUPABASE_LIST_COLUMNS.split(",")) | {
+    "total_amount", "credit", "paid_amount",
+    "invoice_date_display", "payment_date_display", "last_payment_date_display",
+}
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    url = os.getenv("POSTGRES_TEST_URL")
+    if url:
+        return url
+    pgserver = pytest.importorskip("pgserver", reason="set POSTGRES_TEST_URL or install pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pgdata")), cleanup_mode="stop")
+    return server.get_uri()
+
+
+@pytest.fixture(params=["sqlite", "memory", "postgres"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'invoices.db'}")
+        yield database.SQLiteBackend()
+    elif request.param == "memory":
+        yield database.MemoryBackend()
+    else:
+        psycopg = pytest.importorskip("psycopg")
+        url = request.getfixturevalue("postgres_url")
+        with psycopg.connect(url, autocommit=True) as conn:
+            conn.execute("DROP SCHEMA public CASCADE")
+            conn.execute("CREATE SCHEMA public")
+        monkeypatch.setenv("POSTGRES_URL", url)
+        backend = database.PostgresBackend()
+        yield backend
+        backend.pool.close()
+
+
+# ---------------------------------------------------------------------------
+# Invoices
+# ---------------------------------------------------------------------------
+
+def test_implements_protocol(backend):
+    assert isinstance(backend, database.Backend)
+
+
+def test_create_invoice_keeps_every_amount(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice(
+        "INV-1", invoice_date="03/14/2025", total_amount="1,234.56", credit="10", paid_amount="5.25",
+        notes="first", pdf_path="a.pdf",
+    ))
+    assert set(invoice) == INVOICE_KEYS
+    assert invoice["invoice_date"] == "2025-03-14"
+    assert (invoice["total_cents"], invoice["credit_cents"], invoice["paid_cents"]) == (123456, 1000, 525)
+    assert str(invoice["total_amount"]) == "1234.56"
+    assert invoice["payment_status"] == "unpaid"
+    assert (invoice["payment_count"], invoice["last_payment_date"]) == (0, None)
+    assert backend.get_invoice(invoice["id"]) == invoice
+    assert backend.get_invoice(invoice["id"] + 1000) is None
+
+
+def test_listing_is_newest_first_with_filters(backend, make_invoice):
+    first = backend.create_invoice(make_invoice("A-1", invoice_date="2025-01-10"))
+    second = backend.create_invoice(make_invoice("A-2", invoice_date="2025-02-10", company_name="Globex Corporation"))
+    third = backend.create_invoice(make_invoice("B-3", invoice_date="2025-02-10"))
+
+    assert [row["id"] for row in backend.get_invoices()] == [third["id"], second["id"], first["id"]]
+    assert [row["id"] for row in backend.get_invoices(date_from="2025-02-01")] == [third["id"], second["id"]]
+    assert [row["id"] for row in backend.get_invoices(date_to="01/31/2025")] == [first["id"]]
+    assert [row["id"] for row in backend.get_invoices(date_from="2025-02-10", date_to="2025-02-10")] == [
+        third["id"], second["id"],
+    ]
+    assert [row["id"] for row in backend.get_invoices(company_name="globex")] == [second["id"]]
+    assert [row["id"] for row in backend.get_invoices(invoice_number="a-")] == [second["id"], first["id"]]
+    assert [row["id"] for row in backend.get_invoices(vendor_id=first["vendor_id"])] == [third["id"], first["id"]]
+    assert all(set(row) == INVOICE_KEYS for row in backend.get_invoices())
+
+
+def test_search_requires_every_word(backend, make_invoice):
+    widgets = backend.create_invoice(make_invoice("S-1", notes="blue widgets"))
+    both = backend.create_invoice(make_invoice("S-2", notes="blue widgets and bolts"))
+    backend.create_invoice(make_invoice("S-3", notes="red bolts"))
+
+    assert {row["id"] for row in backend.get_invoices(q="widgets")} == {widgets["id"], both["id"]}
+    assert [row["id"] for row in backend.get_invoices(q="Widgets bolts")] == [both["id"]]
+    assert backend.get_invoices(q="widgets", company_name="globex") == []
+    assert backend.get_invoices(q="nothing") == []
+
+
+def test_update_invoice(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("U-1"))
+    updated = backend.update_invoice(invoice["id"], {
+        "invoice_date": "2025-04-01", "invoice_number": "U-2", "company_name": "Globex Corporation",
+        "total_amount": "250.00", "credit": "1.50", "notes": "changed",
+    })
+    assert updated["invoice_number"] == "U-2" and updated["notes"] == "changed"
+    assert (updated["total_cents"], updated["credit_cents"]) == (25000, 150)
+    assert updated["vendor_id"] != invoice["vendor_id"]
+    assert backend.get_invoice(invoice["id"]) == updated
+    assert [row["id"] for row in backend.get_invoices(date_from="2025-04-01")] == [invoice["id"]]
+    assert backend.update_invoice(invoice["id"] + 1000, {"notes": "x"}) is None
+
+
+def test_update_invoice_checks_version(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("O-1"))
+    assert invoice["version"] == 1
+    updated = backend.update_invoice(invoice["id"], {"notes": "first"}, expected_version=1)
+    assert (updated["notes"], updated["version"]) == ("first", 2)
+
+    with pytest.raises(database.VersionConflictError) as conflict:
+        backend.update_invoice(invoice["id"], {"notes": "stale"}, expected_version=1)
+    assert conflict.value.current_version == updated["version"]
+    assert backend.get_invoice(invoice["id"]) == updated
+
+    paid = backend.apply_payment(invoice["id"], 100, "2025-04-01")
+    assert paid["version"] == 3
+    with pytest.raises(database.VersionConflictError):
+        backend.update_invoice(invoice["id"], {"notes": "stale"}, expected_version=updated["version"])
+    with pytest.raises(database.VersionConflictError):
+        backend.apply_payment(invoice["id"], 100, "2025-04-02", credit_cents=50, expected_version=updated["version"])
+    assert backend.get_invoice(invoice["id"]) == paid
+    paid = backend.apply_payment(invoice["id"], 100, "2025-04-02", credit_cents=50, expected_version=3)
+    assert (paid["paid_cents"], paid["credit_cents"], paid["version"]) == (200, 50, 4)
+
+    # Background writes such as OCR text do not invalidate an open edit form
+    assert backend.update_invoice(invoice["id"], {"ocr_text": "scanned"})["version"] == 4
+    assert [row["id"] for row in backend.get_invoices(q="scanned")] == [invoice["id"]]
+    assert backend.update_invoice(invoice["id"], {"notes": "fresh"}, expected_version=4)["version"] == 5
+    paid = backend.get_invoice(invoice["id"])
+    assert backend.update_invoice(invoice["id"], {"version": 1, "payment_count": 9}) == paid
+    assert backend.update_invoice(invoice["id"] + 1000, {"notes": "x"}, expected_version=1) is None
+
+
+def test_concurrent_edits_of_one_version_let_one_win(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("O-2"))
+    barrier = threading.Barrier(8)
+
+    def edit(number):
+        barrier.wait()
+        try:
+            backend.update_invoice(invoice["id"], {"notes": f"edit {number}"}, expected_version=invoice["version"])
+            return number
+        except database.VersionConflictError:
+            return None
+
+    with ThreadPoolExecutor(8) as executor:
+        winners = [number for number in executor.map(edit, range(8)) if number is not None]
+    assert len(winners) == 1
+    assert backend.get_invoice(invoice["id"])["notes"] == f"edit {winners[0]}"
+
+
+def test_delete_invoice(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("D-1"))
+    backend.apply_payment(invoice["id"], 100, "2025-04-01")
+    assert backend.delete_invoice(invoice["id"]) is True
+    assert backend.get_invoice(invoice["id"]) is None
+    assert backend.get_payment_history(invoice["id"]) == []
+    assert backend.delete_invoice(invoice["id"]) is False
+
+
+def test_required_columns_are_enforced(backend, make_invoice):
+    kept = backend.create_invoice(make_invoice("N-1"))
+    with pytest.raises(Exception):
+        backend.create_invoice(make_invoice("N-2", invoice_date=None))
+    with pytest.raises(Exception):
+        backend.import_invoices([make_invoice("N-3"), make_invoice("N-4", invoice_date="")])
+    with pytest.raises(Exception):
+        backend.update_invoice(kept["id"], {"invoice_date": None})
+
+    assert backend.get_invoices(date_to="2025-12-31") == [kept]
+    assert backend.get_invoices() == [kept]
+
+
+def test_import_invoices(backend, make_invoice):
+    count = backend.import_invoices(make_invoice(f"I-{number}", notes="imported") for number in range(25))
+    assert count == 25
+    rows = backend.get_invoices()
+    assert len(rows) == 25 and {row["invoice_number"] for row in rows} == {f"I-{n}" for n in range(25)}
+    assert len({row["vendor_id"] for row in rows}) == 1
+    assert len(backend.get_invoices(q="imported")) == 25
+
+
+# ---------------------------------------------------------------------------
+# Payments
+# ---------------------------------------------------------------------------
+
+def test_apply_payment(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("P-1"))
+    partial = backend.apply_payment(invoice["id"], 4000, "2025-04-01", payment_proof_path="proof.pdf")
+    assert (partial["paid_cents"], partial["payment_status"]) == (4000, "partial")
+    assert (partial["payment_date"], partial["payment_proof_path"]) == ("2025-04-01", "proof.pdf")
+    assert (partial["payment_count"], partial["last_payment_date"]) == (1, "2025-04-01")
+    assert partial["version"] == invoice["version"] + 1
+
+    paid = backend.apply_payment(invoice["id"], 6000, "2025-05-01", credit_cents=250, notes="rest")
+    assert (paid["paid_cents"], paid["payment_status"], paid["credit_cents"]) == (10000, "paid", 250)
+    assert paid["payment_proof_path"] == "proof.pdf"
+    assert (paid["payment_count"], paid["last_payment_date"]) == (2, "2025-05-01")
+    assert paid["version"] == partial["version"] + 1
+
+    with pytest.raises(database.OverpaymentError):
+        backend.apply_payment(invoice["id"], 1, "2025-05-02")
+    assert backend.get_invoice(invoice["id"]) == paid
+    assert backend.apply_payment(invoice["id"] + 1000, 1, "2025-05-02") is None
+
+    history = backend.get_payment_history(invoice["id"])
+    assert [record["amount_cents"] for record in history] == [6000, 4000]
+    assert [record["notes"] for record in history] == ["rest", "Payment of $40.00"]
+    assert str(history[0]["payment_amount"]) == "60.00"
+
+
+def test_concurrent_payments_never_overpay(backend, make_invoice):
+    invoice = backend.create_invoice(make_invoice("P-2", total_amount="10.00"))
+    barrier = threading.Barrier(8)
+
+    def pay(_):
+        barrier.wait()
+        try:
+            backend.apply_payment(invoice["id"], 100, "2025-04-01")
+            return 1
+        except database.OverpaymentError:
+            return 0
+
+    with ThreadPoolExecutor(8) as executor:
+        accepted = sum(executor.map(pay, range(16)))
+    stored = backend.get_invoice(invoice["id"])
+    assert accepted == 10
+    assert (stored["paid_cents"], stored["payment_count"]) == (1000, 10)
+
+
+def test_payment_records_and_history(backend, make_invoice):
+    first = backend.create_invoice(make_invoice("H-1"))
+    second = backend.create_invoice(make_invoice("H-2"))
+    record_id = backend.create_payment_record({
+        "invoice_id": first["id"], "payment_amount": "12.50", "payment_date": "2025-04-01", "notes": "manual",
+    })
+    assert isinstance(record_id, int)
+    backend.create_payment_record({"invoice_id": first["id"], "amount_cents": 100, "payment_date": "2025-04-02"})
+
+    history = backend.get_payment_history(first["id"])
+    assert [record["amount_cents"] for record in history] == [100, 1250]
+    assert history[1]["id"] == record_id and history[1]["notes"] == "manual"
+    assert backend.get_invoice(first["id"])["payment_count"] == 2
+    assert backend.get_payment_history_many([first["id"], second["id"]]) == {first["id"]: history, second["id"]: []}
+
+
+# ---------------------------------------------------------------------------
+# Bulk operations and totals
+# ---------------------------------------------------------------------------
+
+def test_bulk_mark_paid_and_credit(backend, make_invoice):
+    unpaid = backend.create_invoice(make_invoice("B-1", total_amount="1234.50"))
+    partial = backend.create_invoice(make_invoice("B-2"))
+    backend.apply_payment(partial["id"], 2500, "2025-04-01")
+    done = backend.create_invoice(make_invoice("B-3", paid_amount="100.00", payment_status="paid"))
+    ids = [unpaid["id"], partial["id"], done["id"], unpaid["id"]]
+
+    assert backend.bulk_mark_paid(ids, "2025-05-01") == 2
+    for invoice_id, balance in ((unpaid["id"], 123450), (partial["id"], 7500)):
+        invoice = backend.get_invoice(invoice_id)
+        assert (invoice["paid_cents"], invoice["payment_status"]) == (invoice["total_cents"], "paid")
+        assert invoice["payment_date"] == "2025-05-01"
+        record = backend.get_payment_history(invoice_id)[0]
+        assert record["amount_cents"] == balance
+        assert record["notes"] == f"Bulk payment of ${balance // 100}.{balance % 100:02d}"
+    assert backend.get_payment_history(done["id"]) == []
+
+    assert backend.bulk_update_credit([unpaid["id"], done["id"], done["id"] + 1000], 300) == 2
+    assert backend.get_invoice(done["id"])["credit_cents"] == 300
+
+
+def test_concurrent_bulk_mark_paid_pays_each_invoice_once(backend, make_invoice):
+    invoices = [backend.create_invoice(make_invoice(f"BC-{number}")) for number in range(6)]
+    backend.apply_payment(invoices[0]["id"], 2500, "2025-04-01")
+    ids = [invoice["id"] for invoice in invoices]
+    barrier = threading.Barrier(4)
+
+    def mark_paid(offset):
+        barrier.wait()
+        # Overlapping id lists in different orders
+        return backend.bulk_mark_paid(ids[offset:] + ids[:offset], "2025-05-01")
+
+    with ThreadPoolExecutor(4) as executor:
+        assert sum(executor.map(mark_paid, range(4))) == len(ids)
+    for invoice in invoices:
+        current = backend.get_invoice(invoice["id"])
+        history = backend.get_payment_history(invoice["id"])
+        assert (current["paid_cents"], current["payment_count"]) == (10000, len(history))
+        assert sum(record["amount_cents"] for record in history) == 10000
+    assert backend.get_invoice(ids[0])["payment_count"] == 2
+
+
+def test_bulk_delete_returns_released_files(backend, make_invoice):
+    kept = backend.create_invoice(make_invoice("F-1", pdf_path="kept.pdf"))
+    gone = backend.create_invoice(make_invoice("F-2", pdf_path="gone.pdf"))
+    backend.apply_payment(gone["id"], 100, "2025-04-01", payment_proof_path="proof-1.pdf")
+    backend.apply_payment(gone["id"], 100, "2025-04-02", payment_proof_path="proof-2.pdf")
+
+    assert backend.list_file_references() == {"kept.pdf", "gone.pdf", "proof-1.pdf", "proof-2.pdf"}
+    assert set(backend.bulk_delete([gone["id"], gone["id"] + 1000])) == {"gone.pdf", "proof-1.pdf", "proof-2.pdf"}
+    assert backend.get_invoice(gone["id"]) is None
+    assert backend.get_payment_history(gone["id"]) == []
+    assert backend.list_file_references() == {"kept.pdf"}
+    assert backend.get_invoice(kept["id"]) is not None
+
+
+def test_totals(backend, make_invoice):
+    backend.create_invoice(make_invoice("T-1", invoice_date="2025-01-31", total_amount="0.10", credit="0.01"))
+    backend.create_invoice(make_invoice("T-2", invoice_date="2025-02-01", total_amount="0.20", paid_amount="0.05"))
+    backend.create_invoice(make_invoice("T-3", invoice_date="2025-03-01", total_amount="1000000.70"))
+
+    totals = backend.get_totals()
+    assert (totals["invoice_count"], totals["total_cents"], totals["paid_cents"], totals["credit_cents"]) == (
+        3, 100000100, 5, 1,
+    )
+    assert str(totals["total_amount"]) == "1000001.00"
+    february = backend.get_totals("2025-02-01", "2025-02-28")
+    assert (february["invoice_count"], february["total_cents"]) == (1, 20)
+    assert backend.get_totals("2026-01-01")["invoice_count"] == 0
+
+
+# ---------------------------------------------------------------------------
+# Vendors and duplicates
+# ---------------------------------------------------------------------------
+
+def test_vendors(backend, make_invoice):
+    vendor_id = backend.get_or_create_vendor("Acme Industrial Supplies Inc")
+    assert backend.get_or_create_vendor("ACME INDUSTRIAL SUPPLIES, INC.") == vendor_id
+    assert backend.get_or_create_vendor("  ") is None
+    backend.create_invoice(make_invoice("V-1"))
+    backend.create_invoice(make_invoice("V-2", company_name="Globex Corporation"))
+
+    listed = {vendor["name"]: vendor for vendor in backend.list_vendors()}
+    assert set(listed) == {"Acme Industrial Supplies Inc", "Globex Corporation"}
+    assert listed["Acme Industrial Supplies Inc"]["id"] == vendor_id
+    assert listed["Acme Industrial Supplies Inc"]["invoice_count"] == 1
+    assert set(listed["Globex Corporation"]) == {"id", "name", "normalized_key", "invoice_count"}
+
+
+def test_find_duplicates(backend, make_invoice):
+    original = backend.create_invoice(make_invoice("INV-0042", pdf_sha256="abc123"))
+    backend.create_invoice(make_invoice("INV-0043", total_amount="55.00"))
+
+    by_number = backend.find_duplicates({"company_name": "ACME Industrial Supplies", "invoice_number": "inv 0042"})
+    assert [match["id"] for match in by_number] == [original["id"]]
+    assert by_number[0]["reasons"] == ["invoice_number"]
+    assert set(by_number[0]) == INVOICE_KEYS | {"reasons"}
+
+    every_probe = backend.find_duplicates({
+        "company_name": "Acme Industrial Supplies Inc", "invoice_number": "INV-0042",
+        "pdf_sha256": "abc123", "invoice_date": "03/14/2025", "total_amount": "100",
+    })
+    assert [(match["id"], sorted(match["reasons"])) for match in every_probe] == [
+        (original["id"], ["file", "fingerprint", "invoice_number"]),
+    ]
+
+    assert backend.find_duplicates({"pdf_sha256": "abc123"}, exclude_id=original["id"]) == []
+    assert backend.find_duplicates({"company_name": "Unknown Vendor", "invoice_number": "INV-0042"}) == []
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Layout field lookup tests on synthetic pages.
+
+    python -m pytest -q test_layout.py
+
+Pages are built from word tuples shaped like PyMuPDF's
+``page.get_text("words")``, so no PDF (and no PyMuPDF) is needed.
+"""
+
+import layout
+
+
+def _row(y, line, *texts, x=50.0):
+    """Word tuples for one text line at height ``y``, left to right."""
+    words = []
+    for position, text in enumerate(texts):
+        width = 6.0 * len(text)
+        words.append((x, y, x + width, y + 10.0, text, line, 0, position))
+        x += width + 4.0
+    return words
+
+
+class FakePage:
+    def __init__(self, *rows):
+        self.words = [word for row in rows for word in row]
+
+    def get_text(self, kind):
+        assert kind == "words"
+        return self.words
+
+
+def _layout(*pages):
+    return layout.LayoutIndex(list(pages))
+
+
+def test_page_index_finds_phrase_and_neighbours():
+    index = layout.PageIndex(_row(100, 0, "Invoice", "No:", "INV-0042") + _row(120, 1, "ACME-7"))
+
+    ((start, end),) = index.find_phrase("invoice no")
+    assert (start.text, end.text) == ("Invoice", "No:")
+    assert index.previous(end) is start
+    assert [word.text for word in index.right_of(end)] == ["INV-0042"]
+    assert [word.text for word in index.below(start)] == ["ACME-7"]
+
+
+def test_invoice_date_skips_other_dates():
+    page = FakePage(
+        _row(80, 0, "Due", "Date:", "2025-04-30"),
+        _row(100, 1, "Ship", "Date:", "2025-03-20"),
+        _row(120, 2, "Date:", "2025-03-14"),
+    )
+    assert layout.find_invoice_date(_layout(page)) == "2025-03-14"
+
+
+def test_invoice_date_spanning_several_words():
+    page = FakePage(_row(100, 0, "Invoice", "Date", "March", "14,", "2025"))
+    assert layout.find_invoice_date(_layout(page)) == "2025-03-14"
+
+
+def test_total_is_the_bottom_most_occurrence():
+    page = FakePage(
+        _row(200, 0, "Total", "40.00"),
+        _row(400, 1, "Total", "$", "120.50"),
+        _row(300, 2, "Total", "80.50"),
+    )
+    assert layout.find_total_amount(_layout(page)) == 120.50
+
+
+def test_total_label_must_be_followed_by_the_amount():
+    page = FakePage(
+        _row(300, 0, "Total", "251.76"),
+        _row(400, 1, "Total", "Tax", "51.76"),
+    )
+    assert layout.find_total_amount(_layout(page)) == 251.76
+
+
+def test_total_walks_back_past_pages_without_text():
+    pages = [FakePage(_row(300, 0, "Total", "99.00")), FakePage()]
+    assert layout.find_total_amount(_layout(*pages)) == 99.00
+    assert layout.find_total_amount(_layout(FakePage(_row(300, 0, "Total", "Tax", "5.00")))) is None
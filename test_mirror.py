@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Read mirror tests: listings served from a local SQLite copy of the primary.
+
+    python -m pytest -q test_mirror.py
+
+``MemoryBackend`` stands in for Supabase: it stamps ``updated_at`` and keeps
+delete tombstones the same way the Supabase schema does.
+"""
+
+import pytest
+
+import database
+
+
+class CountingRemote(database.MemoryBackend):
+    """Records the ``since`` of every pull; fails pulls while ``down`` is set."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pulls = []
+        self.down = False
+
+    def get_invoice_changes(self, since):
+        if self.down:
+            raise ConnectionError("primary unreachable")
+        self.pulls.append(since)
+        return super().get_invoice_changes(since)
+
+
+@pytest.fixture
+def remote():
+    return CountingRemote()
+
+
+@pytest.fixture
+def mirror_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'mirror.db'}"
+
+
+def _mirror(remote, mirror_url, max_staleness=3600.0):
+    return database.MirroredBackend(remote, database.SQLiteBackend(mirror_url), max_staleness)
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_first_listing_copies_everything(remote, mirror_url, make_invoice):
+    first = remote.create_invoice(make_invoice("M-1", invoice_date="2025-01-10", notes="blue widgets"))
+    second = remote.create_invoice(make_invoice("M-2", company_name="Globex Corporation", ocr_text="bolts"))
+    mirror = _mirror(remote, mirror_url)
+
+    assert mirror.get_invoices() == remote.get_invoices()
+    assert _ids(mirror.get_invoices(q="widgets")) == [first["id"]]
+    assert _ids(mirror.get_invoices(q="bolts")) == [second["id"]]
+    assert _ids(mirror.get_invoices(date_to="2025-02-01")) == [first["id"]]
+    assert _ids(mirror.get_invoices(vendor_id=second["vendor_id"])) == [second["id"]]
+    assert remote.pulls == [None]
+
+
+def test_fresh_mirror_answers_without_pulling(remote, mirror_url, make_invoice):
+    remote.create_invoice(make_invoice("M-1"))
+    mirror = _mirror(remote, mirror_url)
+    mirror.get_invoices()
+
+    behind_its_back = remote.create_invoice(make_invoice("M-2"))
+    assert behind_its_back["id"] not in _ids(mirror.get_invoices())
+    assert len(remote.pulls) == 1
+
+    mirror.sync(force=True)
+    assert behind_its_back["id"] in _ids(mirror.get_invoices())
+    assert remote.pulls[1] is not None
+
+
+def test_zero_staleness_pulls_before_every_listing(remote, mirror_url, make_invoice):
+    mirror = _mirror(remote, mirror_url, max_staleness=0)
+    assert mirror.get_invoices() == []
+    invoice = remote.create_invoice(make_invoice("M-1"))
+    assert _ids(mirror.get_invoices()) == [invoice["id"]]
+    assert len(remote.pulls) == 2
+
+
+def test_writes_go_to_the_primary_and_show_up_in_the_next_listing(remote, mirror_url, make_invoice):
+    mirror = _mirror(remote, mirror_url)
+    invoice = mirror.create_invoice(make_invoice("W-1"))
+    other = mirror.create_invoice(make_invoice("W-2"))
+    assert remote.get_invoice(invoice["id"]) == invoice
+    assert set(_ids(mirror.get_invoices())) == {invoice["id"], other["id"]}
+
+    mirror.update_invoice(invoice["id"], {"notes": "rush order"})
+    assert _ids(mirror.get_invoices(q="rush")) == [invoice["id"]]
+
+    mirror.apply_payment(invoice["id"], 4000, "2025-04-01")
+    [listed] = [row for row in mirror.get_invoices() if row["id"] == invoice["id"]]
+    assert (listed["paid_cents"], listed["payment_status"], listed["payment_count"]) == (4000, "partial", 1)
+
+    mirror.delete_invoice(other["id"])
+    assert _ids(mirror.get_invoices()) == [invoice["id"]]
+    assert mirror.get_invoices() == remote.get_invoices()
+
+
+def test_workers_sharing_the_mirror_see_each_others_writes(remote, mirror_url, make_invoice):
+    worker_a = _mirror(remote, mirror_url)
+    worker_b = _mirror(remote, mirror_url)
+    assert worker_b.get_invoices() == []
+
+    invoice = worker_a.create_invoice(make_invoice("S-1"))
+    assert _ids(worker_b.get_invoices()) == [invoice["id"]]
+    assert _ids(worker_a.get_invoices()) == [invoice["id"]]
+    assert len(remote.pulls) == 2
+
+
+def test_pulls_resume_from_the_stored_watermark(remote, mirror_url, make_invoice):
+    remote.create_invoice(make_invoice("R-1"))
+    _mirror(remote, mirror_url).get_invoices()
+    deleted = remote.create_invoice(make_invoice("R-2"))
+    _mirror(remote, mirror_url, max_staleness=0).get_invoices()
+    remote.delete_invoice(deleted["id"])
+
+    restarted = _mirror(remote, mirror_url, max_staleness=0)
+    assert restarted.get_invoices() == remote.get_invoices()
+    assert remote.pulls[0] is None and all(since is not None for since in remote.pulls[1:])
+
+
+def test_failed_pull_lists_from_the_primary(remote, mirror_url, capsys, make_invoice):
+    mirror = _mirror(remote, mirror_url, max_staleness=0)
+    invoice = remote.create_invoice(make_invoice("F-1"))
+    remote.down = True
+    assert _ids(mirror.get_invoices()) == [invoice["id"]]
+    assert "Read mirror pull failed" in capsys.readouterr().out
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Outbox tests: leasing, retries with backoff and orphan detection.
+
+    python -m pytest -q test_outbox.py
+
+Every test gets its own outbox database under ``tmp_path``; the entries use
+a ``test`` kind whose handler the test controls.
+"""
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+import outbox
+
+KIND = "test"
+
+
+@pytest.fixture(autouse=True)
+def outbox_db(tmp_path, monkeypatch):
+    path = tmp_path / "outbox.db"
+    monkeypatch.setattr(outbox, "OUTBOX_PATH", str(path))
+    monkeypatch.setattr(outbox, "_schema_ready", False)
+    return path
+
+
+@pytest.fixture
+def results(monkeypatch):
+    """Set ``results["success"]`` / ``results["error"]`` to choose what the handler answers."""
+    answer = {"success": False, "error": "storage unavailable", "calls": 0}
+
+    def handle(payloads):
+        answer["calls"] += 1
+        return [(answer["success"], answer["error"])] * len(payloads)
+
+    monkeypatch.setitem(outbox.HANDLERS, KIND, handle)
+    return answer
+
+
+def _rows(path):
+    conn = sqlite3.connect(str(path))
+    try:
+        conn.row_factory = sqlite3.Row
+        return [dict(row) for row in conn.execute("SELECT * FROM outbox ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_claims_never_hand_an_entry_to_two_workers():
+    outbox.enqueue(KIND, [{"n": n} for n in range(40)])
+    claimed = []
+    barrier = threading.Barrier(4)
+
+    def worker():
+        barrier.wait()
+        while True:
+            batch = outbox._claim_batch(3)
+            if not batch:
+                return
+            claimed.extend(entry_id for entry_id, _, _, _ in batch)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == list(range(1, 41))
+    assert outbox._claim_batch(10) == []  # all leased
+
+
+def test_expired_lease_is_claimed_again(outbox_db):
+    outbox.enqueue(KIND, [{"n": 1}])
+    assert len(outbox._claim_batch(10)) == 1
+
+    conn = sqlite3.connect(str(outbox_db))
+    conn.execute("UPDATE outbox SET locked_until = 0")
+    conn.commit()
+    conn.close()
+
+    assert [payload for _, _, payload, _ in outbox._claim_batch(10)] == [{"n": 1}]
+
+
+def test_failure_is_rescheduled_with_backoff(outbox_db, results, monkeypatch):
+    monkeypatch.setattr(outbox.random, "uniform", lambda low, high: high)
+    outbox.enqueue(KIND, [{"n": 1}])
+
+    started = outbox.time.time()
+    assert outbox.drain_once() == 1
+    finished = outbox.time.time()
+
+    (row,) = _rows(outbox_db)
+    assert row["status"] == "pending"
+    assert row["attempts"] == 1
+    assert row["last_error"] == "storage unavailable"
+    assert row["locked_until"] == 0
+    assert started + outbox.BACKOFF_BASE <= row["next_attempt_at"] <= finished + outbox.BACKOFF_BASE
+    assert outbox.drain_once() == 0  # not due yet
+    assert results["calls"] == 1
+
+
+def test_backoff_grows_and_is_capped(monkeypatch):
+    monkeypatch.setattr(outbox.random, "uniform", lambda low, high: high)
+    assert outbox._backoff(1) < outbox._backoff(2) < outbox._backoff(3)
+    assert outbox._backoff(50) == outbox.BACKOFF_MAX
+
+
+def test_entry_fails_after_max_attempts(outbox_db, results, monkeypatch):
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(outbox, "_backoff", lambda attempts: 0.0)
+    outbox.enqueue(KIND, [{"n": 1}])
+
+    assert outbox.drain_all() == 3
+    (row,) = _rows(outbox_db)
+    assert row["status"] == "failed"
+    assert row["attempts"] == 3
+    assert outbox.status() == {"failed": 1}
+    assert outbox.drain_once() == 0
+
+    assert outbox.retry_failed() == 1
+    results["success"] = True
+    assert outbox.drain_all() == 1
+    assert _rows(outbox_db) == []
+
+
+def test_successful_entries_are_removed(outbox_db, results):
+    results["success"] = True
+    outbox.enqueue(KIND, [{"n": n} for n in range(5)])
+    assert outbox.drain_all() == 5
+    assert _rows(outbox_db) == []
+    assert results["calls"] == 1  # one batch
+
+
+def _stamp(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def test_find_orphans_respects_grace_period():
+    now = 1_750_000_000.0
+    cutoff = now - outbox.RECONCILE_GRACE_SECONDS
+    objects = [
+        {"name": "old.pdf", "created_at": _stamp(cutoff - 60)},
+        {"name": "at-cutoff.pdf", "created_at": _stamp(cutoff)},
+        {"name": "fresh.pdf", "created_at": _stamp(cutoff + 60)},
+        {"name": "referenced.pdf", "created_at": _stamp(cutoff - 60)},
+        {"name": "undated.pdf"},
+        {"name": "bad-date.pdf", "created_at": "yesterday"},
+        {"created_at": _stamp(cutoff - 60)},
+    ]
+
+    orphans = outbox.find_orphans(["referenced.pdf"], objects, now=now)
+
+    assert orphans == ["old.pdf", "at-cutoff.pdf", "undated.pdf", "bad-date.pdf"]
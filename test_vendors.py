@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Vendor key and autocomplete index tests.
+
+    python -m pytest -q test_vendors.py
+"""
+
+import pytest
+
+import vendors
+
+
+@pytest.mark.parametrize("name", ["ACME INC", "Acme Inc.", "ACME, INC", "  acme   inc  ", "Acme"])
+def test_spellings_of_one_company_share_a_key(name):
+    assert vendors.normalize_vendor(name) == "acme"
+
+
+def test_ampersand_is_and():
+    assert vendors.normalize_vendor("A&B Ltd") == vendors.normalize_vendor("A and B Ltd") == "a and b"
+    assert vendors.normalize_vendor("Smith & Sons") == "smith and sons"
+
+
+def test_only_trailing_suffixes_are_dropped():
+    assert vendors.normalize_vendor("Inc Consulting LLC") == "inc consulting"
+    assert vendors.normalize_vendor("Co") == "co"  # a name is never normalized away
+    assert vendors.normalize_vendor(None) == ""
+    assert vendors.normalize_vendor("") == ""
+
+
+@pytest.fixture
+def index():
+    return vendors.VendorIndex([
+        {"id": 1, "name": "Acme Industrial Supplies Inc", "invoice_count": 3},
+        {"id": 2, "name": "Industrial Metals & Co", "invoice_count": 7},
+        {"id": 3, "name": "Northwind Traders", "invoice_count": 0},
+    ])
+
+
+def _ids(results):
+    return [vendor["id"] for vendor in results]
+
+
+def test_search_matches_from_any_word(index):
+    assert _ids(index.search("acme")) == [1]
+    assert _ids(index.search("supp")) == [1]
+    assert _ids(index.search("TRADERS")) == [3]
+
+
+def test_search_orders_by_invoice_count(index):
+    assert _ids(index.search("indus")) == [2, 1]
+
+
+def test_search_matches_word_sequences(index):
+    assert _ids(index.search("industrial sup")) == [1]
+    assert _ids(index.search("metals and")) == [2]
+    assert _ids(index.search("metals &")) == [2]
+    assert index.search("acme supplies") == []  # words must be consecutive
+
+
+def test_search_limits_and_misses(index):
+    assert _ids(index.search("i", limit=1)) == [2]
+    assert index.search("zzz") == []
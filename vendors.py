@@ -0,0 +1,107 @@
+"""
+Vendor name normalization and an in-memory prefix index for autocomplete.
+
+"ACME INC", "Acme Inc." and "ACME, INC" all normalize to the key ``acme``,
+which is unique in the ``vendors`` table; invoices point at their vendor by
+``vendor_id``. ``VendorIndex`` is a trie over the words of each vendor name
+whose nodes keep their best matches precomputed, so a lookup costs one walk
+down the prefix.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from companies import COMPANY_SUFFIXES
+
+LEGAL_SUFFIXES = {suffix.rstrip(".") for suffix in COMPANY_SUFFIXES}
+
+# Matches kept per trie node, i.e. the most suggestions a lookup can return
+MAX_SUGGESTIONS = 10
+
+INDEX_TTL_SECONDS = int(os.getenv("VENDOR_INDEX_TTL_SECONDS", "300"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(value: str) -> List[str]:
+    # "&" is kept as "and" so "A&B Ltd" and "A and B Ltd" agree
+    return _WORD_RE.findall((value or "").casefold().replace("&", " and "))
+
+
+def normalize_vendor(name: Optional[str]) -> str:
+    """Return the grouping key for a company name ("" when there is nothing to group on)."""
+    words = _words(name or "")
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.top: List[Dict[str, Any]] = []
+
+
+class VendorIndex:
+    """Prefix index over vendor names; any word of the name can start a match."""
+
+    def __init__(self, vendors: List[Dict[str, Any]]) -> None:
+        self._root = _Node()
+        # Most-used vendors first so each node's top list is already in display order
+        ordered = sorted(vendors, key=lambda v: (-int(v.get("invoice_count") or 0), v["name"].casefold()))
+        for vendor in ordered:
+            entry = {"id": vendor["id"], "name": vendor["name"], "invoice_count": int(vendor.get("invoice_count") or 0)}
+            words = _words(vendor["name"])
+            for start in range(len(words)):
+                self._insert(" ".join(words[start:]), entry)
+
+    def _insert(self, key: str, entry: Dict[str, Any]) -> None:
+        node = self._root
+        self._offer(node, entry)
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+            self._offer(node, entry)
+
+    @staticmethod
+    def _offer(node: _Node, entry: Dict[str, Any]) -> None:
+        if len(node.top) < MAX_SUGGESTIONS and all(item["id"] != entry["id"] for item in node.top):
+            node.top.append(entry)
+
+    def search(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[Dict[str, Any]]:
+        node = self._root
+        for char in " ".join(_words(prefix)):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+
+_index: Optional[VendorIndex] = None
+_index_built_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_index(loader: Callable[[], List[Dict[str, Any]]]) -> VendorIndex:
+    """Return the process-wide index, rebuilding it from ``loader()`` when older than the TTL."""
+    global _index, _index_built_at
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at > INDEX_TTL_SECONDS:
+            metrics.CACHE_MISSES.inc(cache="vendor_index")
+            _index = VendorIndex(loader())
+            _index_built_at = time.monotonic()
+        else:
+            metrics.CACHE_HITS.inc(cache="vendor_index")
+        return _index
+
+
+def invalidate_index() -> None:
+    """Force the next lookup in this process to rebuild (other workers catch up via the TTL)."""
+    global _index
+    with _index_lock:
+        _index = None